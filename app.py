@@ -1,22 +1,52 @@
+import time
+# Marca para medir cuánto tarda la importación del módulo (el arranque de cada worker)
+_IMPORT_STARTED = time.perf_counter()
 import os
 import datetime
+import calendar
 import uuid
 import base64
 import io
 from io import BytesIO
 import csv
-from collections import defaultdict
+import hashlib
+import hmac
+import functools
+import zipfile
+import multiprocessing
+import unicodedata
+import queue
+import json
+import glob
+import fcntl
+import atexit
+import re
+import shutil
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+import threading
+from collections import deque, OrderedDict
 
-from flask import Flask, render_template, request, redirect, url_for, session, g, Response, jsonify, flash
+import click
+import numpy as np
+from flask import Flask, render_template, stream_template, request, redirect, url_for, session, g, Response, jsonify, flash, has_request_context, make_response, send_file
 from werkzeug.security import generate_password_hash, check_password_hash
+from werkzeug.utils import secure_filename
+from werkzeug.datastructures import MIMEAccept
+from werkzeug.http import parse_accept_header, is_resource_modified
 
 # 🚨 CAMBIO CRÍTICO 1: Reemplazar MySQLdb con psycopg2
 # import MySQLdb as mdb
 # import MySQLdb.cursors
 import psycopg2
 import psycopg2.extras # Para usar DictCursor
+import psycopg2.extensions
+import psycopg2.pool
+import psycopg2.errors
 
 import qrcode
+import qrcode.image.svg
+from PIL import Image, ImageDraw, ImageFont
 
 # --- Configuración de Flask ---
 app = Flask(__name__)
@@ -26,12 +56,43 @@ app = Flask(__name__)
 # ⚠️ ALERTA: DEBES REEMPLAZAR TODOS ESTOS MARCADORES DE POSICIÓN ⚠️
 # =========================================================================
 # 🚨 CAMBIO CRÍTICO 2: Adaptar la configuración a PostgreSQL
+# Las variables DB_* permiten apuntar a otra base (p. ej. una local para benchmark.py).
 DB_CONFIG = {
-    'host': 'ep-old-pond-af37t6sb-pooler.c-2.us-west-2.aws.neon.tech',
-    'user': 'neondb_owner',
-    'password': 'npg_lvsqT6A1XZgk',         # <-- ¡REEMPLAZA! Ejemplo: 'root'
-    'database': 'neondb',
-    'sslmode': 'require'
+    'host': os.environ.get('DB_HOST', 'ep-old-pond-af37t6sb-pooler.c-2.us-west-2.aws.neon.tech'),
+    'port': int(os.environ.get('DB_PORT', 5432)),
+    'user': os.environ.get('DB_USER', 'neondb_owner'),
+    'password': os.environ.get('DB_PASSWORD', 'npg_lvsqT6A1XZgk'),         # <-- ¡REEMPLAZA! Ejemplo: 'root'
+    'database': os.environ.get('DB_NAME', 'neondb'),
+    'sslmode': os.environ.get('DB_SSLMODE', 'require'),
+    # Un host caído no debe colgar /readyz ni a los workers indefinidamente
+    'connect_timeout': int(os.environ.get('DB_CONNECT_TIMEOUT', 5)),
+}
+
+# Pool de conexiones por proceso (cada worker de gunicorn tiene el suyo).
+# - min/max: conexiones abiertas al arrancar / tope de conexiones simultáneas.
+# - timeout: segundos máximos esperando una conexión libre antes de fallar.
+# - ping_after: si una conexión estuvo ociosa más de estos segundos, se
+#   verifica con un `SELECT 1` antes de entregarla.
+# - max_idle: las conexiones libres por encima del mínimo se cierran tras
+#   estar ociosas este tiempo.
+DB_POOL_CONFIG = {
+    'minconn': int(os.environ.get('DB_POOL_MIN', 1)),
+    'maxconn': int(os.environ.get('DB_POOL_MAX', 10)),
+    'timeout': float(os.environ.get('DB_POOL_TIMEOUT', 10)),
+    'ping_after': float(os.environ.get('DB_POOL_PING_AFTER', 30)),
+    'max_idle': float(os.environ.get('DB_POOL_MAX_IDLE', 300)),
+}
+
+# Réplica de lectura opcional (cadena de conexión de libpq). Si se define, las
+# vistas de solo lectura (reportes, calendarios, exportaciones, búsqueda) leen
+# de ella; check-in, registro y cambios de cuenta siguen en el primario.
+# - max_lag: segundos de retraso tolerados; con más, se lee del primario.
+# - check_interval: cada cuántos segundos se vuelve a medir el retraso (o a
+#   reintentar una réplica que falló).
+DB_REPLICA_DSN = os.environ.get('DB_REPLICA_DSN')
+DB_REPLICA_CONFIG = {
+    'max_lag': float(os.environ.get('DB_REPLICA_MAX_LAG', 30)),
+    'check_interval': float(os.environ.get('DB_REPLICA_CHECK_INTERVAL', 5)),
 }
 # =========================================================================
 
@@ -57,15 +118,639 @@ def add_security_headers(response):
     return response
 
 
+# --- Métricas (formato de texto de Prometheus) ---
+
+# Cubetas de los histogramas
+METRICS_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+METRICS_QUERY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)
+METRICS_QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+METRICS_SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+# Si se define, /metrics acepta `Authorization: Bearer <token>` (para el scraper) además de la sesión de admin
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
+
+def _escape_label_value(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labelnames, labelvalues, extra=()):
+    pairs = [f'{name}="{_escape_label_value(value)}"' for name, value in zip(labelnames, labelvalues)]
+    pairs.extend(f'{name}="{_escape_label_value(value)}"' for name, value in extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Contador monótono con etiquetas."""
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, *labelvalues, amount=1):
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} counter']
+        with self._lock:
+            for labelvalues, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{_format_labels(self.labelnames, labelvalues)} {_format_number(value)}')
+        return lines
+
+
+class Histogram:
+    """Histograma acumulativo con etiquetas (cubetas `le`, `_sum` y `_count`)."""
+
+    def __init__(self, name, documentation, buckets, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(buckets) + (float('inf'),)
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}  # etiquetas -> [conteos por cubeta, suma, total]
+
+    def observe(self, value, *labelvalues):
+        with self._lock:
+            entry = self._values.get(labelvalues)
+            if entry is None:
+                entry = self._values[labelvalues] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+                    break
+            entry[1] += value
+            entry[2] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            for labelvalues, (counts, total, count) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    labels = _format_labels(self.labelnames, labelvalues, (('le', _format_number(float(bound))),))
+                    lines.append(f'{self.name}_bucket{labels} {cumulative}')
+                labels = _format_labels(self.labelnames, labelvalues)
+                lines.append(f'{self.name}_sum{labels} {_format_number(float(total))}')
+                lines.append(f'{self.name}_count{labels} {count}')
+        return lines
+
+
+HTTP_REQUESTS = Counter('http_requests_total', 'Solicitudes HTTP atendidas.', ('endpoint', 'method', 'status'))
+HTTP_LATENCY = Histogram('http_request_duration_seconds', 'Duración de la solicitud hasta enviar el último byte (incluye el streaming).',
+                         METRICS_LATENCY_BUCKETS, ('endpoint', 'method'))
+HTTP_RESPONSE_SIZE = Histogram('http_response_size_bytes', 'Tamaño del cuerpo de la respuesta.',
+                               METRICS_SIZE_BUCKETS, ('endpoint', 'method'))
+HTTP_DB_QUERIES = Histogram('http_request_db_queries', 'Consultas SQL ejecutadas por solicitud.',
+                            METRICS_QUERY_COUNT_BUCKETS, ('endpoint',))
+HTTP_DB_TIME = Histogram('http_request_db_seconds', 'Tiempo total en consultas SQL por solicitud.',
+                         METRICS_LATENCY_BUCKETS, ('endpoint',))
+DB_QUERY_LATENCY = Histogram('db_query_duration_seconds', 'Duración de cada consulta SQL (execute/copy).',
+                             METRICS_QUERY_BUCKETS, ('operation',))
+DB_ACQUIRE_LATENCY = Histogram('db_pool_acquire_seconds', 'Tiempo para obtener una conexión del pool (espera, ping o conexión nueva).',
+                               METRICS_QUERY_BUCKETS)
+DB_REPLICA_FALLBACKS = Counter('db_replica_fallbacks_total', 'Lecturas enviadas al primario porque la réplica falló o iba retrasada.',
+                               ('reason',))
+JOBS_FINISHED = Counter('jobs_total', 'Trabajos en segundo plano terminados.', ('kind', 'status'))
+PASSWORD_HASH_WAIT = Histogram('password_hash_queue_seconds', 'Espera en la cola del pool de hashing de contraseñas.',
+                               METRICS_LATENCY_BUCKETS, ('operation',))
+PASSWORD_HASH_DURATION = Histogram('password_hash_duration_seconds', 'Tiempo de cómputo del KDF en el pool de hashing.',
+                                   METRICS_LATENCY_BUCKETS, ('operation',))
+PASSWORD_HASH_REJECTED = Counter('password_hash_rejected_total', 'Hashes rechazados por cola llena o timeout.',
+                                 ('operation', 'reason'))
+METRICS = [HTTP_REQUESTS, HTTP_LATENCY, HTTP_RESPONSE_SIZE, HTTP_DB_QUERIES, HTTP_DB_TIME, DB_QUERY_LATENCY, DB_ACQUIRE_LATENCY,
+           DB_REPLICA_FALLBACKS, JOBS_FINISHED, PASSWORD_HASH_WAIT, PASSWORD_HASH_DURATION, PASSWORD_HASH_REJECTED]
+
+
+def record_query(operation, elapsed):
+    """Registra una consulta en el histograma global y en los totales de la solicitud en curso."""
+    DB_QUERY_LATENCY.observe(elapsed, operation)
+    if has_request_context() and '_metrics_start' in g:
+        g._metrics_db_queries += 1
+        g._metrics_db_time += elapsed
+
+
+class MetricsCursorMixin:
+    """Mide execute/executemany/copy_expert de cualquier clase de cursor de psycopg2."""
+
+    def execute(self, query, vars=None):
+        start = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            record_query('execute', time.perf_counter() - start)
+
+    def executemany(self, query, vars_list):
+        start = time.perf_counter()
+        try:
+            return super().executemany(query, vars_list)
+        finally:
+            record_query('executemany', time.perf_counter() - start)
+
+    def copy_expert(self, sql, file, size=8192):
+        start = time.perf_counter()
+        try:
+            return super().copy_expert(sql, file, size)
+        finally:
+            record_query('copy', time.perf_counter() - start)
+
+
+@functools.lru_cache(maxsize=None)
+def instrumented_cursor_class(cursor_factory):
+    """Subclase medida de `cursor_factory` (DictCursor, cursor normal, etc.)."""
+    return type(f'Metrics{cursor_factory.__name__}', (MetricsCursorMixin, cursor_factory), {})
+
+
+class MetricsConnection(psycopg2.extensions.connection):
+    """Conexión cuyos cursores (con o sin cursor_factory) registran sus consultas."""
+
+    def cursor(self, *args, **kwargs):
+        cursor_factory = kwargs.get('cursor_factory') or self.cursor_factory or psycopg2.extensions.cursor
+        kwargs['cursor_factory'] = instrumented_cursor_class(cursor_factory)
+        return super().cursor(*args, **kwargs)
+
+
+class _CountingIterable:
+    """
+    Envuelve el cuerpo de una respuesta en streaming para medir su tamaño y la
+    duración de la solicitud al terminar de enviarlo (o al cerrarse, si el
+    cliente se desconecta antes).
+    """
+
+    def __init__(self, iterable, labels, start):
+        self._iterable = iterable
+        self._labels = labels
+        self._start = start
+        self._size = 0
+        self._finished = False
+
+    def __iter__(self):
+        try:
+            for chunk in self._iterable:
+                # Las plantillas en streaming entregan str; Werkzeug las codifica en UTF-8
+                self._size += len(chunk.encode('utf-8') if isinstance(chunk, str) else chunk)
+                yield chunk
+        finally:
+            self._finish()
+
+    def _finish(self):
+        if self._finished:
+            return
+        self._finished = True
+        HTTP_RESPONSE_SIZE.observe(self._size, *self._labels)
+        if self._start is not None:
+            HTTP_LATENCY.observe(time.perf_counter() - self._start, *self._labels)
+
+    def close(self):
+        try:
+            close = getattr(self._iterable, 'close', None)
+            if close is not None:
+                close()
+        finally:
+            self._finish()
+
+
+def _metrics_labels():
+    return request.endpoint or 'unmatched', request.method
+
+
+@app.before_request
+def start_request_metrics():
+    g._metrics_start = time.perf_counter()
+    g._metrics_db_queries = 0
+    g._metrics_db_time = 0.0
+
+
+@app.after_request
+def record_response_metrics(response):
+    g._metrics_status = response.status_code
+    labels = _metrics_labels()
+    if response.is_streamed:
+        # teardown_request puede correr antes de enviar el cuerpo: la duración
+        # la registra el iterable al terminar
+        response.response = _CountingIterable(response.response, labels, g.get('_metrics_start'))
+        g._metrics_streamed = True
+    else:
+        HTTP_RESPONSE_SIZE.observe(response.calculate_content_length() or 0, *labels)
+    return response
+
+
+@app.teardown_request
+def record_request_metrics(exc=None):
+    """Se ejecuta al cerrar el contexto; la duración de las respuestas en streaming la mide _CountingIterable."""
+    start = g.pop('_metrics_start', None)
+    if start is None:
+        return
+    endpoint, method = _metrics_labels()
+    status = 500 if exc is not None else g.pop('_metrics_status', 500)
+    HTTP_REQUESTS.inc(endpoint, method, str(status))
+    if not g.pop('_metrics_streamed', False):
+        HTTP_LATENCY.observe(time.perf_counter() - start, endpoint, method)
+    HTTP_DB_QUERIES.observe(g._metrics_db_queries, endpoint)
+    HTTP_DB_TIME.observe(g._metrics_db_time, endpoint)
+
+
+def render_metrics():
+    """Texto de exposición de Prometheus con las métricas y el estado del pool de este worker."""
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    lines.append('# HELP app_import_seconds Tiempo que tardó en importarse app.py en este proceso.')
+    lines.append('# TYPE app_import_seconds gauge')
+    lines.append(f'app_import_seconds {APP_IMPORT_SECONDS:.6f}')
+    if _db_pool is not None and _db_pool_pid == os.getpid():
+        pool_stats = _db_pool.stats()
+        lines.append('# HELP db_pool_connections Conexiones del pool por estado.')
+        lines.append('# TYPE db_pool_connections gauge')
+        lines.append(f'db_pool_connections{{state="in_use"}} {pool_stats["in_use"]}')
+        lines.append(f'db_pool_connections{{state="idle"}} {pool_stats["idle"]}')
+        lines.append('# HELP db_pool_waiting Solicitudes esperando una conexión libre.')
+        lines.append('# TYPE db_pool_waiting gauge')
+        lines.append(f'db_pool_waiting {pool_stats["waiting"]}')
+        lines.append('# HELP db_pool_timeouts_total Esperas de conexión que agotaron el timeout.')
+        lines.append('# TYPE db_pool_timeouts_total counter')
+        lines.append(f'db_pool_timeouts_total {pool_stats["timeouts"]}')
+    if _job_runner is not None and _job_runner_pid == os.getpid():
+        job_stats = _job_runner.stats()
+        lines.append('# HELP jobs_in_progress Trabajos en segundo plano de este worker por estado.')
+        lines.append('# TYPE jobs_in_progress gauge')
+        lines.append(f'jobs_in_progress{{state="running"}} {job_stats["running"]}')
+        lines.append(f'jobs_in_progress{{state="queued"}} {job_stats["queued"]}')
+    if _password_hasher is not None and _password_hasher_pid == os.getpid():
+        lines.append('# HELP password_hash_pending Hashes de contraseña en cola o en cálculo en este worker.')
+        lines.append('# TYPE password_hash_pending gauge')
+        lines.append(f'password_hash_pending {_password_hasher.stats()["pending"]}')
+    replica_lag = replica_router.stats()['lag_seconds'] if DB_REPLICA_DSN else None
+    if replica_lag is not None:
+        lines.append('# HELP db_replica_lag_seconds Retraso de la réplica en la última verificación.')
+        lines.append('# TYPE db_replica_lag_seconds gauge')
+        lines.append(f'db_replica_lag_seconds {_format_number(float(replica_lag))}')
+    return '\n'.join(lines) + '\n'
+
+
+# --- Pool de Conexiones a PostgreSQL ---
+
+class ConnectionPool:
+    """
+    Pool de conexiones psycopg2 seguro entre hilos.
+
+    Reutiliza las conexiones abiertas (evitando el handshake TLS y la
+    autenticación en cada solicitud), verifica que sigan vivas al entregarlas
+    y las deja limpias (rollback) al devolverlas. Lleva estadísticas para
+    poder dimensionarlo.
+    """
+
+    def __init__(self, minconn, maxconn, timeout, ping_after, max_idle, **db_config):
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.ping_after = ping_after
+        self.max_idle = max_idle
+        self._db_config = db_config
+
+        self._cond = threading.Condition()
+        self._idle = deque()  # (conexión, momento en que se devolvió)
+        self._size = 0        # Conexiones abiertas (en uso + libres)
+        self._in_use = 0
+        self._waiting = 0
+
+        self._checkouts = 0
+        self._timeouts = 0
+        self._created = 0
+        self._discarded = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+        for _ in range(minconn):
+            conn = self._connect()
+            with self._cond:
+                self._size += 1
+                self._idle.append((conn, time.monotonic()))
+
+    def _connect(self):
+        conn = psycopg2.connect(connection_factory=MetricsConnection, **self._db_config)
+        conn.autocommit = False
+        with self._cond:
+            self._created += 1
+        return conn
+
+    @staticmethod
+    def _close_quietly(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _is_alive(self, conn, returned_at):
+        """Comprueba que la conexión siga utilizable antes de entregarla."""
+        if conn.closed:
+            return False
+        if conn.info.transaction_status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            return False
+        # Solo se hace un viaje al servidor si la conexión estuvo ociosa un buen rato
+        if time.monotonic() - returned_at < self.ping_after:
+            return True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except Exception:
+            return False
+
+    def _reset(self, conn):
+        """Deja la conexión en un estado limpio. Devuelve False si no es reutilizable."""
+        if conn.closed:
+            return False
+        try:
+            status = conn.info.transaction_status
+            if status == psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN:
+                # Se perdió la conexión con el servidor
+                return False
+            if status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                conn.rollback()
+            if conn.autocommit:
+                conn.autocommit = False
+            return True
+        except Exception:
+            return False
+
+    def getconn(self):
+        """Obtiene una conexión, esperando hasta `timeout` segundos si el pool está lleno."""
+        start = time.perf_counter()
+        deadline = start + self.timeout
+        with self._cond:
+            while not self._idle and self._size >= self.maxconn:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    self._timeouts += 1
+                    raise psycopg2.pool.PoolError(
+                        f"Pool de conexiones agotado ({self.maxconn} en uso) tras {self.timeout}s de espera."
+                    )
+                # Solo cuenta como "esperando" quien de verdad se bloquea en la condición
+                self._waiting += 1
+                try:
+                    self._cond.wait(remaining)
+                finally:
+                    self._waiting -= 1
+
+            if self._idle:
+                # LIFO: la conexión devuelta más recientemente es la que menos necesita ping
+                conn, returned_at = self._idle.pop()
+            else:
+                conn, returned_at = None, None
+                self._size += 1  # Reservamos el lugar antes de conectar fuera del lock
+            self._in_use += 1
+
+            waited = time.perf_counter() - start
+            self._checkouts += 1
+            self._wait_total += waited
+            self._wait_max = max(self._wait_max, waited)
+
+        try:
+            if conn is not None and not self._is_alive(conn, returned_at):
+                self._close_quietly(conn)
+                with self._cond:
+                    self._discarded += 1
+                conn = None
+            if conn is None:
+                conn = self._connect()
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+        DB_ACQUIRE_LATENCY.observe(time.perf_counter() - start)
+        return conn
+
+    def putconn(self, conn):
+        """Devuelve una conexión al pool (o la descarta si quedó inservible)."""
+        reusable = self._reset(conn)
+        if not reusable:
+            self._close_quietly(conn)
+
+        expired = []
+        now = time.monotonic()
+        with self._cond:
+            self._in_use -= 1
+            if reusable:
+                self._idle.append((conn, now))
+            else:
+                self._size -= 1
+                self._discarded += 1
+
+            # Cerrar las conexiones libres más antiguas que sobran por encima del mínimo
+            while len(self._idle) > self.minconn and now - self._idle[0][1] > self.max_idle:
+                expired.append(self._idle.popleft()[0])
+                self._size -= 1
+            self._cond.notify()
+
+        for old_conn in expired:
+            self._close_quietly(old_conn)
+
+    def closeall(self):
+        """Cierra todas las conexiones libres del pool."""
+        with self._cond:
+            idle = [conn for conn, _ in self._idle]
+            self._idle.clear()
+            self._size -= len(idle)
+        for conn in idle:
+            self._close_quietly(conn)
+
+    def stats(self):
+        """Estadísticas del pool para dimensionar min/max."""
+        with self._cond:
+            return {
+                'min': self.minconn,
+                'max': self.maxconn,
+                'size': self._size,
+                'idle': len(self._idle),
+                'in_use': self._in_use,
+                'waiting': self._waiting,
+                'checkouts': self._checkouts,
+                'timeouts': self._timeouts,
+                'created': self._created,
+                'discarded': self._discarded,
+                'wait_avg_ms': round(self._wait_total / self._checkouts * 1000, 3) if self._checkouts else 0.0,
+                'wait_max_ms': round(self._wait_max * 1000, 3),
+            }
+
+
+_db_pool = None
+_db_pool_pid = None
+_db_pool_lock = threading.Lock()
+
+def get_pool():
+    """
+    Devuelve el pool del proceso actual, creándolo si es necesario.
+    Se compara el PID para que cada worker de gunicorn (fork) abra sus propias
+    conexiones en lugar de compartir los sockets heredados del proceso maestro.
+    """
+    global _db_pool, _db_pool_pid
+    pid = os.getpid()
+    if _db_pool is None or _db_pool_pid != pid:
+        with _db_pool_lock:
+            if _db_pool is None or _db_pool_pid != pid:
+                _db_pool = ConnectionPool(**DB_POOL_CONFIG, **DB_CONFIG)
+                _db_pool_pid = pid
+    return _db_pool
+
+
+# Retraso de la réplica en segundos. Si ya aplicó todo lo recibido está al día
+# aunque la última transacción sea vieja (primario sin escrituras).
+REPLICA_LAG_SQL = """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+"""
+
+
+class ReplicaRouter:
+    """
+    Entrega conexiones de la réplica de lectura mientras esté disponible y al día.
+
+    El retraso se mide como mucho una vez cada `check_interval` segundos por
+    proceso, aprovechando la conexión que se va a entregar. Si la réplica no
+    responde o va más atrasada que `max_lag`, getconn devuelve None (la
+    lectura va al primario) hasta la siguiente verificación.
+    """
+
+    def __init__(self, dsn, max_lag, check_interval):
+        self.dsn = dsn
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._pool = None
+        self._pool_pid = None
+        self._next_check = 0.0
+        self._usable = False
+        self._reason = 'unchecked'
+        self._lag = None
+        self._checked_at = None
+
+    def pool(self):
+        """Pool de la réplica del proceso actual (por PID, igual que get_pool)."""
+        pid = os.getpid()
+        with self._lock:
+            if self._pool is None or self._pool_pid != pid:
+                self._pool = ConnectionPool(
+                    **DB_POOL_CONFIG, dsn=self.dsn, connect_timeout=DB_CONFIG['connect_timeout']
+                )
+                self._pool_pid = pid
+            return self._pool
+
+    def _fallback(self, reason):
+        DB_REPLICA_FALLBACKS.inc(reason)
+        return None
+
+    def _mark(self, usable, reason, lag=None):
+        with self._lock:
+            self._usable = usable
+            self._reason = reason
+            self._lag = lag
+            self._checked_at = datetime.datetime.now()
+
+    def getconn(self):
+        """Conexión a la réplica, o None si hay que leer del primario."""
+        now = time.monotonic()
+        with self._lock:
+            check = now >= self._next_check
+            if check:
+                # Un solo hilo verifica; los demás usan el último resultado
+                self._next_check = now + self.check_interval
+            elif not self._usable:
+                return self._fallback(self._reason)
+
+        try:
+            # El pool abre `minconn` conexiones al crearse: también puede fallar
+            pool = self.pool()
+            conn = pool.getconn()
+        except Exception as e:
+            print(f"Réplica de lectura no disponible: {e}")
+            self._mark(False, 'unavailable')
+            return self._fallback('unavailable')
+        if not check:
+            return conn
+
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(REPLICA_LAG_SQL)
+                lag = float(cursor.fetchone()[0])
+            conn.rollback()
+        except Exception as e:
+            print(f"Error al medir el retraso de la réplica: {e}")
+            pool.putconn(conn)
+            self._mark(False, 'unavailable')
+            return self._fallback('unavailable')
+        if lag > self.max_lag:
+            pool.putconn(conn)
+            self._mark(False, 'lagging', lag)
+            return self._fallback('lagging')
+        self._mark(True, None, lag)
+        return conn
+
+    def putconn(self, conn):
+        self.pool().putconn(conn)
+
+    def stats(self):
+        with self._lock:
+            stats = {
+                'usable': self._usable,
+                'reason': self._reason,
+                'lag_seconds': round(self._lag, 3) if self._lag is not None else None,
+                'max_lag_seconds': self.max_lag,
+                'checked_at': self._checked_at.isoformat() if self._checked_at else None,
+            }
+            pool = self._pool if self._pool_pid == os.getpid() else None
+        if pool is not None:
+            stats['pool'] = pool.stats()
+        return stats
+
+
+replica_router = ReplicaRouter(DB_REPLICA_DSN, **DB_REPLICA_CONFIG)
+
+
+def getconn_read_only():
+    """
+    Conexión propia (fuera de `g`) para lecturas que duran más que la vista,
+    como el streaming: (conexión, función para devolverla). Réplica si se puede.
+    """
+    if DB_REPLICA_DSN:
+        conn = replica_router.getconn()
+        if conn is not None:
+            return conn, replica_router.putconn
+    pool = get_pool()
+    return pool.getconn(), pool.putconn
+
+
 # --- Funciones de Conexión a la Base de Datos ---
 
-def get_db():
-    """Establece la conexión a PostgreSQL y la almacena en el objeto 'g' de Flask."""
+def get_db(read_only=False):
+    """
+    Obtiene una conexión del pool de PostgreSQL y la almacena en el objeto 'g' de Flask.
+    Con read_only=True usa la réplica de lectura si está configurada, disponible
+    y al día; si no, la misma conexión al primario.
+    """
+    if read_only and DB_REPLICA_DSN:
+        if 'db_replica' not in g:
+            g.db_replica = replica_router.getconn()
+        if g.db_replica is not None:
+            return g.db_replica
     if 'db' not in g:
         try:
-            # 🚨 CAMBIO 3: Conexión con psycopg2
-            g.db = psycopg2.connect(**DB_CONFIG)
-            g.db.autocommit = False
+            g.db = get_pool().getconn()
         except Exception as e:
             print(f"Error al conectar con PostgreSQL: {e}")
             raise e
@@ -73,15 +758,28 @@ def get_db():
 
 @app.teardown_appcontext
 def close_db(e=None):
-    """Cierra la conexión a PostgreSQL al finalizar la solicitud."""
+    """Devuelve la conexión al pool al finalizar la solicitud (con rollback si quedó algo pendiente)."""
     db = g.pop('db', None)
     if db is not None:
-        db.close()
+        get_pool().putconn(db)
+    replica = g.pop('db_replica', None)
+    if replica is not None:
+        replica_router.putconn(replica)
 
 # --- Función para Generar QR ---
 
-def generate_qr_code(data):
-    """Genera un código QR y lo devuelve como imagen base64."""
+# Tamaño de la caché LRU de imágenes QR ya renderizadas (por proceso)
+QR_CACHE_SIZE = int(os.environ.get('QR_CACHE_SIZE', 1024))
+# Cambiar este valor invalida los ETag si cambia la forma de renderizar
+QR_RENDER_VERSION = 1
+QR_IMAGE_FORMATS = {
+    'png': 'image/png',
+    'svg': 'image/svg+xml',
+}
+
+
+def make_qr(data):
+    """Construye la matriz del código QR para `data`."""
     qr = qrcode.QRCode(
         version=1,
         error_correction=qrcode.constants.ERROR_CORRECT_L,
@@ -90,300 +788,1269 @@ def generate_qr_code(data):
     )
     qr.add_data(data)
     qr.make(fit=True)
+    return qr
 
-    img = qr.make_image(fill_color="black", back_color="white")
-    
-    # Convertir la imagen a un stream de bytes y luego a base64
+
+def render_qr_png(data):
+    """Renderiza el código QR como bytes PNG."""
+    img = make_qr(data).make_image(fill_color="black", back_color="white")
     buffer = BytesIO()
     img.save(buffer, format="PNG")
-    img_str = base64.b64encode(buffer.getvalue()).decode()
+    return buffer.getvalue()
+
+
+def render_qr_svg(data):
+    """Renderiza el código QR como bytes SVG (vectorial, sin Pillow)."""
+    return make_qr(data).make_image(image_factory=qrcode.image.svg.SvgPathImage).to_string()
+
+
+@functools.lru_cache(maxsize=QR_CACHE_SIZE)
+def render_qr_image(data, fmt):
+    """Renderiza (y memoriza) la imagen QR de `data` en el formato pedido ('png' o 'svg')."""
+    if fmt == 'svg':
+        return render_qr_svg(data)
+    return render_qr_png(data)
+
+
+def qr_image_etag(data, fmt):
+    """ETag fuerte derivado del contenido del QR: permite responder 304 sin renderizar."""
+    return hashlib.sha1(f"{QR_RENDER_VERSION}:{fmt}:{data}".encode()).hexdigest()
+
+
+def generate_qr_code(data):
+    """Genera un código QR y lo devuelve como imagen base64."""
+    img_str = base64.b64encode(render_qr_image(data, 'png')).decode()
     return f"data:image/png;base64,{img_str}"
 
-# --- Función Helper: Genera el HTML de la respuesta (BYPASS TemplateNotFound) ---
-def build_checkin_response(message, status, full_name=None):
-    """Genera el HTML de la página de resultado de check-in directamente en Python."""
-    
-    # Mapeo de estado a título y clase CSS
-    status_map = {
-        'success': ('¡Registro Exitoso! ✅', 'success'),
-        'warning': ('Asistencia Registrada Hoy ⚠️', 'warning'),
-        'error': ('Error al Registrar ❌', 'error')
-    }
-    title, css_class = status_map.get(status, ('Error Desconocido', 'error'))
-
-    # Define el HTML para mostrar el nombre
-    user_name_html = ""
-    if full_name:
-        user_name_html = f'<span class="user-name">{full_name}</span>'
-
-    # Define el CSS para estilizar el nombre
-    name_style = """
-        .user-name {
-            font-weight: bold;
-            font-size: 1.2em;
-            display: block;
-            margin-bottom: 15px;
-            color: #2c3e50;
-        }
-    """
-
-    html_content = f"""
-<!DOCTYPE html>
-<html lang="es">
-<head>
-    <meta charset="UTF-8">
-    <title>Resultado de Asistencia</title>
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <style>
-        {name_style}
-        body {{
-            font-family: 'Inter', Arial, sans-serif;
-            background-color: #f4f4f4;
-            display: flex;
-            justify-content: center;
-            align-items: center;
-            min-height: 100vh;
-            margin: 0;
-            text-align: center;
-        }}
-        .container {{
-            background-color: #fff;
-            padding: 40px;
-            border-radius: 10px;
-            box-shadow: 0 4px 15px rgba(0, 0, 0, 0.2);
-            max-width: 400px;
-            width: 90%;
-        }}
-        .message-box {{
-            padding: 25px;
-            border-radius: 8px;
-            margin-bottom: 20px;
-        }}
-        .success {{ background-color: #d4edda; color: #155724; border: 1px solid #c3e6cb; }}
-        .warning {{ background-color: #fffff0; color: #856404; border: 1px solid #ffeeba; }}
-        .error {{ background-color: #f8d7da; color: #721c24; border: 1px solid #f5c6cb; }}
-        
-        h2 {{
-            margin-top: 0;
-            font-size: 1.5em;
-        }}
-        p {{
-            font-size: 1.1em;
-            line-height: 1.4;
-        }}
-    </style>
-</head>
-<body>
-    <div class="container">
-        <div class="message-box {css_class}">
-            <h2>{title}</h2>
-            {user_name_html}
-            <p>{message}</p>
-        </div>
-        <p>Proceso completado.</p>
-    </div>
-</body>
-</html>
-    """
-    return Response(html_content, mimetype='text/html')
+# --- Generación Masiva de Gafetes ---
 
+# Cómo arrancan los procesos de los pools (gafetes y contraseñas). No se usa
+# 'fork': los pools se crean desde hilos (workers con hilos, trabajos en segundo
+# plano) y el hijo heredaría locks tomados por otros hilos en ese momento (pool
+# de conexiones, logging) sin nadie que los libere. 'forkserver' crea los
+# procesos desde un servidor de un solo hilo que ya importó este módulo.
+PROCESS_POOL_START_METHOD = os.environ.get('PROCESS_POOL_START_METHOD', 'forkserver')
+PROCESS_POOL_CONTEXT = multiprocessing.get_context(PROCESS_POOL_START_METHOD)
+if PROCESS_POOL_START_METHOD == 'forkserver':
+    PROCESS_POOL_CONTEXT.set_forkserver_preload([__name__])
+
+# Procesos para renderizar gafetes en paralelo y tamaño de lote por tarea
+BADGE_WORKERS = int(os.environ.get('BADGE_WORKERS', os.cpu_count() or 1))
+BADGE_CHUNKSIZE = int(os.environ.get('BADGE_CHUNKSIZE', 16))
+# Máximo de gafetes de la descarga directa; más que eso se genera como trabajo
+BADGE_SYNC_MAX_USERS = int(os.environ.get('BADGE_SYNC_MAX_USERS', 200))
+BADGE_CAPTION_HEIGHT = 60
+# Fuente TrueType para el nombre (p. ej. DejaVuSans.ttf). La fuente integrada de
+# Pillow no tiene tildes ni eñes, así que sin ella el nombre se imprime sin acentos.
+BADGE_FONT_PATH = os.environ.get('BADGE_FONT_PATH', 'DejaVuSans.ttf')
 
-# --- Inicialización de DB y Creación de Tablas ---
 
-def init_db():
-    """Crea las tablas, asegura las columnas necesarias y el usuario administrador si no existen."""
-    db = None
+@functools.lru_cache(maxsize=1)
+def _badge_font():
+    """Devuelve (fuente, soporta_acentos)."""
     try:
-        db = get_db()
-        # 🚨 CAMBIO 4: Usar DictCursor de psycopg2 para cursores que devuelvan diccionarios
-        cursor = db.cursor(cursor_factory=psycopg2.extras.DictCursor)
+        return ImageFont.truetype(BADGE_FONT_PATH, 18), True
+    except OSError:
+        return ImageFont.load_default(size=18), False
 
-        # 1. Crear Tabla de Usuarios (con nuevos campos)
-        # 🚨 CAMBIO 5: Sintaxis de PostgreSQL (SERIAL, UUID, TEXT en lugar de VARCHAR(80), etc.)
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                id SERIAL PRIMARY KEY,
-                username VARCHAR(80) UNIQUE NOT NULL,
-                password VARCHAR(255) NOT NULL,
-                is_admin BOOLEAN NOT NULL DEFAULT FALSE,
-                qr_code_uuid UUID UNIQUE NULL, 
-                first_name VARCHAR(100) NULL,           
-                paternal_last_name VARCHAR(100) NULL,   
-                maternal_last_name VARCHAR(100) NULL,   
-                gender CHAR(1) NULL,                    
-                phone_number VARCHAR(20) NULL           
-            );
-        ''')
-        
-        # ⚠️ Verificación de columnas (En PostgreSQL se hace diferente o se asume la creación inicial)
-        # Para simplificar la migración y evitar dependencias de INFORMATION_SCHEMA,
-        # confiamos en que CREATE TABLE IF NOT EXISTS maneja las columnas
-        # y eliminamos el bloque de ALTER TABLE de MySQL.
 
-        
-        # 2. Crear Tabla de Asistencias 
-        # 🚨 CAMBIO 6: Sintaxis de PostgreSQL (SERIAL, TIMESTAMP, REFERENCES)
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS attendance (
-                id SERIAL PRIMARY KEY,
-                user_id INT NOT NULL,
-                check_in_time TIMESTAMP WITHOUT TIME ZONE DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users (id)
-            );
-        ''')
+def render_badge_png(item):
+    """
+    Renderiza un gafete imprimible (PNG): el QR de check-in con el nombre debajo.
+    Recibe una tupla (URL de check-in, leyenda) para poder usarse con un pool de procesos.
+    """
+    checkin_url, caption = item
+    qr_img = make_qr(checkin_url).make_image(fill_color="black", back_color="white").get_image().convert('L')
 
-        # 3. Agregar Usuario Administrador Inicial 
-        admin_password_hash = generate_password_hash('adminpass')
-        
-        # 🚨 CAMBIO 7: Usar `WHERE username = %s` (psycopg2 usa %s)
-        cursor.execute("SELECT id FROM users WHERE username = %s", ('admin',))
-        admin_user = cursor.fetchone()  
+    badge = Image.new('L', (qr_img.width, qr_img.height + BADGE_CAPTION_HEIGHT), color=255)
+    badge.paste(qr_img, (0, 0))
+    draw = ImageDraw.Draw(badge)
+    font, supports_accents = _badge_font()
+    if not supports_accents:
+        caption = unicodedata.normalize('NFKD', caption).encode('ascii', 'ignore').decode()
+    left, top, right, bottom = draw.textbbox((0, 0), caption, font=font)
+    draw.text(
+        ((badge.width - (right - left)) / 2, qr_img.height + (BADGE_CAPTION_HEIGHT - (bottom - top)) / 2 - top),
+        caption, fill=0, font=font
+    )
 
-        if admin_user is None:
-            # Insertar admin con valores nulos/vacíos para los nuevos campos
-            # 🚨 CAMBIO 8: Usar UUID para el UUID. Generar uno si es necesario para el admin, aunque aquí se usa NULL.
-            # Se usa `NULL` para el UUID.
-            cursor.execute(
-                """
-                INSERT INTO users (username, password, is_admin, qr_code_uuid, first_name, paternal_last_name, maternal_last_name, gender, phone_number) 
-                VALUES (%s, %s, %s, NULL, %s, %s, %s, %s, %s)
-                """,
-                ('admin', admin_password_hash, True, 'Admin', 'User', 'System', 'O', '000000000')
+    buffer = BytesIO()
+    badge.save(buffer, format="PNG", optimize=False)
+    return buffer.getvalue()
+
+
+class _ZipStreamBuffer(io.RawIOBase):
+    """Destino no posicionable para zipfile: acumula lo escrito hasta que se vacía con drain()."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def iter_badge_zip(badges, workers=BADGE_WORKERS, stats=None):
+    """
+    Genera en streaming un ZIP con un PNG por gafete. `badges` es una lista de
+    (nombre de archivo, URL de check-in, leyenda). El renderizado se reparte en
+    un pool de procesos; al final se agregan un manifiesto y un resumen con el
+    rendimiento (gafetes/s), que también se deja en `stats` si se pasa un dict.
+    """
+    buffer = _ZipStreamBuffer()
+    start = time.perf_counter()
+    count = 0
+    executor = ProcessPoolExecutor(max_workers=max(1, workers), mp_context=PROCESS_POOL_CONTEXT)
+    try:
+        # ZIP_STORED: los PNG ya están comprimidos
+        with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_STORED) as archive:
+            rendered = executor.map(
+                render_badge_png,
+                [(checkin_url, caption) for _, checkin_url, caption in badges],
+                chunksize=BADGE_CHUNKSIZE
             )
-            db.commit()  
-            print("Usuario 'admin' creado con éxito en PostgreSQL.")
-        else:
-            print("El usuario 'admin' ya existe.")
-            
-    except Exception as e:
-        print(f"Error en init_db: {e}")
-        if db is not None:
-            db.rollback() 
-            
+            for (filename, _, _), png in zip(badges, rendered):
+                archive.writestr(filename, png)
+                count += 1
+                yield buffer.drain()
+
+            elapsed = time.perf_counter() - start
+            rate = count / elapsed if elapsed else 0.0
+
+            manifest = io.StringIO()
+            writer = csv.writer(manifest)
+            writer.writerow(["Archivo", "Nombre", "URL de Check-in"])
+            for filename, checkin_url, caption in badges:
+                writer.writerow([filename, caption, checkin_url])
+            archive.writestr('manifiesto.csv', manifest.getvalue())
+            archive.writestr(
+                'resumen.txt',
+                f"Gafetes: {count}\nTiempo: {elapsed:.2f} s\nRendimiento: {rate:.1f} gafetes/s\n"
+            )
+        yield buffer.drain()
+
+        print(f"Gafetes generados: {count} en {elapsed:.2f}s ({rate:.1f} gafetes/s)")
+        if stats is not None:
+            stats.update({'count': count, 'seconds': elapsed, 'rate': rate})
     finally:
-        pass
+        executor.shutdown(wait=False, cancel_futures=True)
 
-# Inicializar la base de datos al arrancar
-with app.app_context():
-    init_db()
 
-# --- Rutas de la Aplicación (Lógica Web) ---
+def fetch_badge_users(db, search_term=None, user_ids=None, limit=None):
+    """Usuarios (no admin, con UUID) para los gafetes, opcionalmente filtrados por texto o IDs y hasta `limit`."""
+    conditions = ["is_admin = FALSE", "qr_code_uuid IS NOT NULL"]
+    params = []
+    if search_term:
+        # Mismo texto normalizado e índice de trigramas que la búsqueda de usuarios
+        conditions.append("search_text LIKE '%%' || fold_search_text(%s) || '%%'")
+        params.append(escape_like(search_term))
+    if user_ids:
+        conditions.append("id = ANY(%s)")
+        params.append(list(user_ids))
+    limit_sql = ""
+    if limit is not None:
+        limit_sql = "LIMIT %s"
+        params.append(limit)
 
-@app.route('/')
-def index():
-    """Página principal. Redirecciona al login, al admin dashboard, o al QR del usuario."""
-    if 'user_id' not in session:
-        return redirect(url_for('login'))
-    
-    if session.get('is_admin'):
-        return redirect(url_for('admin_dashboard'))
-    
-    # Usuario normal es redirigido directamente a su QR
-    return redirect(url_for('show_qr'))
+    cursor = db.cursor(cursor_factory=psycopg2.extras.DictCursor)
+    cursor.execute(
+        f"""
+        SELECT id, first_name, paternal_last_name, maternal_last_name, qr_code_uuid
+        FROM users
+        WHERE {' AND '.join(conditions)}
+        ORDER BY paternal_last_name, maternal_last_name, first_name
+        {limit_sql}
+        """,
+        params
+    )
+    users = cursor.fetchall()
+    cursor.close()
+    return users
 
 
-# --- Rutas de Administración ---
+def build_badge_list(users):
+    """(nombre de archivo, URL de check-in, leyenda) por usuario. Requiere contexto de solicitud."""
+    badges = []
+    for user in users:
+        caption = f"{user['paternal_last_name'] or ''} {user['maternal_last_name'] or ''}, {user['first_name'] or ''}".strip()
+        filename = secure_filename(f"{user['paternal_last_name']}_{user['maternal_last_name']}_{user['first_name']}_{user['id']}.png")
+        badges.append((filename, build_checkin_url(str(user['qr_code_uuid'])), caption))
+    return badges
 
-@app.route('/admin')
-def admin_dashboard():
-    """Dashboard principal para el administrador."""
-    if not session.get('is_admin'):
-        return "Acceso denegado.", 403
 
-    # Nota: Requiere que 'admin_dashboard.html' exista.
-    return render_template('admin_dashboard.html')
+# --- Respuesta de Check-in (plantilla precompilada, BYPASS TemplateNotFound) ---
 
+# Título y clase CSS por estado
+CHECKIN_STATUS_MAP = {
+    'success': ('¡Registro Exitoso! ✅', 'success'),
+    'warning': ('Asistencia Registrada Hoy ⚠️', 'warning'),
+    'error': ('Error al Registrar ❌', 'error')
+}
+CHECKIN_UNKNOWN_STATUS = ('Error Desconocido', 'error')
+# Respuestas ya generadas que se conservan (los escaneos repetidos del día producen el mismo texto)
+CHECKIN_RESPONSE_CACHE_SIZE = int(os.environ.get('CHECKIN_RESPONSE_CACHE_SIZE', 4096))
 
-@app.route('/admin/attendance')
-def admin_attendance_report():
-    """Muestra el reporte completo de asistencias, agrupado por día, con separación de string en Python."""
-    if not session.get('is_admin'):
-        return "Acceso denegado.", 403
+# Se compila una sola vez al importar; el entorno de Flask escapa automáticamente
+# las plantillas creadas con from_string, así que nombre y mensaje llegan escapados.
+CHECKIN_RESPONSE_TEMPLATE = app.jinja_env.from_string("""<!DOCTYPE html>
+<html lang="es">
+<head>
+<meta charset="UTF-8">
+<title>Resultado de Asistencia</title>
+<meta name="viewport" content="width=device-width, initial-scale=1.0">
+<style>
+.user-name{font-weight:bold;font-size:1.2em;display:block;margin-bottom:15px;color:#2c3e50}
+body{font-family:'Inter',Arial,sans-serif;background-color:#f4f4f4;display:flex;justify-content:center;align-items:center;min-height:100vh;margin:0;text-align:center}
+.container{background-color:#fff;padding:40px;border-radius:10px;box-shadow:0 4px 15px rgba(0,0,0,0.2);max-width:400px;width:90%}
+.message-box{padding:25px;border-radius:8px;margin-bottom:20px}
+.success{background-color:#d4edda;color:#155724;border:1px solid #c3e6cb}
+.warning{background-color:#fffff0;color:#856404;border:1px solid #ffeeba}
+.error{background-color:#f8d7da;color:#721c24;border:1px solid #f5c6cb}
+h2{margin-top:0;font-size:1.5em}
+p{font-size:1.1em;line-height:1.4}
+</style>
+</head>
+<body>
+<div class="container">
+<div class="message-box {{ css_class }}">
+<h2>{{ title }}</h2>
+{% if full_name %}<span class="user-name">{{ full_name }}</span>{% endif %}
+<p>{{ message }}</p>
+</div>
+<p>Proceso completado.</p>
+</div>
+</body>
+</html>
+""")
 
-    db = get_db()
-    # 🚨 CAMBIO 9: Usar DictCursor para los fetchall
-    cursor = db.cursor(cursor_factory=psycopg2.extras.DictCursor)
 
-    # Seleccionamos los campos de nombre, apellido y phone_number
-    cursor.execute("""
-        SELECT 
-            u.first_name,
-            u.paternal_last_name,
-            u.maternal_last_name,
-            u.phone_number,
-            a.check_in_time 
-        FROM attendance a
-        JOIN users u ON a.user_id = u.id
-        ORDER BY a.check_in_time DESC
-    """)
-    all_attendances = cursor.fetchall()
+@functools.lru_cache(maxsize=CHECKIN_RESPONSE_CACHE_SIZE)
+def render_checkin_page(message, status, full_name=None):
+    """HTML del resultado de check-in, ya codificado (cacheado por mensaje, estado y nombre)."""
+    title, css_class = CHECKIN_STATUS_MAP.get(status, CHECKIN_UNKNOWN_STATUS)
+    return CHECKIN_RESPONSE_TEMPLATE.render(
+        title=title, css_class=css_class, message=message, full_name=full_name
+    ).encode('utf-8')
 
-    attendances_by_day = defaultdict(list)
-    
-    for record in all_attendances:
-        
-        # Formatear el nombre completo: APELLIDO PATERNO, APELLIDO MATERNO, NOMBRES
-        # Nota: La estructura del diccionario es la misma con DictCursor
-        full_name = f"{record['paternal_last_name']} {record['maternal_last_name']}, {record['first_name']}"
-        
-        # Procesamiento de fecha y hora (check_in_time es un objeto datetime en Python)
-        time_data_dt = record['check_in_time'] # Es un objeto datetime
-        
-        date_key = time_data_dt.strftime('%Y-%m-%d')
-        time_str = time_data_dt.strftime('%H:%M:%S')
 
-        if not date_key:
-            continue
+@functools.lru_cache(maxsize=CHECKIN_RESPONSE_CACHE_SIZE)
+def render_checkin_json(message, status, full_name=None):
+    """Variante compacta para escáneres/kioscos: {"status", "message", "name"}."""
+    if status not in CHECKIN_STATUS_MAP:
+        status = CHECKIN_UNKNOWN_STATUS[1]
+    payload = {"status": status, "message": message, "name": full_name}
+    return json.dumps(payload, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
 
-        attendances_by_day[date_key].append({
-            'full_name': full_name,  # Usamos el nombre completo aquí
-            'time': time_str,
-            'phone_number': record.get('phone_number') 
-        })
-        
-    # Nota: Requiere que 'admin_attendance.html' exista.
-    return render_template('admin_attendance.html', attendances_by_day=attendances_by_day)
 
+@functools.lru_cache(maxsize=256)
+def prefers_json(accept_header):
+    """True si el Accept pide JSON explícitamente (un navegador o '*/*' reciben HTML)."""
+    accept_mimetypes = parse_accept_header(accept_header, MIMEAccept)
+    return accept_mimetypes.best_match(('text/html', 'application/json')) == 'application/json'
 
-@app.route('/admin/attendance/individual', methods=['GET', 'POST'])
-def admin_individual_report():
+
+def build_checkin_response(message, status, full_name=None, accept_header=None):
     """
-    Permite buscar un usuario por nombre/apellido/teléfono y muestra un calendario.
+    Respuesta del resultado de check-in: HTML o JSON según el encabezado Accept.
+    Fuera de una solicitud de Flask (asgi.py) se pasa `accept_header` explícitamente.
     """
-    if not session.get('is_admin'):
-        return "Acceso denegado.", 403
+    if accept_header is None and has_request_context():
+        accept_header = request.headers.get('Accept')
+    if accept_header and prefers_json(accept_header):
+        response = Response(render_checkin_json(message, status, full_name), mimetype='application/json')
+    else:
+        response = Response(render_checkin_page(message, status, full_name), mimetype='text/html')
+    response.headers['Vary'] = 'Accept'
+    return response
 
-    db = get_db()
-    # 🚨 CAMBIO 10: Usar DictCursor
-    cursor = db.cursor(cursor_factory=psycopg2.extras.DictCursor)
-    search_results = None
-    user_data_for_calendar = None 
-    total_attendance_count = 0 # <-- NUEVA VARIABLE: Inicializada a 0
-    
-    # 🚨 CAMBIO 11: Usar int() para forzar la conversión de user_id
-    user_id_to_display = request.args.get('user_id') 
 
-    if request.method == 'POST':
-        search_term = request.form.get('search_term', '').strip()
-        if search_term:
-            # Búsqueda usando LIKE para encontrar coincidencias parciales
-            search_query = f"%{search_term}%"
+# --- Migración en Línea de attendance a Particiones Mensuales ---
+
+# attendance particionada por mes. La llave es check_in_date (no check_in_time)
+# porque toda restricción única debe incluirla y la de un registro por usuario
+# y día es (user_id, check_in_date); el CHECK la mantiene igual a
+# check_in_time::DATE, así que los rangos mensuales coinciden.
+# La partición por defecto recibe lo que llegue a un mes aún sin partición;
+# ensure_attendance_partition la vacía al crear ese mes.
+
+# Filas por transacción al copiar attendance a la tabla particionada
+ATTENDANCE_PARTITION_BATCH_SIZE = int(os.environ.get('ATTENDANCE_PARTITION_BATCH_SIZE', 5000))
+# Espera máxima por los locks de la migración antes de ceder y reintentar
+ATTENDANCE_PARTITION_LOCK_TIMEOUT = os.environ.get('ATTENDANCE_PARTITION_LOCK_TIMEOUT', '2s')
+ATTENDANCE_PARTITION_LOCK_ATTEMPTS = int(os.environ.get('ATTENDANCE_PARTITION_LOCK_ATTEMPTS', 10))
+
+ATTENDANCE_PARTITION_PREPARE_SQL = """
+    CREATE TABLE attendance_partitioned (
+        id INT NOT NULL DEFAULT nextval('attendance_id_seq'),
+        user_id INT NOT NULL,
+        check_in_time TIMESTAMP WITHOUT TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        check_in_date DATE NOT NULL DEFAULT CURRENT_DATE,
+        CONSTRAINT attendance_check_in_date_matches CHECK (check_in_date = check_in_time::DATE)
+    ) PARTITION BY RANGE (check_in_date);
+
+    -- MIN/MAX por check_in_time (indexado) para no recorrer la tabla bajo el lock;
+    -- su fecha es check_in_date por el CHECK
+    DO $$
+    DECLARE
+        month DATE;
+    BEGIN
+        FOR month IN
+            SELECT generate_series(
+                date_trunc('month', COALESCE((SELECT MIN(check_in_time) FROM attendance)::DATE, CURRENT_DATE)),
+                date_trunc('month', GREATEST((SELECT MAX(check_in_time) FROM attendance)::DATE, CURRENT_DATE)),
+                INTERVAL '1 month'
+            )::DATE
+        LOOP
+            EXECUTE format(
+                'CREATE TABLE %I PARTITION OF attendance_partitioned FOR VALUES FROM (%L) TO (%L)',
+                'attendance_' || to_char(month, 'YYYY_MM'), month, (month + INTERVAL '1 month')::DATE
+            );
+        END LOOP;
+    END;
+    $$;
+    CREATE TABLE attendance_default PARTITION OF attendance_partitioned DEFAULT;
+
+    -- Índices y restricciones desde el inicio (tabla vacía): la copia y la doble
+    -- escritura los usan para ON CONFLICT y el intercambio no tiene que construirlos
+    ALTER TABLE attendance_partitioned
+        ADD CONSTRAINT attendance_partitioned_pkey PRIMARY KEY (id, check_in_date);
+    ALTER TABLE attendance_partitioned
+        ADD CONSTRAINT attendance_partitioned_user_day_unique UNIQUE (user_id, check_in_date);
+    ALTER TABLE attendance_partitioned
+        ADD CONSTRAINT attendance_partitioned_user_id_fkey FOREIGN KEY (user_id) REFERENCES users (id);
+    CREATE INDEX idx_attendance_partitioned_user_time ON attendance_partitioned (user_id, check_in_time);
+    CREATE INDEX idx_attendance_partitioned_time ON attendance_partitioned (check_in_time);
+
+    -- Doble escritura: todo cambio en attendance se replica en la tabla nueva
+    CREATE FUNCTION attendance_partitioned_sync() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP IN ('UPDATE', 'DELETE') THEN
+            DELETE FROM attendance_partitioned WHERE id = OLD.id AND check_in_date = OLD.check_in_date;
+        END IF;
+        IF TG_OP IN ('INSERT', 'UPDATE') THEN
+            INSERT INTO attendance_partitioned (id, user_id, check_in_time, check_in_date)
+            VALUES (NEW.id, NEW.user_id, NEW.check_in_time, NEW.check_in_date)
+            ON CONFLICT DO NOTHING;
+        END IF;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+    CREATE TRIGGER attendance_partitioned_sync
+        AFTER INSERT OR UPDATE OR DELETE ON attendance
+        FOR EACH ROW EXECUTE FUNCTION attendance_partitioned_sync();
+"""
+
+# Copia un lote de filas existentes por id. FOR SHARE impide que un DELETE
+# concurrente se cuele entre la lectura y el commit del lote (la doble
+# escritura no vería la fila copiada y quedaría huérfana en la tabla nueva).
+ATTENDANCE_PARTITION_COPY_SQL = """
+    WITH batch AS (
+        SELECT id, user_id, check_in_time, check_in_date
+        FROM attendance
+        WHERE id > %s AND id <= %s
+        ORDER BY id
+        LIMIT %s
+        FOR SHARE
+    ), copied AS (
+        INSERT INTO attendance_partitioned (id, user_id, check_in_time, check_in_date)
+        SELECT id, user_id, check_in_time, check_in_date FROM batch
+        ON CONFLICT DO NOTHING
+    )
+    SELECT MAX(id) FROM batch
+"""
+
+ATTENDANCE_PARTITION_SWAP_SQL = """
+    -- Intercambio: la secuencia de ids pasa a la tabla nueva antes de borrar la anterior
+    ALTER SEQUENCE attendance_id_seq OWNED BY NONE;
+    DROP TABLE attendance;
+    DROP FUNCTION attendance_partitioned_sync();
+    ALTER TABLE attendance_partitioned RENAME TO attendance;
+    ALTER SEQUENCE attendance_id_seq OWNED BY attendance.id;
+    ALTER TABLE attendance RENAME CONSTRAINT attendance_partitioned_pkey TO attendance_pkey;
+    ALTER TABLE attendance RENAME CONSTRAINT attendance_partitioned_user_day_unique TO attendance_user_day_unique;
+    ALTER TABLE attendance RENAME CONSTRAINT attendance_partitioned_user_id_fkey TO attendance_user_id_fkey;
+    ALTER INDEX idx_attendance_partitioned_user_time RENAME TO idx_attendance_user_time;
+    ALTER INDEX idx_attendance_partitioned_time RENAME TO idx_attendance_time;
+
+    -- Los triggers del resumen diario se borraron con la tabla anterior
+    CREATE TRIGGER attendance_daily_insert
+        AFTER INSERT ON attendance
+        REFERENCING NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION attendance_daily_on_insert();
+    CREATE TRIGGER attendance_daily_delete
+        AFTER DELETE ON attendance
+        REFERENCING OLD TABLE AS old_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION attendance_daily_on_delete();
+
+    -- Filtra por la llave de partición para leer solo los meses del rango
+    CREATE OR REPLACE FUNCTION refresh_attendance_daily(from_day DATE, to_day DATE)
+    RETURNS void AS $$
+        DELETE FROM attendance_daily WHERE day >= from_day AND day < to_day;
+        INSERT INTO attendance_daily (day, attendee_count, first_check_in, last_check_in)
+        SELECT check_in_date, COUNT(*), MIN(check_in_time), MAX(check_in_time)
+        FROM attendance
+        WHERE check_in_date >= from_day AND check_in_date < to_day
+        GROUP BY check_in_date;
+    $$ LANGUAGE sql;
+
+    -- Crea (si falta) la partición del mes de `month`, moviendo antes las filas
+    -- de ese mes que hayan caído en la partición por defecto. Se crea como tabla
+    -- suelta y se adjunta: ATTACH no bloquea lecturas ni escrituras en attendance.
+    CREATE OR REPLACE FUNCTION ensure_attendance_partition(month DATE) RETURNS BOOLEAN AS $$
+    DECLARE
+        from_day DATE := date_trunc('month', month)::DATE;
+        to_day DATE := (date_trunc('month', month) + INTERVAL '1 month')::DATE;
+        partition_name TEXT := 'attendance_' || to_char(month, 'YYYY_MM');
+    BEGIN
+        IF to_regclass(partition_name) IS NOT NULL THEN
+            RETURN FALSE;
+        END IF;
+        EXECUTE format(
+            'CREATE TABLE %I (LIKE attendance INCLUDING DEFAULTS INCLUDING CONSTRAINTS)', partition_name
+        );
+        -- Con el CHECK del rango, ATTACH no necesita recorrer la tabla para validarla
+        EXECUTE format(
+            'ALTER TABLE %I ADD CONSTRAINT %I CHECK (check_in_date >= %L AND check_in_date < %L)',
+            partition_name, partition_name || '_range', from_day, to_day
+        );
+        EXECUTE format(
+            'WITH moved AS (DELETE FROM attendance_default WHERE check_in_date >= %L AND check_in_date < %L RETURNING *) '
+            'INSERT INTO %I SELECT * FROM moved',
+            from_day, to_day, partition_name
+        );
+        EXECUTE format(
+            'ALTER TABLE attendance ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+            partition_name, from_day, to_day
+        );
+        EXECUTE format('ALTER TABLE %I DROP CONSTRAINT %I', partition_name, partition_name || '_range');
+        RETURN TRUE;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    CREATE OR REPLACE FUNCTION ensure_attendance_partitions(from_day DATE, to_day DATE) RETURNS INT AS $$
+        SELECT COUNT(*)::INT
+        FROM generate_series(date_trunc('month', from_day), to_day, INTERVAL '1 month') AS m
+        WHERE ensure_attendance_partition(m::DATE);
+    $$ LANGUAGE sql;
+"""
+
+
+def _lock_attendance(db, mode):
+    """
+    Toma `mode` sobre attendance dentro de la transacción actual con un
+    lock_timeout corto, reintentando: mientras espera un lock fuerte, Postgres
+    encola detrás a los check-ins, así que es mejor ceder y volver a intentar.
+    """
+    for attempt in range(1, ATTENDANCE_PARTITION_LOCK_ATTEMPTS + 1):
+        try:
+            with db.cursor() as cursor:
+                cursor.execute("SELECT set_config('lock_timeout', %s, true)", (ATTENDANCE_PARTITION_LOCK_TIMEOUT,))
+                cursor.execute(f"LOCK TABLE attendance IN {mode} MODE")
+            return
+        except psycopg2.errors.LockNotAvailable:
+            db.rollback()
+            if attempt == ATTENDANCE_PARTITION_LOCK_ATTEMPTS:
+                raise
+            print(f"attendance ocupada; reintento {attempt} de {ATTENDANCE_PARTITION_LOCK_ATTEMPTS} del lock {mode}.")
+            time.sleep(attempt)
+
+
+def migrate_attendance_to_partitions(db):
+    """
+    Migración 8 en línea. Pasos, cada uno en su propia transacción:
+
+    1. Crea attendance_partitioned (particiones, índices) y el trigger de doble
+       escritura. Solo toma un lock breve para crear el trigger.
+    2. Copia las filas existentes en lotes por id; los check-ins siguen
+       escribiéndose en attendance y el trigger los replica.
+    3. Intercambio: con ACCESS EXCLUSIVE (lo único que bloquea escrituras, y
+       solo por unos cambios de catálogo) borra la tabla anterior y renombra
+       la nueva. Esta última transacción queda abierta para que
+       apply_migrations registre la versión en el mismo commit.
+
+    Si se interrumpe, al volver a correr retoma: el paso 1 ya hecho se salta y
+    la copia es idempotente (ON CONFLICT DO NOTHING).
+    """
+    with db.cursor() as cursor:
+        cursor.execute("SELECT to_regclass('attendance_partitioned') IS NOT NULL")
+        prepared = cursor.fetchone()[0]
+    db.commit()
+    if not prepared:
+        # CREATE TRIGGER espera a las escrituras en curso; al confirmar, toda fila
+        # nueva pasa por la doble escritura y las anteriores ya son visibles
+        _lock_attendance(db, 'SHARE ROW EXCLUSIVE')
+        with db.cursor() as cursor:
+            cursor.execute(ATTENDANCE_PARTITION_PREPARE_SQL)
+        db.commit()
+
+    # Basta copiar hasta el id más alto de ahora: lo posterior llegó por el trigger
+    with db.cursor() as cursor:
+        cursor.execute("SELECT COALESCE(MAX(id), 0) FROM attendance")
+        last_id = cursor.fetchone()[0]
+    db.commit()
+    copied_up_to = 0
+    while True:
+        with db.cursor() as cursor:
+            cursor.execute(ATTENDANCE_PARTITION_COPY_SQL, (copied_up_to, last_id, ATTENDANCE_PARTITION_BATCH_SIZE))
+            batch_last_id = cursor.fetchone()[0]
+        db.commit()
+        if batch_last_id is None:
+            break
+        copied_up_to = batch_last_id
+        print(f"attendance: copiadas las filas hasta el id {copied_up_to} de {last_id}.")
+
+    _lock_attendance(db, 'ACCESS EXCLUSIVE')
+    with db.cursor() as cursor:
+        cursor.execute(ATTENDANCE_PARTITION_SWAP_SQL)
+
+
+# --- Migraciones Versionadas del Esquema ---
+
+# Cada migración es (versión, descripción, SQL). Las versiones aplicadas se
+# registran en `schema_migrations`; nunca se edita una migración ya publicada,
+# se agrega una nueva al final. En lugar del SQL puede ir una función que
+# recibe la conexión, para migraciones largas que confirman por pasos: debe
+# dejar abierta su última transacción, que se confirma junto con el registro.
+MIGRATIONS = [
+    (1, 'Crear tabla users', """
+        CREATE TABLE IF NOT EXISTS users (
+            id SERIAL PRIMARY KEY,
+            username VARCHAR(80) UNIQUE NOT NULL,
+            password VARCHAR(255) NOT NULL,
+            is_admin BOOLEAN NOT NULL DEFAULT FALSE,
+            qr_code_uuid UUID UNIQUE NULL,
+            first_name VARCHAR(100) NULL,
+            paternal_last_name VARCHAR(100) NULL,
+            maternal_last_name VARCHAR(100) NULL,
+            gender CHAR(1) NULL,
+            phone_number VARCHAR(20) NULL
+        );
+    """),
+    (2, 'Crear tabla attendance', """
+        CREATE TABLE IF NOT EXISTS attendance (
+            id SERIAL PRIMARY KEY,
+            user_id INT NOT NULL,
+            check_in_time TIMESTAMP WITHOUT TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        );
+    """),
+    # Sirve a check_in (usuario + día), al calendario y al CSV individual
+    # (usuario + rango del mes) y al COUNT(*) histórico por usuario (index-only scan).
+    (3, 'Índice attendance (user_id, check_in_time)', """
+        CREATE INDEX IF NOT EXISTS idx_attendance_user_time
+            ON attendance (user_id, check_in_time);
+    """),
+    # Sirve a los "días activos del sistema" del mes y al reporte general por rango.
+    (4, 'Índice attendance (check_in_time)', """
+        CREATE INDEX IF NOT EXISTS idx_attendance_time
+            ON attendance (check_in_time);
+    """),
+    # Una asistencia por usuario y día, garantizada por la base de datos.
+    # check_in_date es una columna normal (no una expresión) para que pueda ser
+    # destino de ON CONFLICT; el CHECK la mantiene igual a check_in_time::DATE.
+    # Si existían duplicados (escaneos simultáneos), se conserva el primero del día.
+    (5, 'Restricción única de asistencia por usuario y día', """
+        ALTER TABLE attendance ADD COLUMN IF NOT EXISTS check_in_date DATE;
+        UPDATE attendance SET check_in_date = check_in_time::DATE WHERE check_in_date IS NULL;
+        DELETE FROM attendance a
+        USING attendance b
+        WHERE a.user_id = b.user_id
+          AND a.check_in_date = b.check_in_date
+          AND (a.check_in_time, a.id) > (b.check_in_time, b.id);
+        ALTER TABLE attendance ALTER COLUMN check_in_time SET NOT NULL;
+        ALTER TABLE attendance ALTER COLUMN check_in_date SET DEFAULT CURRENT_DATE;
+        ALTER TABLE attendance ALTER COLUMN check_in_date SET NOT NULL;
+        ALTER TABLE attendance ADD CONSTRAINT attendance_check_in_date_matches
+            CHECK (check_in_date = check_in_time::DATE);
+        ALTER TABLE attendance ADD CONSTRAINT attendance_user_day_unique
+            UNIQUE (user_id, check_in_date);
+    """),
+    # Resumen diario (día -> asistentes, primer y último check-in) mantenido de
+    # forma incremental por triggers de sentencia: un INSERT de N filas hace un
+    # solo upsert por día. Gracias a la restricción única, COUNT(*) ya es el
+    # número de asistentes distintos. Los DELETE recalculan los días afectados.
+    (6, 'Tabla de resumen diario attendance_daily', """
+        CREATE TABLE IF NOT EXISTS attendance_daily (
+            day DATE PRIMARY KEY,
+            attendee_count INT NOT NULL,
+            first_check_in TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+            last_check_in TIMESTAMP WITHOUT TIME ZONE NOT NULL
+        );
+
+        CREATE OR REPLACE FUNCTION refresh_attendance_daily(from_day DATE, to_day DATE)
+        RETURNS void AS $$
+            DELETE FROM attendance_daily WHERE day >= from_day AND day < to_day;
+            INSERT INTO attendance_daily (day, attendee_count, first_check_in, last_check_in)
+            SELECT check_in_date, COUNT(*), MIN(check_in_time), MAX(check_in_time)
+            FROM attendance
+            WHERE check_in_time >= from_day AND check_in_time < to_day
+            GROUP BY check_in_date;
+        $$ LANGUAGE sql;
+
+        CREATE OR REPLACE FUNCTION attendance_daily_on_insert() RETURNS trigger AS $$
+        BEGIN
+            INSERT INTO attendance_daily AS d (day, attendee_count, first_check_in, last_check_in)
+            SELECT check_in_date, COUNT(*), MIN(check_in_time), MAX(check_in_time)
+            FROM new_rows
+            GROUP BY check_in_date
+            ON CONFLICT (day) DO UPDATE SET
+                attendee_count = d.attendee_count + EXCLUDED.attendee_count,
+                first_check_in = LEAST(d.first_check_in, EXCLUDED.first_check_in),
+                last_check_in = GREATEST(d.last_check_in, EXCLUDED.last_check_in);
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+
+        CREATE OR REPLACE FUNCTION attendance_daily_on_delete() RETURNS trigger AS $$
+        DECLARE
+            affected DATE;
+        BEGIN
+            FOR affected IN SELECT DISTINCT check_in_date FROM old_rows LOOP
+                PERFORM refresh_attendance_daily(affected, affected + 1);
+            END LOOP;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+
+        DROP TRIGGER IF EXISTS attendance_daily_insert ON attendance;
+        CREATE TRIGGER attendance_daily_insert
+            AFTER INSERT ON attendance
+            REFERENCING NEW TABLE AS new_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION attendance_daily_on_insert();
+
+        DROP TRIGGER IF EXISTS attendance_daily_delete ON attendance;
+        CREATE TRIGGER attendance_daily_delete
+            AFTER DELETE ON attendance
+            REFERENCING OLD TABLE AS old_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION attendance_daily_on_delete();
+
+        SELECT refresh_attendance_daily('-infinity'::DATE, 'infinity'::DATE);
+    """),
+    # Búsqueda de usuarios: texto normalizado (minúsculas, sin acentos) con
+    # nombre, apellidos y teléfono, calculado por PostgreSQL e indexado por
+    # trigramas para servir LIKE '%término%' y la similitud por palabra.
+    (7, 'Búsqueda de usuarios por trigramas (search_text)', """
+        CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+        CREATE OR REPLACE FUNCTION fold_search_text(value TEXT) RETURNS TEXT
+        LANGUAGE sql IMMUTABLE PARALLEL SAFE AS $$
+            SELECT lower(translate(value,
+                'ÁÀÄÂÃÉÈËÊÍÌÏÎÓÒÖÔÕÚÙÜÛÑÇáàäâãéèëêíìïîóòöôõúùüûñç',
+                'AAAAAEEEEIIIIOOOOOUUUUNCaaaaaeeeeiiiiooooouuuunc'))
+        $$;
+
+        ALTER TABLE users ADD COLUMN IF NOT EXISTS search_text TEXT GENERATED ALWAYS AS (
+            fold_search_text(
+                coalesce(first_name, '') || ' ' ||
+                coalesce(paternal_last_name, '') || ' ' ||
+                coalesce(maternal_last_name, '') || ' ' ||
+                coalesce(phone_number, '')
+            )
+        ) STORED;
+
+        CREATE INDEX IF NOT EXISTS idx_users_search_text_trgm
+            ON users USING gin (search_text gin_trgm_ops);
+    """),
+    # Ver "Migración en Línea de attendance a Particiones Mensuales": copia por
+    # lotes con doble escritura y un intercambio final breve.
+    (8, 'Particionar attendance por mes (check_in_date)', migrate_attendance_to_partitions),
+]
+
+# Clave arbitraria para pg_advisory_lock: evita que dos workers migren a la vez
+MIGRATIONS_LOCK_KEY = 72390011
+
+# Meses de attendance que se mantienen particionados por adelantado (además del actual)
+ATTENDANCE_PARTITIONS_AHEAD = int(os.environ.get('ATTENDANCE_PARTITIONS_AHEAD', 3))
+
+
+def _ensure_migrations_table(db):
+    with db.cursor() as cursor:
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version INT PRIMARY KEY,
+                description TEXT NOT NULL,
+                applied_at TIMESTAMP WITHOUT TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP
+            );
+        """)
+    db.commit()
+
+
+def get_pending_migrations(db):
+    """Devuelve las migraciones (versión, descripción, SQL) que aún no se aplicaron, en orden."""
+    _ensure_migrations_table(db)
+    with db.cursor() as cursor:
+        cursor.execute("SELECT version FROM schema_migrations")
+        applied = {row[0] for row in cursor.fetchall()}
+    db.commit()
+    return [migration for migration in MIGRATIONS if migration[0] not in applied]
+
+
+def apply_migrations(db):
+    """
+    Aplica en orden las migraciones pendientes, cada una en su propia transacción
+    (o, si es una función, su última transacción) junto con su registro en
+    `schema_migrations`. Devuelve las versiones aplicadas.
+    """
+    with db.cursor() as cursor:
+        cursor.execute("SELECT pg_advisory_lock(%s)", (MIGRATIONS_LOCK_KEY,))
+    db.commit()
+    applied = []
+    try:
+        # Se consulta después de tomar el lock por si otro worker acaba de migrar
+        for version, description, sql in get_pending_migrations(db):
+            try:
+                with db.cursor() as cursor:
+                    if callable(sql):
+                        sql(db)
+                    else:
+                        cursor.execute(sql)
+                    cursor.execute(
+                        "INSERT INTO schema_migrations (version, description) VALUES (%s, %s)",
+                        (version, description)
+                    )
+                db.commit()
+            except Exception:
+                db.rollback()
+                raise
+            applied.append(version)
+            print(f"Migración {version} aplicada: {description}")
+    finally:
+        db.rollback()  # Por si la transacción quedó abortada antes de liberar el lock
+        with db.cursor() as cursor:
+            cursor.execute("SELECT pg_advisory_unlock(%s)", (MIGRATIONS_LOCK_KEY,))
+        db.commit()
+    return applied
+
+
+# --- Inicialización de DB y Creación de Tablas ---
+
+# Importar el módulo no abre conexiones ni hashea contraseñas: el esquema y el
+# administrador inicial se preparan explícitamente con `flask db init`.
+# Contraseña del administrador inicial (solo se usa si aún no existe)
+ADMIN_INITIAL_PASSWORD = os.environ.get('ADMIN_INITIAL_PASSWORD', 'adminpass')
+
+
+def ensure_admin_user(db, password):
+    """Crea el usuario administrador si no existe. Devuelve True si lo creó."""
+    cursor = db.cursor(cursor_factory=psycopg2.extras.DictCursor)
+    try:
+        cursor.execute("SELECT id FROM users WHERE username = %s", ('admin',))
+        if cursor.fetchone() is not None:
+            db.rollback()
+            return False
+        # El hash (costoso a propósito) solo se calcula cuando de verdad hay que crearlo
+        cursor.execute(
+            """
+            INSERT INTO users (username, password, is_admin, qr_code_uuid, first_name, paternal_last_name, maternal_last_name, gender, phone_number)
+            VALUES (%s, %s, %s, NULL, %s, %s, %s, %s, %s)
+            ON CONFLICT (username) DO NOTHING
+            """,
+            ('admin', make_password_hash(password), True, 'Admin', 'User', 'System', 'O', '000000000')
+        )
+        created = cursor.rowcount == 1
+        db.commit()
+        return created
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        cursor.close()
+
+
+def ensure_attendance_partitions(db, months_ahead=ATTENDANCE_PARTITIONS_AHEAD):
+    """
+    Crea las particiones que falten del mes actual y los `months_ahead`
+    siguientes. Devuelve cuántas creó. "Hoy" es el del reloj de los check-ins
+    (checkin_now), no CURRENT_DATE del servidor, que puede ir en otra zona.
+    """
+    today = checkin_now().date()
+    with db.cursor() as cursor:
+        cursor.execute(
+            "SELECT ensure_attendance_partitions(%s, (%s + make_interval(months => %s))::DATE)",
+            (today, today, months_ahead)
+        )
+        created = cursor.fetchone()[0]
+    db.commit()
+    return created
+
+
+def init_db(admin_password=ADMIN_INITIAL_PASSWORD):
+    """Aplica las migraciones pendientes, crea las particiones próximas y el usuario administrador si no existe."""
+    db = get_db()
+    applied = apply_migrations(db)
+    ensure_attendance_partitions(db)
+    if ensure_admin_user(db, admin_password):
+        print("Usuario 'admin' creado con éxito en PostgreSQL.")
+    else:
+        print("El usuario 'admin' ya existe.")
+    return applied
+
+
+def schema_status(db):
+    """Versiones de MIGRATIONS que faltan aplicar, sin crear nada (para /readyz)."""
+    with db.cursor() as cursor:
+        cursor.execute("SELECT to_regclass('schema_migrations') IS NOT NULL")
+        applied = set()
+        if cursor.fetchone()[0]:
+            cursor.execute("SELECT version FROM schema_migrations")
+            applied = {row[0] for row in cursor.fetchall()}
+    db.rollback()
+    return [version for version, _, _ in MIGRATIONS if version not in applied]
+
+
+# --- Comandos de CLI (flask db ..., flask badges) ---
+
+@app.cli.group('db')
+def db_cli():
+    """Migraciones del esquema de la base de datos."""
+
+
+@db_cli.command('init')
+@click.option('--admin-password', default=ADMIN_INITIAL_PASSWORD, show_default='$ADMIN_INITIAL_PASSWORD o adminpass',
+              help="Contraseña del usuario admin si hay que crearlo.")
+def db_init_command(admin_password):
+    """Aplica las migraciones y crea el usuario admin (ejecutar en cada despliegue, antes de los workers)."""
+    applied = init_db(admin_password)
+    click.echo(f"{len(applied)} migración(es) aplicada(s).")
+
+
+@db_cli.command('pending')
+def db_pending_command():
+    """Lista las migraciones pendientes de aplicar."""
+    pending = get_pending_migrations(get_db())
+    if not pending:
+        click.echo("No hay migraciones pendientes.")
+        return
+    for version, description, _ in pending:
+        click.echo(f"{version:>4}  {description}")
+
+
+@db_cli.command('migrate')
+def db_migrate_command():
+    """Aplica todas las migraciones pendientes."""
+    applied = apply_migrations(get_db())
+    click.echo(f"{len(applied)} migración(es) aplicada(s).")
+
+
+@db_cli.command('partitions')
+@click.option('--ahead', default=ATTENDANCE_PARTITIONS_AHEAD, show_default=True, type=int,
+              help="Meses futuros a dejar creados además del actual.")
+def db_partitions_command(ahead):
+    """Crea por adelantado las particiones mensuales de attendance (programar p. ej. a diario)."""
+    created = ensure_attendance_partitions(get_db(), ahead)
+    click.echo(f"{created} partición(es) creada(s).")
+
+
+@db_cli.command('detach-month')
+@click.argument('month', type=click.DateTime(formats=['%Y-%m']))
+@click.option('--drop', is_flag=True, help="Borrar la tabla del mes después de separarla.")
+def db_detach_month_command(month, drop):
+    """
+    Separa de attendance la partición de un mes pasado (YYYY-MM). Es una
+    operación de catálogo, sin mover filas; la tabla queda suelta para
+    archivarla (o se borra con --drop). attendance_daily conserva esos días.
+
+    Sin partición por defecto se usa DETACH ... CONCURRENTLY (en autocommit),
+    que no bloquea los check-ins. Postgres no lo permite mientras exista
+    attendance_default (el esquema normal), así que entonces el DETACH toma
+    ACCESS EXCLUSIVE sobre attendance: se pide con lock_timeout corto y
+    reintentos, y aun así conviene correrlo en una ventana de mantenimiento,
+    porque durante ese instante los check-ins esperan.
+    """
+    month = month.date()
+    if month >= checkin_now().date().replace(day=1):
+        raise click.ClickException("Solo se pueden separar meses ya cerrados.")
+    partition = f"attendance_{month:%Y_%m}"
+    db = get_db()
+    with db.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT 1 FROM pg_inherits
+            WHERE inhparent = 'attendance'::regclass AND inhrelid = to_regclass(%s)
+            """,
+            (partition,)
+        )
+        if cursor.fetchone() is None:
+            raise click.ClickException(f"{partition} no es una partición de attendance.")
+        cursor.execute("SELECT partdefid <> 0 FROM pg_partitioned_table WHERE partrelid = 'attendance'::regclass")
+        has_default = cursor.fetchone()[0]
+    if has_default:
+        _lock_attendance(db, 'ACCESS EXCLUSIVE')
+        with db.cursor() as cursor:
+            cursor.execute(f'ALTER TABLE attendance DETACH PARTITION "{partition}"')
+    else:
+        # CONCURRENTLY no puede ir dentro de un bloque de transacción
+        db.commit()
+        db.autocommit = True
+        try:
+            with db.cursor() as cursor:
+                cursor.execute(f'ALTER TABLE attendance DETACH PARTITION "{partition}" CONCURRENTLY')
+        finally:
+            db.autocommit = False
+    with db.cursor() as cursor:
+        if drop:
+            cursor.execute(f'DROP TABLE "{partition}"')
+        else:
+            # La llave foránea heredada impediría borrar usuarios que aparecen en el archivo
+            cursor.execute(
+                "SELECT conname FROM pg_constraint WHERE conrelid = %s::regclass AND contype = 'f'",
+                (partition,)
+            )
+            for (constraint,) in cursor.fetchall():
+                cursor.execute(f'ALTER TABLE "{partition}" DROP CONSTRAINT "{constraint}"')
+    db.commit()
+    click.echo(f"{partition} {'borrada' if drop else 'separada'}.")
+
+
+@db_cli.command('rebuild-rollup')
+@click.option('--start', type=click.DateTime(formats=['%Y-%m-%d']), default=None, help="Primer día (YYYY-MM-DD).")
+@click.option('--end', type=click.DateTime(formats=['%Y-%m-%d']), default=None, help="Último día, inclusive (YYYY-MM-DD).")
+def db_rebuild_rollup_command(start, end):
+    """Recalcula el resumen diario attendance_daily (todo el historial por defecto)."""
+    db = get_db()
+    from_day = start.date() if start else '-infinity'
+    to_day = end.date() + datetime.timedelta(days=1) if end else 'infinity'
+    with db.cursor() as cursor:
+        cursor.execute("SELECT refresh_attendance_daily(%s::DATE, %s::DATE)", (from_day, to_day))
+        cursor.execute(
+            "SELECT COUNT(*) FROM attendance_daily WHERE day >= %s::DATE AND day < %s::DATE",
+            (from_day, to_day)
+        )
+        days = cursor.fetchone()[0]
+    db.commit()
+    click.echo(f"Resumen diario recalculado: {days} día(s).")
+
+
+@app.cli.command('badges')
+@click.argument('output', type=click.Path(dir_okay=False, writable=True))
+@click.option('--base-url', required=True, help="URL pública de la app, p. ej. https://asistencia.example.com")
+@click.option('--search', default=None, help="Filtrar por nombre, apellido o teléfono.")
+@click.option('--workers', default=BADGE_WORKERS, show_default=True, type=int, help="Procesos de renderizado.")
+def badges_command(output, base_url, search, workers):
+    """Genera un ZIP con los gafetes QR de todos los usuarios (o los filtrados)."""
+    users = fetch_badge_users(get_db(), search)
+    if not users:
+        click.echo("No hay usuarios que coincidan con el filtro.")
+        return
+    # url_for necesita un contexto de solicitud para construir URLs absolutas
+    with app.test_request_context(base_url=base_url):
+        badges = build_badge_list(users)
+
+    stats = {}
+    with open(output, 'wb') as f:
+        for chunk in iter_badge_zip(badges, workers, stats=stats):
+            f.write(chunk)
+    click.echo(f"{stats['count']} gafetes en {stats['seconds']:.2f}s ({stats['rate']:.1f} gafetes/s) -> {output}")
+
+
+# --- Rutas de la Aplicación (Lógica Web) ---
+
+@app.route('/')
+def index():
+    """Página principal. Redirecciona al login, al admin dashboard, o al QR del usuario."""
+    if 'user_id' not in session:
+        return redirect(url_for('login'))
+    
+    if session.get('is_admin'):
+        return redirect(url_for('admin_dashboard'))
+    
+    # Usuario normal es redirigido directamente a su QR
+    return redirect(url_for('show_qr'))
+
+
+# --- Rutas de Administración ---
+
+@app.route('/admin')
+def admin_dashboard():
+    """Dashboard principal para el administrador."""
+    if not session.get('is_admin'):
+        return "Acceso denegado.", 403
+
+    # Nota: Requiere que 'admin_dashboard.html' exista.
+    return render_template('admin_dashboard.html')
+
+
+def parse_date_arg(name, default=None):
+    """Lee un parámetro 'YYYY-MM-DD' de la query string; devuelve `default` si falta o es inválido."""
+    value = request.args.get(name, '').strip()
+    if not value:
+        return default
+    try:
+        return datetime.date.fromisoformat(value)
+    except ValueError:
+        return default
+
+
+# Rango por defecto del reporte general y tamaño de página (en días)
+REPORT_DEFAULT_RANGE_DAYS = 31
+REPORT_DEFAULT_PAGE_DAYS = 7
+REPORT_MAX_PAGE_DAYS = 31
+REPORT_CURSOR_ITERSIZE = 2000
+
+
+@app.route('/admin/attendance')
+def admin_attendance_report():
+    """
+    Muestra el reporte de asistencias agrupado por día, acotado por un rango de
+    fechas (`start`, `end`) y paginado por días con keyset (`before`).
+    Las filas se leen con un cursor de servidor y el HTML se envía en streaming,
+    así la memoria del worker no crece con el historial.
+    """
+    if not session.get('is_admin'):
+        return "Acceso denegado.", 403
+
+    # Mismo reloj que registra los check-ins, para que "hoy" coincida con check_in_date
+    today = checkin_now().date()
+    end_date = parse_date_arg('end', today)
+    start_date = parse_date_arg('start', end_date - datetime.timedelta(days=REPORT_DEFAULT_RANGE_DAYS - 1))
+    if start_date > end_date:
+        start_date, end_date = end_date, start_date
+    before = parse_date_arg('before')
+
+    try:
+        page_days = int(request.args.get('days', REPORT_DEFAULT_PAGE_DAYS))
+    except ValueError:
+        page_days = REPORT_DEFAULT_PAGE_DAYS
+    page_days = max(1, min(page_days, REPORT_MAX_PAGE_DAYS))
+
+    # Límite superior exclusivo: el fin del rango o el cursor de la página anterior
+    upper_bound = end_date + datetime.timedelta(days=1)
+    if before is not None and before < upper_bound:
+        upper_bound = before
+
+    db = get_db(read_only=True)
+    cursor = db.cursor(cursor_factory=psycopg2.extras.DictCursor)
+
+    # 1. Días de esta página (uno extra para saber si hay una página siguiente)
+    cursor.execute(
+        """
+        SELECT day
+        FROM attendance_daily
+        WHERE day >= %s
+          AND day < %s
+          AND attendee_count > 0
+        ORDER BY day DESC
+        LIMIT %s
+        """,
+        (start_date, upper_bound, page_days + 1)
+    )
+    days = [record['day'] for record in cursor.fetchall()]
+    cursor.close()
+
+    next_before = None
+    if len(days) > page_days:
+        days = days[:page_days]
+        next_before = days[-1]
+
+    records = ()
+    if days:
+        # 2. Las filas de los días de la página se leen durante el streaming
+        records = iter_attendance_report_rows(days[-1], days[0] + datetime.timedelta(days=1))
+
+    # La conexión de la consulta de días se devuelve ya: con stream_template el
+    # contexto (y g.db) puede seguir vivo hasta el último byte, y el generador
+    # usa la suya
+    close_db()
+
+    # Nota: Requiere que 'admin_attendance.html' exista.
+    return stream_template(
+        'admin_attendance.html',
+        records=records,
+        page_days=days,
+        start_date=start_date.isoformat(),
+        end_date=end_date.isoformat(),
+        days_per_page=page_days,
+        next_before=next_before.isoformat() if next_before else None,
+    )
+
+
+def iter_attendance_report_rows(start_date, end_date):
+    """
+    Genera las filas del reporte general a medida que llegan de un cursor con
+    nombre (del lado del servidor). Usa su propia conexión (de la réplica si la
+    hay) y la devuelve al terminar; la vista libera la de `g` antes de empezar
+    el streaming, así cada reporte ocupa una sola conexión del pool.
+    """
+    conn, putconn = getconn_read_only()
+    try:
+        with conn.cursor(name='admin_attendance_report', cursor_factory=psycopg2.extras.DictCursor) as cursor:
+            cursor.itersize = REPORT_CURSOR_ITERSIZE
             cursor.execute(
                 """
-                SELECT id, first_name, paternal_last_name, maternal_last_name, phone_number
-                FROM users
-                WHERE is_admin = FALSE AND (
-                    first_name ILIKE %s OR  
-                    paternal_last_name ILIKE %s OR  
-                    maternal_last_name ILIKE %s OR
-                    phone_number LIKE %s
-                )
-                ORDER BY paternal_last_name, maternal_last_name, first_name
+                SELECT
+                    u.first_name,
+                    u.paternal_last_name,
+                    u.maternal_last_name,
+                    u.phone_number,
+                    a.check_in_time
+                FROM attendance a
+                JOIN users u ON a.user_id = u.id
+                WHERE a.check_in_date >= %s
+                  AND a.check_in_date < %s
+                ORDER BY a.check_in_time DESC
                 """,
-                # 🚨 CAMBIO 12: Usar ILIKE (Case Insensitive LIKE) en PostgreSQL
-                (search_query, search_query, search_query, search_query)
+                (start_date, end_date)
             )
-            search_results = cursor.fetchall()
+            for record in cursor:
+                # Procesamiento de fecha y hora (check_in_time es un objeto datetime en Python)
+                time_data_dt = record['check_in_time']
+                yield {
+                    'first_name': record['first_name'],
+                    'paternal_last_name': record['paternal_last_name'],
+                    'maternal_last_name': record['maternal_last_name'],
+                    'phone_number': record['phone_number'],
+                    'date_key': time_data_dt.strftime('%Y-%m-%d'),
+                    'time': time_data_dt.strftime('%H:%M:%S'),
+                }
+    finally:
+        putconn(conn)
+
+
+# --- Búsqueda de Usuarios ---
+
+# Resultados por página del reporte individual y máximo del autocompletado
+USER_SEARCH_PAGE_SIZE = int(os.environ.get('USER_SEARCH_PAGE_SIZE', 25))
+USER_SEARCH_AUTOCOMPLETE_LIMIT = 10
+USER_SEARCH_AUTOCOMPLETE_MAX = 20
+USER_SEARCH_MIN_CHARS = 2
+# Similitud por palabra mínima (0-1) para aceptar coincidencias aproximadas (errores de dedo)
+USER_SEARCH_THRESHOLD = float(os.environ.get('USER_SEARCH_THRESHOLD', 0.5))
+
+# Coincide por subcadena o por similitud de trigramas contra search_text (ambas
+# condiciones usan idx_users_search_text_trgm) y ordena por similitud. La
+# paginación es keyset sobre (rank, id): la página siguiente empieza después
+# del último resultado mostrado, sin OFFSET.
+USER_SEARCH_SQL = """
+    SELECT set_config('pg_trgm.word_similarity_threshold', %(threshold)s, true);
+    SELECT *
+    FROM (
+        SELECT id, first_name, paternal_last_name, maternal_last_name, phone_number,
+               word_similarity(fold_search_text(%(term)s), search_text) AS rank
+        FROM users
+        WHERE is_admin = FALSE
+          AND (search_text LIKE '%%' || fold_search_text(%(like)s) || '%%'
+               OR fold_search_text(%(term)s) <%% search_text)
+    ) m
+    WHERE %(after_rank)s::REAL IS NULL
+       OR m.rank < %(after_rank)s::REAL
+       OR (m.rank = %(after_rank)s::REAL AND m.id > %(after_id)s)
+    ORDER BY m.rank DESC, m.id
+    LIMIT %(limit)s
+"""
+
+
+def escape_like(value):
+    """Escapa los comodines de LIKE para buscar el texto literal."""
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def parse_search_cursor(value):
+    """Convierte el cursor `rank:id` en (rank, id); (None, None) si falta o es inválido."""
+    try:
+        rank, user_id = (value or '').split(':')
+        return float(rank), int(user_id)
+    except ValueError:
+        return None, None
+
+
+def search_users(db, term, limit, after=None):
+    """
+    Busca usuarios (no admin) por nombre, apellidos o teléfono, sin importar
+    acentos ni mayúsculas. Devuelve (filas, cursor de la página siguiente o None).
+    """
+    after_rank, after_id = parse_search_cursor(after)
+    cursor = db.cursor(cursor_factory=psycopg2.extras.DictCursor)
+    try:
+        cursor.execute(USER_SEARCH_SQL, {
+            'threshold': str(USER_SEARCH_THRESHOLD),
+            'term': term,
+            'like': escape_like(term),
+            'after_rank': after_rank,
+            'after_id': after_id,
+            'limit': limit + 1,
+        })
+        rows = cursor.fetchall()
+    finally:
+        cursor.close()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = f"{rows[-1]['rank']!r}:{rows[-1]['id']}"
+    return rows, next_cursor
+
+
+@app.route('/api/users/search')
+def api_search_users():
+    """Autocompletado del buscador de usuarios: ?q=texto[&limit=N][&after=cursor] (JSON)."""
+    if not session.get('is_admin'):
+        return jsonify({"error": "Acceso denegado."}), 403
+
+    term = request.args.get('q', '').strip()
+    if len(term) < USER_SEARCH_MIN_CHARS:
+        return jsonify({"results": [], "next": None})
+    try:
+        limit = int(request.args.get('limit', USER_SEARCH_AUTOCOMPLETE_LIMIT))
+    except ValueError:
+        limit = USER_SEARCH_AUTOCOMPLETE_LIMIT
+    limit = max(1, min(limit, USER_SEARCH_AUTOCOMPLETE_MAX))
+
+    try:
+        rows, next_cursor = search_users(get_db(read_only=True), term, limit, request.args.get('after'))
+    except Exception as e:
+        print(f"Error en la búsqueda de usuarios: {e}")
+        return jsonify({"error": "Error interno del servidor al buscar usuarios."}), 500
+
+    results = [{
+        "id": row['id'],
+        "name": f"{row['paternal_last_name'] or ''} {row['maternal_last_name'] or ''}, {row['first_name'] or ''}".strip(),
+        "phone": row['phone_number'],
+        "rank": round(row['rank'], 3),
+    } for row in rows]
+    response = jsonify({"results": results, "next": next_cursor})
+    # El navegador puede reutilizar la respuesta al borrar y volver a teclear
+    response.headers['Cache-Control'] = 'private, max-age=30'
+    return response
+
+
+@app.route('/admin/attendance/individual', methods=['GET', 'POST'])
+def admin_individual_report():
+    """
+    Permite buscar un usuario por nombre/apellido/teléfono y muestra un calendario.
+    """
+    if not session.get('is_admin'):
+        return "Acceso denegado.", 403
+
+    db = get_db(read_only=True)
+    # 🚨 CAMBIO 10: Usar DictCursor
+    cursor = db.cursor(cursor_factory=psycopg2.extras.DictCursor)
+    search_results = None
+    user_data_for_calendar = None 
+    total_attendance_count = 0 # <-- NUEVA VARIABLE: Inicializada a 0
+    
+    # 🚨 CAMBIO 11: Usar int() para forzar la conversión de user_id
+    user_id_to_display = request.args.get('user_id') 
+
+    # El formulario usa GET (?q=) para que las páginas de resultados se puedan enlazar;
+    # se sigue aceptando el POST con search_term.
+    if request.method == 'POST':
+        search_term = request.form.get('search_term', '').strip()
+    else:
+        search_term = request.args.get('q', '').strip()
+    next_cursor = None
+    if search_term:
+        # Búsqueda por trigramas ordenada por similitud, paginada con keyset
+        search_results, next_cursor = search_users(
+            db, search_term, USER_SEARCH_PAGE_SIZE, request.args.get('after')
+        )
 
     if user_id_to_display: 
         try:
@@ -409,461 +2076,2834 @@ def admin_individual_report():
                     """,
                     (user_data_for_calendar['id'],)
                 )
-                # Guardamos el resultado en la nueva variable
-                total_attendance_count = cursor.fetchone()['total']
-        except ValueError:
-            # Manejar el caso de que user_id_to_display no sea un entero
-            user_id_to_display = None
-            user_data_for_calendar = None
-    
-    # Se envían todas las variables a la plantilla
-    return render_template('admin_individual_report.html', 
-                            search_results=search_results,
-                            user_id_to_display=user_id_to_display,
-                            user_data_for_calendar=user_data_for_calendar,
-                            total_attendance_count=total_attendance_count) 
+                # Guardamos el resultado en la nueva variable
+                total_attendance_count = cursor.fetchone()['total']
+        except ValueError:
+            # Manejar el caso de que user_id_to_display no sea un entero
+            user_id_to_display = None
+            user_data_for_calendar = None
+    
+    # Se envían todas las variables a la plantilla
+    return render_template('admin_individual_report.html', 
+                            search_results=search_results,
+                            search_term=search_term,
+                            next_cursor=next_cursor,
+                            search_min_chars=USER_SEARCH_MIN_CHARS,
+                            user_id_to_display=user_id_to_display,
+                            user_data_for_calendar=user_data_for_calendar,
+                            total_attendance_count=total_attendance_count) 
+
+
+# Días en que alguien registró asistencia dentro de [inicio, fin), leídos del
+# resumen diario (una fila por día) en lugar de un DISTINCT sobre attendance.
+ACTIVE_DAYS_SQL = """
+    SELECT day AS active_date
+    FROM attendance_daily
+    WHERE day >= %s
+      AND day < %s
+      AND attendee_count > 0
+    ORDER BY day
+"""
+
+
+# --- Asistencia Mensual como Máscaras de Bits ---
+
+# Un mes de un usuario se representa con enteros de 31 bits (bit d-1 = día d):
+# los días que asistió y los días activos del sistema. Presencias, ausencias,
+# tasas y rachas salen de operaciones de bits en lugar de conjuntos de cadenas.
+
+# Todo el rango en una consulta: una fila por mes con las dos máscaras y la
+# hora del primer check-in de cada día asistido (segundos desde medianoche),
+# en el mismo orden que los bits.
+ATTENDANCE_RANGE_SQL = """
+    WITH months AS (
+        SELECT m::DATE AS month
+        FROM generate_series(%(start)s::DATE, %(last_month)s::DATE, INTERVAL '1 month') AS m
+    ), user_days AS (
+        SELECT check_in_date AS day, MIN(check_in_time) AS first_check_in
+        FROM attendance
+        WHERE user_id = %(user_id)s
+          AND check_in_date >= %(start)s
+          AND check_in_date < %(end)s
+        GROUP BY check_in_date
+    ), user_months AS (
+        SELECT date_trunc('month', day)::DATE AS month,
+               bit_or(1 << (EXTRACT(DAY FROM day)::INT - 1)) AS attended_mask,
+               array_agg(FLOOR(EXTRACT(EPOCH FROM first_check_in::TIME))::INT ORDER BY day) AS first_seconds
+        FROM user_days
+        GROUP BY 1
+    ), active_months AS (
+        SELECT date_trunc('month', day)::DATE AS month,
+               bit_or(1 << (EXTRACT(DAY FROM day)::INT - 1)) AS active_mask
+        FROM attendance_daily
+        WHERE day >= %(start)s
+          AND day < %(end)s
+          AND attendee_count > 0
+        GROUP BY 1
+    )
+    SELECT m.month,
+           COALESCE(u.attended_mask, 0) AS attended_mask,
+           COALESCE(u.first_seconds, '{}') AS first_seconds,
+           COALESCE(a.active_mask, 0) AS active_mask
+    FROM months m
+    LEFT JOIN user_months u ON u.month = m.month
+    LEFT JOIN active_months a ON a.month = m.month
+    ORDER BY m.month
+"""
+
+
+def mask_days(mask):
+    """Días (1-31) con el bit encendido, en orden."""
+    days = []
+    while mask:
+        low_bit = mask & -mask
+        days.append(low_bit.bit_length())
+        mask ^= low_bit
+    return days
+
+
+def longest_run(mask):
+    """Largo de la secuencia más larga de bits consecutivos encendidos."""
+    length = 0
+    while mask:
+        mask &= mask >> 1
+        length += 1
+    return length
+
+
+def compress_mask(mask, selector):
+    """
+    Conserva solo los bits de `mask` en las posiciones encendidas de `selector`,
+    juntándolos (como PEXT). Devuelve (bits, cantidad de posiciones).
+    Sirve para que los días sin actividad no corten una racha.
+    """
+    result = 0
+    position = 0
+    while selector:
+        low_bit = selector & -selector
+        if mask & low_bit:
+            result |= 1 << position
+        position += 1
+        selector ^= low_bit
+    return result, position
+
+
+class MonthAttendance:
+    """Asistencia de un usuario en un mes, como máscaras de 31 bits."""
+
+    __slots__ = ('month', 'attended', 'active', 'first_seconds')
+
+    def __init__(self, month, attended, active, first_seconds):
+        self.month = month                  # Primer día del mes (date)
+        self.attended = attended            # Días con check-in del usuario
+        self.active = active                # Días con actividad en el sistema
+        self.first_seconds = first_seconds  # Hora del primer check-in por bit de `attended`
+
+    @property
+    def days_in_month(self):
+        return calendar.monthrange(self.month.year, self.month.month)[1]
+
+    def elapsed_mask(self, today):
+        """Días del mes que ya pasaron o son hoy."""
+        if today < self.month:
+            return 0
+        if (today.year, today.month) > (self.month.year, self.month.month):
+            return (1 << self.days_in_month) - 1
+        return (1 << today.day) - 1
+
+    def absent_mask(self, today):
+        """Días activos ya transcurridos sin check-in del usuario."""
+        return self.active & ~self.attended & self.elapsed_mask(today)
+
+    def check_in_seconds(self, day):
+        """Segundos desde medianoche del primer check-in del día; None si no asistió."""
+        bit = 1 << (day - 1)
+        if not self.attended & bit:
+            return None
+        return self.first_seconds[(self.attended & (bit - 1)).bit_count()]
+
+    def day_status(self, day, today):
+        """ASISTIO, NO_ASISTIO (día activo ya transcurrido) o NADIE_ASISTIO, como en el CSV."""
+        bit = 1 << (day - 1)
+        if self.attended & bit:
+            return "ASISTIO"
+        if self.absent_mask(today) & bit:
+            return "NO_ASISTIO"
+        return "NADIE_ASISTIO"
+
+    def date_keys(self, mask):
+        """'YYYY-MM-DD' de los días de `mask` (solo para respuestas que esperan cadenas)."""
+        prefix = self.month.strftime('%Y-%m-')
+        return [f"{prefix}{day:02d}" for day in mask_days(mask)]
+
+
+def fetch_month_attendance(cursor, user_id, start_month, last_month):
+    """MonthAttendance de cada mes entre `start_month` y `last_month` (inclusive), en una consulta."""
+    cursor.execute(ATTENDANCE_RANGE_SQL, {
+        'user_id': user_id,
+        'start': start_month,
+        'last_month': last_month,
+        'end': month_bounds(last_month.year, last_month.month)[1],
+    })
+    return [
+        MonthAttendance(row['month'], row['attended_mask'], row['active_mask'], row['first_seconds'])
+        for row in cursor.fetchall()
+    ]
+
+
+def attendance_summary(months, today):
+    """
+    Totales de una serie de meses consecutivos: asistencias, ausencias, días
+    activos transcurridos, tasa y rachas. Las rachas cuentan días activos
+    consecutivos con asistencia (un día sin actividad no corta la racha).
+    """
+    attended = absent = active_elapsed = 0
+    longest = current = 0
+    for month in months:
+        elapsed_active = month.active & month.elapsed_mask(today)
+        attended += month.attended.bit_count()
+        absent += month.absent_mask(today).bit_count()
+        active_elapsed += elapsed_active.bit_count()
+
+        # La racha se calcula sobre los días activos del mes ya compactados
+        bits, length = compress_mask(month.attended, elapsed_active)
+        if length == 0:
+            continue
+        full = (1 << length) - 1
+        if bits == full:
+            current += length
+            longest = max(longest, current)
+            continue
+        # Racha que viene del mes anterior + bits bajos de este mes
+        leading = ((bits + 1) & ~bits).bit_length() - 1
+        longest = max(longest, current + leading, longest_run(bits))
+        # Racha abierta al final del mes (bits altos)
+        current = length - (~bits & full).bit_length()
+    return {
+        "attended": attended,
+        "absent": absent,
+        "active_days": active_elapsed,
+        "rate": round(attended / active_elapsed, 4) if active_elapsed else None,
+        "longest_streak": longest,
+        "current_streak": current,
+    }
+
+
+# --- Caché HTTP de Asistencia por Mes ---
+
+# Los meses cerrados prácticamente no cambian. El calendario, el rango y las
+# exportaciones responden con ETag y Last-Modified (último check-in del rango),
+# calculados con una consulta barata a attendance_daily: si el navegador ya
+# tiene esa versión se responde 304 sin las consultas del reporte. Además,
+# cada worker guarda el cuerpo de las respuestas de meses cerrados.
+
+# Segundos que una respuesta de mes cerrado se sirve sin volver a consultar su versión
+ATTENDANCE_CACHE_TTL = float(os.environ.get('ATTENDANCE_CACHE_TTL', 600))
+# Bytes de respuestas en caché por worker, y máximo por respuesta
+ATTENDANCE_CACHE_MAX_BYTES = int(os.environ.get('ATTENDANCE_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+ATTENDANCE_CACHE_MAX_ENTRY_BYTES = int(os.environ.get('ATTENDANCE_CACHE_MAX_ENTRY_BYTES', 8 * 1024 * 1024))
+# Cambiar este valor invalida los ETag si cambia el formato de las respuestas
+ATTENDANCE_ETAG_VERSION = '1'
+# Encabezados de la respuesta original que se conservan en la caché
+ATTENDANCE_CACHED_HEADERS = ('Content-Type', 'Content-Disposition')
+
+# Versión de los datos de un rango de días. El total de check-ins cubre los
+# escaneos atrasados de los kioscos (que no mueven el último check-in), el
+# último id de usuario los registros nuevos (la exportación de la organización
+# incluye a todos los usuarios) y la huella del usuario de la clave su nombre,
+# que va impreso en el CSV individual.
+ATTENDANCE_VERSION_SQL = """
+    SELECT COALESCE(SUM(attendee_count), 0) AS checkins,
+           MAX(last_check_in) AS last_check_in,
+           (SELECT MAX(id) FROM users) AS last_user_id,
+           (SELECT md5(ROW(username, first_name, paternal_last_name, maternal_last_name)::text)
+            FROM users WHERE id = %s) AS user_identity
+    FROM attendance_daily
+    WHERE day >= %s AND day < %s
+"""
+
+
+class CachedResponse:
+    """Cuerpo y validadores de una respuesta de mes cerrado."""
+
+    __slots__ = ('etag', 'last_modified', 'body', 'headers', 'checked_at')
+
+    def __init__(self, etag, last_modified, body, headers):
+        self.etag = etag
+        self.last_modified = last_modified
+        self.body = body
+        self.headers = headers
+        self.checked_at = time.monotonic()  # Última vez que se confirmó la versión
+
+
+class AttendanceResponseCache:
+    """
+    Caché LRU por proceso, acotada en bytes, de respuestas de meses cerrados.
+    La clave es (tipo, user_id, primer mes, último mes). Una entrada se sirve
+    sin consultar durante `ttl` segundos; después se revalida con
+    ATTENDANCE_VERSION_SQL y se reutiliza si la versión no cambió.
+    """
+
+    def __init__(self, max_bytes, ttl):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._hits = 0
+        self._revalidations = 0
+        self._misses = 0
+        self._invalidations = 0
+
+    def get(self, key):
+        """Entrada de `key` o None; no cuenta aciertos (ver record)."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def is_fresh(self, entry):
+        return time.monotonic() - entry.checked_at < self.ttl
+
+    def record(self, result):
+        """Cuenta un 'hit' (sin consultas), 'revalidated' (solo la versión) o 'miss'."""
+        with self._lock:
+            if result == 'hit':
+                self._hits += 1
+            elif result == 'revalidated':
+                self._revalidations += 1
+            else:
+                self._misses += 1
+
+    def put(self, key, entry):
+        size = len(entry.body)
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old.body)
+            if size > self.max_bytes:
+                return
+            self._entries[key] = entry
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= len(evicted.body)
+
+    def invalidate_month(self, month):
+        """Descarta las respuestas que incluyen `month` (primer día del mes)."""
+        with self._lock:
+            for key in [key for key in self._entries if key[2] <= month <= key[3]]:
+                self._bytes -= len(self._entries.pop(key).body)
+            self._invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            self._invalidations += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self._hits + self._revalidations + self._misses
+            return {
+                'size': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'ttl_seconds': self.ttl,
+                'hits': self._hits,
+                'revalidations': self._revalidations,
+                'misses': self._misses,
+                'hit_rate': round((self._hits + self._revalidations) / lookups, 4) if lookups else 0.0,
+                'invalidations': self._invalidations,
+            }
+
+
+attendance_cache = AttendanceResponseCache(ATTENDANCE_CACHE_MAX_BYTES, ATTENDANCE_CACHE_TTL)
+
+
+def attendance_etag(key, fingerprint):
+    """ETag fuerte derivado del recurso y de la versión de sus datos."""
+    raw = repr((ATTENDANCE_ETAG_VERSION, key, fingerprint))
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()[:32]
+
+
+def _tee_into_cache(chunks, key, entry_args):
+    """Pasa los chunks de una respuesta en streaming y, si termina completa y cabe, la guarda."""
+    parts = []
+    size = 0
+    for chunk in chunks:
+        if parts is not None:
+            size += len(chunk)
+            if size > ATTENDANCE_CACHE_MAX_ENTRY_BYTES:
+                parts = None
+            else:
+                parts.append(chunk)
+        yield chunk
+    if parts is not None:
+        attendance_cache.put(key, CachedResponse(body=b''.join(parts), **entry_args))
+
+
+def cached_month_response(key, start_date, end_date, build, depends_on_users=False):
+    """
+    Respuesta condicional de datos de asistencia entre `start_date` y `end_date`
+    (exclusivo). `build()` genera la respuesta completa cuando hace falta; si el
+    rango ya cerró y la respuesta es 200, el cuerpo queda en attendance_cache.
+    """
+    today = datetime.date.today()
+    closed = end_date <= today
+    user_id = key[1]
+    entry = attendance_cache.get(key) if closed else None
+
+    if entry is not None and attendance_cache.is_fresh(entry):
+        attendance_cache.record('hit')
+        etag, last_modified = entry.etag, entry.last_modified
+    else:
+        try:
+            with get_db(read_only=True).cursor() as cursor:
+                cursor.execute(ATTENDANCE_VERSION_SQL, (user_id, start_date, end_date))
+                checkins, last_check_in, last_user_id, user_identity = cursor.fetchone()
+        except Exception as e:
+            print(f"Error al consultar la versión de asistencia: {e}")
+            return build()
+        # En un mes abierto las ausencias dependen de la fecha de hoy
+        fingerprint = (
+            checkins, last_check_in, last_user_id if depends_on_users else None, user_identity,
+            None if closed else today,
+        )
+        etag = attendance_etag(key, fingerprint)
+        # last_check_in es hora local sin zona; Last-Modified va en UTC
+        last_modified = last_check_in.astimezone(datetime.timezone.utc) if last_check_in else None
+        if entry is not None and entry.etag == etag:
+            entry.checked_at = time.monotonic()
+            attendance_cache.record('revalidated')
+        else:
+            entry = None
+            attendance_cache.record('miss')
+
+    # If-None-Match tiene prioridad sobre If-Modified-Since: un escaneo atrasado
+    # cambia el ETag aunque no mueva el último check-in.
+    if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        response = Response(status=304)
+    elif entry is not None:
+        response = Response(entry.body, headers=entry.headers)
+    else:
+        response = make_response(build())
+        if response.status_code != 200:
+            return response
+        if closed:
+            entry_args = {
+                'etag': etag,
+                'last_modified': last_modified,
+                'headers': [(name, value) for name, value in response.headers if name in ATTENDANCE_CACHED_HEADERS],
+            }
+            if response.is_streamed:
+                response.response = _tee_into_cache(response.response, key, entry_args)
+            elif response.calculate_content_length() <= ATTENDANCE_CACHE_MAX_ENTRY_BYTES:
+                attendance_cache.put(key, CachedResponse(body=response.get_data(), **entry_args))
+
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    # Privada (solo admins) y siempre revalidada: la repetición cuesta un 304
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+@app.route('/api/attendance/user/<int:user_id>/<int:year>/<int:month>')
+def get_individual_attendance(user_id, year, month):
+    """
+    Devuelve los días asistidos por un usuario y los días activos del sistema
+    para un mes específico, incluyendo la hora de check-in del usuario.
+    """
+    if not session.get('is_admin'):
+        return jsonify({"error": "Acceso denegado."}), 403
+
+    try:
+        start_date, end_date = month_bounds(year, month)
+    except ValueError:
+        return jsonify({"error": "Mes inválido."}), 400
+
+    def build():
+        cursor = None
+        try:
+            # 🚨 CAMBIO 13: Usar DictCursor para los fetchall
+            cursor = get_db(read_only=True).cursor(cursor_factory=psycopg2.extras.DictCursor)
+            month_data, = fetch_month_attendance(cursor, user_id, start_date, start_date)
+
+            # Hora del primer check-in de cada día asistido (sin segundos para la visualización)
+            attended_records = {}
+            for day, seconds in zip(mask_days(month_data.attended), month_data.first_seconds):
+                attended_records[f"{year:04d}-{month:02d}-{day:02d}"] = f"{seconds // 3600:02d}:{seconds // 60 % 60:02d}"
+
+            # Respuesta del API
+            return jsonify({
+                "attended_days": list(attended_records.keys()),
+                "attended_times": attended_records,  # 🚨 NUEVO DATO: { 'YYYY-MM-DD': 'HH:MM' }
+                "system_active_days": month_data.date_keys(month_data.active)
+            })
+
+        except Exception as e:
+            print(f"Error al obtener datos de asistencia: {e}")
+            return jsonify({"error": "Error interno del servidor al obtener datos de asistencia."}), 500
+        finally:
+            if cursor:
+                cursor.close()
+
+    return cached_month_response(('calendar', user_id, start_date, start_date), start_date, end_date, build)
+
+
+# Máximo de meses por consulta del API de rango
+ATTENDANCE_RANGE_MAX_MONTHS = 12
+
+
+def parse_month_arg(name):
+    """Lee un parámetro 'YYYY-MM' de la query string como el primer día del mes; None si falta o es inválido."""
+    try:
+        year, month = request.args.get(name, '').strip().split('-')
+        return datetime.date(int(year), int(month), 1)
+    except ValueError:
+        return None
+
+
+@app.route('/api/attendance/user/<int:user_id>/range')
+def get_individual_attendance_range(user_id):
+    """
+    Asistencia de un usuario de `start` a `end` (meses 'YYYY-MM', inclusive,
+    hasta ATTENDANCE_RANGE_MAX_MONTHS) en una sola consulta. Por mes devuelve:
+    - attended: máscara de bits de los días asistidos (bit d-1 = día d).
+    - times: minutos desde medianoche del primer check-in de cada día asistido,
+      en orden de día (uno por bit encendido).
+    - active: máscara de los días activos del sistema.
+    Además, `summary` con asistencias, ausencias, tasa y rachas del rango.
+    """
+    if not session.get('is_admin'):
+        return jsonify({"error": "Acceso denegado."}), 403
+
+    start_month = parse_month_arg('start')
+    # Sin `end` el rango es solo el mes inicial; un `end` mal formado es un error
+    last_month = parse_month_arg('end') if request.args.get('end', '').strip() else start_month
+    if start_month is None or last_month is None or last_month < start_month:
+        return jsonify({"error": "Parámetros 'start' y 'end' inválidos (formato YYYY-MM)."}), 400
+    month_count = (last_month.year - start_month.year) * 12 + last_month.month - start_month.month + 1
+    if month_count > ATTENDANCE_RANGE_MAX_MONTHS:
+        return jsonify({"error": f"El rango no puede exceder {ATTENDANCE_RANGE_MAX_MONTHS} meses."}), 400
+
+    def build():
+        cursor = None
+        try:
+            cursor = get_db(read_only=True).cursor(cursor_factory=psycopg2.extras.DictCursor)
+            months = fetch_month_attendance(cursor, user_id, start_month, last_month)
+        except Exception as e:
+            print(f"Error al obtener el rango de asistencia: {e}")
+            return jsonify({"error": "Error interno del servidor al obtener datos de asistencia."}), 500
+        finally:
+            if cursor:
+                cursor.close()
+
+        return jsonify({
+            "user_id": user_id,
+            "months": [{
+                "month": month.month.strftime('%Y-%m'),
+                "attended": month.attended,
+                "times": [seconds // 60 for seconds in month.first_seconds],
+                "active": month.active,
+            } for month in months],
+            "summary": attendance_summary(months, datetime.date.today()),
+        })
+
+    end_date = month_bounds(last_month.year, last_month.month)[1]
+    return cached_month_response(('range', user_id, start_month, last_month), start_month, end_date, build)
+
+
+# --- Rutas de Administración (Continuación) ---
+
+@app.route('/admin/settings', methods=['GET', 'POST'])
+def admin_settings():
+    # 1. Validación de Autenticación y Rol (sin decorador)
+    if 'user_id' not in session or not session.get('is_admin'):
+        flash('Acceso denegado. Debe iniciar sesión como administrador.', 'error')
+        return redirect(url_for('login'))
+
+    admin_id = session.get('user_id')  
+    
+    conn = get_db()
+    # 🚨 CORRECCIÓN: Usar DictCursor aquí para poder acceder por nombre de columna (e.g., admin_data['username'])
+    cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor) 
+    
+    if request.method == 'POST':
+        # Obtenemos ambos campos
+        new_username = request.form.get('username', '').strip()
+        new_password = request.form.get('password', '')
+        
+        # Validación de campos
+        if not new_username:
+             flash('El nombre de usuario no puede estar vacío.', 'error')
+             return redirect(url_for('admin_settings'))
+        if len(new_password) < 6:
+             flash('La contraseña debe tener al menos 6 caracteres.', 'error')
+             return redirect(url_for('admin_settings'))
+
+        try:
+            # 2. Verificar unicidad del nuevo nombre de usuario
+            cur.execute("SELECT id FROM users WHERE username = %s AND id != %s", (new_username, admin_id))
+            if cur.fetchone():
+                flash('El nombre de usuario ya existe. Por favor, elige otro.', 'warning')
+                return redirect(url_for('admin_settings'))
+
+            # 3. Hashear la nueva contraseña (en el pool de hashing)
+            hashed_password = get_password_hasher().hash(new_password)
+            
+            # 4. Actualizar la base de datos (tanto username como password)
+            cur.execute("""
+                UPDATE users 
+                SET username = %s, password = %s 
+                WHERE id = %s
+            """, (new_username, hashed_password, admin_id))
+            conn.commit()
+
+            # 5. Actualizar la sesión
+            session['username'] = new_username
+            
+            flash('Su nombre de usuario y contraseña han sido actualizados exitosamente.', 'success')
+            return redirect(url_for('admin_dashboard'))
+
+        except PasswordHasherBusy:
+            conn.rollback()
+            flash(PASSWORD_HASH_BUSY_MESSAGE, 'warning')
+            return redirect(url_for('admin_settings'))
+        except Exception as e:
+            conn.rollback()
+            print(f"Error al actualizar la configuración del admin: {e}") 
+            flash('Error interno al actualizar la configuración.', 'error')
+            return redirect(url_for('admin_settings'))
+            
+    # GET request: Mostrar el formulario con el nombre de usuario actual
+    try:
+        cur.execute("SELECT username FROM users WHERE id = %s", (admin_id,))
+        admin_data = cur.fetchone() 
+        
+        # ¡Esta línea ahora funciona correctamente!
+        current_username = admin_data['username'] if admin_data else ''
+        
+        return render_template('admin_settings.html', current_username=current_username)
+
+    except Exception as e:
+        print(f'Error al cargar la configuración: {e}')
+        flash('Error al cargar la información del administrador.', 'error')
+        return redirect(url_for('admin_dashboard'))
+
+
+        
+
+# Nombres de los días de la semana (Lunes es 0 en Python)
+DAY_NAMES = ["Lunes", "Martes", "Miércoles", "Jueves", "Viernes", "Sábado", "Domingo"]
+
+
+def month_bounds(year, month):
+    """Devuelve (primer día del mes, primer día del mes siguiente)."""
+    start_date = datetime.date(year, month, 1)
+    if month == 12:
+        end_date = datetime.date(year + 1, 1, 1)
+    else:
+        end_date = datetime.date(year, month + 1, 1)
+    return start_date, end_date
+
+
+@app.route('/admin/attendance/export/<int:user_id>/<int:year>/<int:month>')
+def export_individual_attendance(user_id, year, month):
+    """
+    Genera un archivo CSV con la asistencia (ASISTIO/NO_ASISTIO/NADIE_ASISTIO)
+    para un usuario en un mes específico, incluyendo la hora de registro.
+    """
+    if not session.get('is_admin'):
+        return "Acceso denegado.", 403
+
+    try:
+        start_date, end_date = month_bounds(year, month)
+    except ValueError:
+        return "Mes inválido.", 400
+
+    def build():
+        db = None
+        cursor = None
+
+        try:
+            db = get_db(read_only=True)
+            # 🚨 CAMBIO 15: Usar DictCursor para los fetchall
+            cursor = db.cursor(cursor_factory=psycopg2.extras.DictCursor)
+
+            # Definir current_day_date para evitar errores de ámbito
+            current_day_date = datetime.date.today()
+
+            # 1. Obtener datos del usuario
+            cursor.execute(
+                "SELECT first_name, paternal_last_name, maternal_last_name FROM users WHERE id = %s",
+                (user_id,)
+            )
+            user_data = cursor.fetchone()
+            if not user_data:
+                return "Usuario no encontrado.", 404
+        
+            full_name = f"{user_data['paternal_last_name']} {user_data['maternal_last_name']}, {user_data['first_name']}"
+        
+            # 2. Asistencias del usuario y días activos del sistema, como máscaras de bits
+            month_data, = fetch_month_attendance(cursor, user_id, start_date, start_date)
+
+            # 3. Construir el contenido del CSV en memoria
+            output = io.StringIO()
+            writer = csv.writer(output, delimiter=',')
+        
+            # Metadatos (Tildes eliminadas)
+            writer.writerow(["REPORTE DE ASISTENCIA INDIVIDUAL", "", "", "", ""])
+            writer.writerow(["EMPLEADO:", full_name, "MES:", f"{month}/{year}"])
+            writer.writerow(["ASISTENCIAS PROPIAS:", str(month_data.attended.bit_count())])
+            writer.writerow(["DIAS ACTIVOS DEL SISTEMA:", str(month_data.active.bit_count())])
+            writer.writerow([])
+        
+            # Encabezados (Nueva columna: Hora de Registro)
+            header_row = ["Dia", "Dia Semana", "Fecha (YYYY-MM-DD)", "Hora de Registro", "Estado de Asistencia"]
+            writer.writerow(header_row)
+
+            # 4. Filas de datos: el estado sale de las máscaras (ASISTIO > NO_ASISTIO > NADIE_ASISTIO)
+            first_weekday = start_date.weekday()
+            for day in range(1, month_data.days_in_month + 1):
+                seconds = month_data.check_in_seconds(day)
+                writer.writerow([
+                    day,
+                    DAY_NAMES[(first_weekday + day - 1) % 7],
+                    f"{year:04d}-{month:02d}-{day:02d}",
+                    f"{seconds // 3600:02d}:{seconds // 60 % 60:02d}:{seconds % 60:02d}" if seconds is not None else "", # <-- Columna de la hora
+                    month_data.day_status(day, current_day_date)
+                ])
+
+            # 7. Devolver el archivo CSV
+            csv_output = output.getvalue()
+            filename = f"reporte_asistencia_{user_id}_{year}_{month}_final.csv"
+        
+            response = Response(
+                csv_output,
+                mimetype="text/csv",
+                headers={
+                    "Content-Disposition": f"attachment; filename={filename}"
+                }
+            )
+            return response
+
+        except Exception as e:
+            print(f"ERROR AL GENERAR CSV: {e}")
+            return f"Error interno del servidor al generar el CSV: {e}", 500
+        finally:
+            if cursor:
+                cursor.close()
+
+    return cached_month_response(('export', user_id, start_date, start_date), start_date, end_date, build)
+
+
+# --- Exportación Mensual de Toda la Organización (COPY) ---
+
+# Matriz usuarios x días de un mes, generada en una sola consulta. Cada celda
+# sigue las reglas del CSV individual: 'ASISTIO HH:MM:SS', 'NO_ASISTIO' (día
+# activo del sistema, pasado u hoy) o 'NADIE_ASISTIO'. Las columnas por día
+# ({day_columns}) se agregan en Python porque dependen de los días del mes.
+ORGANIZATION_EXPORT_SQL = """
+    COPY (
+        WITH days AS (
+            SELECT gs::DATE AS day,
+                   (d.attendee_count > 0 AND gs::DATE <= %(today)s) AS counts_absence
+            FROM generate_series(%(start)s::DATE, %(end)s::DATE - 1, INTERVAL '1 day') gs
+            LEFT JOIN attendance_daily d ON d.day = gs::DATE
+        ), month_attendance AS (
+            SELECT user_id, check_in_date, check_in_time
+            FROM attendance
+            WHERE check_in_date >= %(start)s AND check_in_date < %(end)s
+        ), matrix AS (
+            SELECT u.id AS user_id,
+                   COUNT(a.check_in_time) AS attended,
+                   array_agg(
+                       CASE
+                           WHEN a.check_in_time IS NOT NULL THEN 'ASISTIO ' || to_char(a.check_in_time, 'HH24:MI:SS')
+                           WHEN d.counts_absence THEN 'NO_ASISTIO'
+                           ELSE 'NADIE_ASISTIO'
+                       END
+                       ORDER BY d.day
+                   ) AS cells
+            FROM users u
+            CROSS JOIN days d
+            LEFT JOIN month_attendance a ON a.user_id = u.id AND a.check_in_date = d.day
+            WHERE u.is_admin = FALSE
+            GROUP BY u.id
+        )
+        SELECT u.id AS "ID",
+               u.paternal_last_name AS "Apellido Paterno",
+               u.maternal_last_name AS "Apellido Materno",
+               u.first_name AS "Nombre(s)",
+               u.phone_number AS "Telefono",
+               m.attended AS "Asistencias",
+               {day_columns}
+        FROM matrix m
+        JOIN users u ON u.id = m.user_id
+        ORDER BY u.paternal_last_name, u.maternal_last_name, u.first_name, u.id
+    ) TO STDOUT WITH (FORMAT csv, HEADER true)
+"""
+
+# Chunks de COPY acumulados antes de pasarlos al generador, y chunks en vuelo
+COPY_STREAM_CHUNK_SIZE = 64 * 1024
+COPY_STREAM_QUEUE_SIZE = 16
+
+_COPY_DONE = object()
+
+
+class _CopyStreamWriter:
+    """Archivo de destino para copy_expert que pasa los datos a una cola acotada."""
+
+    def __init__(self, put):
+        self._put = put
+        self._buffer = []
+        self._buffered = 0
+
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        self._buffer.append(data)
+        self._buffered += len(data)
+        if self._buffered >= COPY_STREAM_CHUNK_SIZE:
+            self.flush()
+        return len(data)
+
+    def flush(self):
+        if self._buffer:
+            self._put(b''.join(self._buffer))
+            self._buffer.clear()
+            self._buffered = 0
+
+
+def iter_copy_to_stdout(copy_sql, params=None):
+    """
+    Ejecuta un `COPY ... TO STDOUT` en un hilo con su propia conexión de lectura y
+    devuelve los datos como generador. La cola acotada da contrapresión: la
+    memoria usada es constante sin importar el tamaño de la exportación. Si el
+    cliente se desconecta, el COPY se aborta.
+    """
+    chunks = queue.Queue(maxsize=COPY_STREAM_QUEUE_SIZE)
+    cancelled = threading.Event()
+
+    def put(item):
+        while not cancelled.is_set():
+            try:
+                chunks.put(item, timeout=1)
+                return
+            except queue.Full:
+                continue
+        raise IOError("Exportación cancelada por el cliente.")
+
+    def producer():
+        conn = None
+        try:
+            conn, putconn = getconn_read_only()
+            writer = _CopyStreamWriter(put)
+            with conn.cursor() as cursor:
+                cursor.copy_expert(cursor.mogrify(copy_sql, params), writer)
+            writer.flush()
+            conn.commit()
+            put(_COPY_DONE)
+        except Exception as e:
+            if not cancelled.is_set():
+                try:
+                    put(e)
+                except IOError:
+                    pass
+        finally:
+            if conn is not None:
+                putconn(conn)
+
+    thread = threading.Thread(target=producer, name='copy-export', daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = chunks.get()
+            if item is _COPY_DONE:
+                break
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        cancelled.set()
+
+
+def iter_organization_export(cursor, year, month):
+    """
+    Generador con el CSV del mes para todos los usuarios (metadatos + COPY).
+    Los días activos se consultan con `cursor` antes de devolverlo; las filas
+    se leen al iterar, con una conexión propia.
+    """
+    start_date, end_date = month_bounds(year, month)
+    cursor.execute("SELECT COUNT(*) FROM (" + ACTIVE_DAYS_SQL + ") active_days", (start_date, end_date))
+    active_days = cursor.fetchone()[0]
+
+    day_columns = []
+    for day in range(1, (end_date - start_date).days + 1):
+        label = f"{day:02d} {DAY_NAMES[datetime.date(year, month, day).weekday()][:3]}"
+        day_columns.append(f'm.cells[{day}] AS "{label}"')
+    copy_sql = ORGANIZATION_EXPORT_SQL.replace('{day_columns}', ',\n               '.join(day_columns))
+
+    # Metadatos al inicio, igual que el reporte individual
+    preamble = io.StringIO()
+    writer = csv.writer(preamble, delimiter=',')
+    writer.writerow(["REPORTE DE ASISTENCIA MENSUAL (TODOS LOS EMPLEADOS)"])
+    writer.writerow(["MES:", f"{month}/{year}"])
+    writer.writerow(["DIAS ACTIVOS DEL SISTEMA:", str(active_days)])
+    writer.writerow([])
+
+    def generate():
+        yield preamble.getvalue().encode('utf-8')
+        yield from iter_copy_to_stdout(copy_sql, {
+            'start': start_date,
+            'end': end_date,
+            'today': datetime.date.today(),
+        })
+
+    return generate()
+
+
+@app.route('/admin/attendance/export/all/<int:year>/<int:month>')
+def export_organization_attendance(year, month):
+    """
+    Genera (en streaming) el CSV del mes para todos los usuarios: una fila por
+    usuario y una columna por día, con la hora de check-in o el estado.
+    """
+    if not session.get('is_admin'):
+        return "Acceso denegado.", 403
+
+    try:
+        start_date, end_date = month_bounds(year, month)
+    except ValueError:
+        return "Mes inválido.", 400
+
+    def build():
+        cursor = get_db(read_only=True).cursor()
+        try:
+            chunks = iter_organization_export(cursor, year, month)
+        finally:
+            cursor.close()
+
+        filename = f"reporte_asistencia_todos_{year}_{month}.csv"
+        return Response(
+            chunks,
+            mimetype="text/csv",
+            headers={
+                "Content-Disposition": f"attachment; filename={filename}"
+            }
+        )
+
+    # Incluye a todos los usuarios: un registro nuevo también cambia la versión
+    return cached_month_response(('export_all', None, start_date, start_date), start_date, end_date, build,
+                                 depends_on_users=True)
+
+
+# --- NUEVAS RUTAS DE REPORTE INDIVIDUAL (FIN) ---
+
+
+# --- Analítica de Asistencia (NumPy) ---
+
+# Periodo por defecto y máximo (en días) de la analítica
+ANALYTICS_DEFAULT_DAYS = 90
+ANALYTICS_MAX_DAYS = 366
+# Hora límite por defecto para considerar puntual un check-in
+ANALYTICS_DEFAULT_CUTOFF = os.environ.get('ANALYTICS_PUNCTUALITY_CUTOFF', '08:00')
+# Ancho de las barras del histograma de horas de llegada (segundos)
+ANALYTICS_HISTOGRAM_BIN = 15 * 60
+
+# Un solo COPY binario trae (usuario, día relativo al inicio, segundos desde
+# medianoche) de cada asistencia del periodo. Con columnas de ancho fijo y sin
+# NULL, cada fila del formato binario de PostgreSQL mide lo mismo y se lee
+# directamente como un arreglo estructurado de NumPy.
+ANALYTICS_CHECKINS_COPY_SQL = """
+    COPY (
+        SELECT a.user_id::INT4,
+               (a.check_in_date - %(start)s::DATE)::INT2,
+               FLOOR(EXTRACT(EPOCH FROM a.check_in_time::TIME))::INT4
+        FROM attendance a
+        JOIN users u ON u.id = a.user_id AND u.is_admin = FALSE
+        WHERE a.check_in_date >= %(start)s
+          AND a.check_in_date <= %(end)s
+    ) TO STDOUT (FORMAT binary)
+"""
+# Encabezado del formato binario de COPY: firma (11), banderas (4) y largo de la extensión (4)
+PG_COPY_BINARY_SIGNATURE = b'PGCOPY\n\xff\r\n\x00'
+PG_COPY_BINARY_HEADER_SIZE = 19
+ANALYTICS_ROW_DTYPE = np.dtype([
+    ('fields', '>i2'),
+    ('user_len', '>i4'), ('user_id', '>i4'),
+    ('day_len', '>i4'), ('day', '>i2'),
+    ('seconds_len', '>i4'), ('seconds', '>i4'),
+])
+
+ANALYTICS_ACTIVE_DAYS_SQL = """
+    SELECT (day - %(start)s::DATE) AS offset
+    FROM attendance_daily
+    WHERE day >= %(start)s
+      AND day <= %(end)s
+      AND attendee_count > 0
+    ORDER BY day
+"""
+
+# Columnas ordenables: nombre -> clave del resultado
+ANALYTICS_SORT_KEYS = ('name', 'attended', 'absences', 'rate', 'median_check_in', 'on_time_rate',
+                       'late_days', 'longest_streak', 'current_streak')
+
+
+def parse_copy_binary(data, dtype):
+    """Convierte la salida de `COPY ... (FORMAT binary)` de filas de ancho fijo en un arreglo estructurado."""
+    if not data.startswith(PG_COPY_BINARY_SIGNATURE):
+        raise ValueError("La salida de COPY no tiene la firma del formato binario.")
+    extension_length = int.from_bytes(data[15:19], 'big')
+    offset = PG_COPY_BINARY_HEADER_SIZE + extension_length
+    body_size = len(data) - offset - 2  # Sin el marcador final (-1 como int16)
+    if body_size % dtype.itemsize:
+        raise ValueError("Filas de COPY con ancho inesperado (¿hay valores NULL?).")
+    return np.frombuffer(data, dtype=dtype, count=body_size // dtype.itemsize, offset=offset)
+
+
+def parse_time_of_day(value, default):
+    """'HH:MM' -> segundos desde medianoche; `default` si es inválido."""
+    try:
+        hours, minutes = value.split(':')
+        parsed = datetime.time(int(hours), int(minutes))
+    except (ValueError, AttributeError):
+        return default
+    return parsed.hour * 3600 + parsed.minute * 60
+
+
+def format_seconds(value):
+    """Segundos desde medianoche -> 'HH:MM' (None si no hay dato)."""
+    if value is None or np.isnan(value):
+        return None
+    value = int(value)
+    return f"{value // 3600:02d}:{value // 60 % 60:02d}"
+
+
+def row_runs(matrix):
+    """
+    Rachas de una matriz booleana usuarios × días, por fila y sin bucles:
+    (racha más larga, racha abierta al final).
+    """
+    rows, cols = matrix.shape
+    if not cols:
+        return np.zeros(rows, dtype=np.int64), np.zeros(rows, dtype=np.int64)
+    padded = np.zeros((rows, cols + 2), dtype=np.int8)
+    padded[:, 1:-1] = matrix
+    edges = np.diff(padded, axis=1)
+    start_rows, start_cols = np.nonzero(edges == 1)
+    _, end_cols = np.nonzero(edges == -1)
+    # nonzero recorre en orden de fila, así que inicios y fines quedan emparejados
+    longest = np.zeros(rows, dtype=np.int64)
+    np.maximum.at(longest, start_rows, end_cols - start_cols)
+
+    reversed_gaps = ~matrix[:, ::-1]
+    current = np.where(reversed_gaps.any(axis=1), reversed_gaps.argmax(axis=1), cols)
+    return longest, current
+
+
+def compute_attendance_analytics(user_ids, checkins, active_offsets, num_days, cutoff_seconds):
+    """
+    Métricas por usuario con operaciones vectorizadas.
+
+    - user_ids: IDs ordenados (int).
+    - checkins: arreglo estructurado con user_id, day (0..num_days-1) y seconds.
+    - active_offsets: días del periodo con actividad en el sistema.
+    Devuelve un dict de arreglos alineados con user_ids y el histograma global.
+    """
+    user_count = len(user_ids)
+    attended = np.zeros((user_count, num_days), dtype=bool)
+    seconds = np.full((user_count, num_days), np.nan)
+    rows = np.searchsorted(user_ids, checkins['user_id'])
+    attended[rows, checkins['day']] = True
+    seconds[rows, checkins['day']] = checkins['seconds']
+
+    active = np.zeros(num_days, dtype=bool)
+    active[active_offsets] = True
+    active_days = int(active.sum())
+    # Solo cuentan los días con actividad en el sistema (un día sin nadie no es ausencia)
+    attended_active = attended[:, active]
+
+    attended_count = attended_active.sum(axis=1)
+    absences = active_days - attended_count
+    with np.errstate(invalid='ignore', divide='ignore'):
+        rate = attended_count / active_days if active_days else np.full(user_count, np.nan)
+        on_time = (seconds <= cutoff_seconds).sum(axis=1)
+        on_time_rate = np.where(attended_count > 0, on_time / np.maximum(attended_count, 1), np.nan)
+    late_days = attended_count - on_time
+
+    has_data = attended_count > 0
+    median = np.full(user_count, np.nan)
+    mean = np.full(user_count, np.nan)
+    p90 = np.full(user_count, np.nan)
+    if has_data.any():
+        median[has_data] = np.nanmedian(seconds[has_data], axis=1)
+        mean[has_data] = np.nanmean(seconds[has_data], axis=1)
+        p90[has_data] = np.nanpercentile(seconds[has_data], 90, axis=1)
+
+    longest, current = row_runs(attended_active)
+
+    histogram = []
+    if len(checkins):
+        first_bin = checkins['seconds'].min() // ANALYTICS_HISTOGRAM_BIN * ANALYTICS_HISTOGRAM_BIN
+        last_bin = checkins['seconds'].max() // ANALYTICS_HISTOGRAM_BIN * ANALYTICS_HISTOGRAM_BIN + ANALYTICS_HISTOGRAM_BIN
+        counts, edges = np.histogram(checkins['seconds'], bins=np.arange(first_bin, last_bin + 1, ANALYTICS_HISTOGRAM_BIN))
+        histogram = [{"from": format_seconds(edge), "count": int(count)} for edge, count in zip(edges[:-1], counts)]
+
+    return {
+        'attended': attended_count,
+        'absences': absences,
+        'rate': rate,
+        'median_check_in': median,
+        'mean_check_in': mean,
+        'p90_check_in': p90,
+        'on_time_rate': on_time_rate,
+        'late_days': late_days,
+        'longest_streak': longest,
+        'current_streak': current,
+        'active_days': active_days,
+        'histogram': histogram,
+    }
+
+
+def sort_order(metrics, names, sort_key, descending):
+    """Índices de orden por `sort_key` (los usuarios sin datos van al final)."""
+    if sort_key == 'name':
+        keys = np.array(names)
+        order = np.argsort(keys, kind='stable')
+        return order[::-1] if descending else order
+    values = np.asarray(metrics[sort_key], dtype=float)
+    values = np.where(np.isnan(values), np.inf if not descending else -np.inf, values)
+    order = np.argsort(values if not descending else -values, kind='stable')
+    return order
+
+
+def load_attendance_analytics(db, start_date, end_date, cutoff_seconds, sort_key, descending):
+    """Trae los datos del periodo en tres consultas y arma las filas ordenadas del reporte."""
+    cursor = db.cursor()
+    try:
+        cursor.execute("""
+            SELECT id, first_name, paternal_last_name, maternal_last_name
+            FROM users
+            WHERE is_admin = FALSE
+            ORDER BY id
+        """)
+        users = cursor.fetchall()
+        params = {'start': start_date, 'end': end_date}
+        cursor.execute(ANALYTICS_ACTIVE_DAYS_SQL, params)
+        active_offsets = np.array([row[0] for row in cursor.fetchall()], dtype=np.int64)
+        buffer = BytesIO()
+        cursor.copy_expert(cursor.mogrify(ANALYTICS_CHECKINS_COPY_SQL, params), buffer)
+    finally:
+        cursor.close()
+
+    user_ids = np.array([user[0] for user in users], dtype=np.int64)
+    names = [f"{user[2] or ''} {user[3] or ''}, {user[1] or ''}".strip() for user in users]
+    checkins = parse_copy_binary(buffer.getvalue(), ANALYTICS_ROW_DTYPE)
+    # Un usuario creado entre la primera consulta y el COPY no tiene fila en la matriz
+    checkins = checkins[np.isin(checkins['user_id'], user_ids)]
+    num_days = (end_date - start_date).days + 1
+    metrics = compute_attendance_analytics(user_ids, checkins, active_offsets, num_days, cutoff_seconds)
+
+    order = sort_order(metrics, names, sort_key, descending)
+    columns = {key: np.asarray(metrics[key])[order].tolist() for key in (
+        'attended', 'absences', 'rate', 'median_check_in', 'mean_check_in', 'p90_check_in',
+        'on_time_rate', 'late_days', 'longest_streak', 'current_streak')}
+    rows = []
+    for i, index in enumerate(order.tolist()):
+        rate = columns['rate'][i]
+        on_time_rate = columns['on_time_rate'][i]
+        rows.append({
+            "id": users[index][0],
+            "name": names[index],
+            "attended": columns['attended'][i],
+            "absences": columns['absences'][i],
+            "rate": None if np.isnan(rate) else round(rate, 4),
+            "median_check_in": format_seconds(columns['median_check_in'][i]),
+            "mean_check_in": format_seconds(columns['mean_check_in'][i]),
+            "p90_check_in": format_seconds(columns['p90_check_in'][i]),
+            "on_time_rate": None if np.isnan(on_time_rate) else round(on_time_rate, 4),
+            "late_days": columns['late_days'][i],
+            "longest_streak": columns['longest_streak'][i],
+            "current_streak": columns['current_streak'][i],
+        })
+
+    rates = np.asarray(metrics['rate'], dtype=float)
+    summary = {
+        "users": len(users),
+        "active_days": metrics['active_days'],
+        "check_ins": int(len(checkins)),
+        "average_rate": None if not len(rates) or np.isnan(rates).all() else round(float(np.nanmean(rates)), 4),
+        "median_rate": None if not len(rates) or np.isnan(rates).all() else round(float(np.nanmedian(rates)), 4),
+        "on_time_rate": round(float((checkins['seconds'] <= cutoff_seconds).mean()), 4) if len(checkins) else None,
+        "median_check_in": format_seconds(float(np.median(checkins['seconds']))) if len(checkins) else None,
+    }
+    return rows, summary, metrics['histogram']
+
+
+ANALYTICS_CSV_COLUMNS = [
+    ('id', 'ID'), ('name', 'Nombre'), ('attended', 'Asistencias'), ('absences', 'Ausencias'),
+    ('rate', 'Tasa de Asistencia'), ('median_check_in', 'Hora Mediana'), ('mean_check_in', 'Hora Promedio'),
+    ('p90_check_in', 'Hora P90'), ('on_time_rate', 'Tasa de Puntualidad'), ('late_days', 'Dias Tarde'),
+    ('longest_streak', 'Racha Mas Larga'), ('current_streak', 'Racha Actual'),
+]
+
+
+def read_analytics_args():
+    """Periodo, hora límite y orden desde la query string (con valores por defecto y límites)."""
+    today = datetime.date.today()
+    end_date = min(parse_date_arg('end', today), today)
+    start_date = parse_date_arg('start', end_date - datetime.timedelta(days=ANALYTICS_DEFAULT_DAYS - 1))
+    if start_date > end_date:
+        start_date, end_date = end_date, start_date
+    if (end_date - start_date).days + 1 > ANALYTICS_MAX_DAYS:
+        start_date = end_date - datetime.timedelta(days=ANALYTICS_MAX_DAYS - 1)
+    cutoff = request.args.get('cutoff', ANALYTICS_DEFAULT_CUTOFF)
+    cutoff_seconds = parse_time_of_day(cutoff, parse_time_of_day(ANALYTICS_DEFAULT_CUTOFF, 8 * 3600))
+    sort_key = request.args.get('sort', 'rate')
+    if sort_key not in ANALYTICS_SORT_KEYS:
+        sort_key = 'rate'
+    descending = request.args.get('order', 'desc') != 'asc'
+    return start_date, end_date, cutoff_seconds, sort_key, descending
+
+
+@app.route('/api/analytics/attendance')
+def api_attendance_analytics():
+    """
+    Tasa de asistencia, ausencias, puntualidad y rachas de todos los usuarios
+    en un periodo (?start=&end=&cutoff=HH:MM&sort=&order=asc|desc).
+    Con ?format=csv se descarga la misma tabla.
+    """
+    if not session.get('is_admin'):
+        return jsonify({"error": "Acceso denegado."}), 403
+
+    start_date, end_date, cutoff_seconds, sort_key, descending = read_analytics_args()
+    try:
+        rows, summary, histogram = load_attendance_analytics(
+            get_db(read_only=True), start_date, end_date, cutoff_seconds, sort_key, descending
+        )
+    except Exception as e:
+        print(f"Error en la analítica de asistencia: {e}")
+        return jsonify({"error": "Error interno del servidor al calcular la analítica."}), 500
+
+    if request.args.get('format') == 'csv':
+        output = io.StringIO()
+        writer = csv.writer(output)
+        writer.writerow([label for _, label in ANALYTICS_CSV_COLUMNS])
+        for row in rows:
+            writer.writerow(['' if row[key] is None else row[key] for key, _ in ANALYTICS_CSV_COLUMNS])
+        filename = f"analitica_asistencia_{start_date.isoformat()}_{end_date.isoformat()}.csv"
+        return Response(
+            output.getvalue(),
+            mimetype="text/csv",
+            headers={"Content-Disposition": f"attachment; filename={filename}"}
+        )
+
+    return jsonify({
+        "start": start_date.isoformat(),
+        "end": end_date.isoformat(),
+        "cutoff": format_seconds(cutoff_seconds),
+        "sort": sort_key,
+        "order": "desc" if descending else "asc",
+        "summary": summary,
+        "histogram": histogram,
+        "users": rows,
+    })
+
+
+@app.route('/admin/analytics')
+def admin_analytics():
+    """Página de analítica: resumen, histograma de llegadas y tabla ordenable de usuarios."""
+    if not session.get('is_admin'):
+        return "Acceso denegado.", 403
+
+    start_date, end_date, cutoff_seconds, sort_key, descending = read_analytics_args()
+    try:
+        rows, summary, histogram = load_attendance_analytics(
+            get_db(read_only=True), start_date, end_date, cutoff_seconds, sort_key, descending
+        )
+    except Exception as e:
+        print(f"Error en la analítica de asistencia: {e}")
+        return f"Error interno del servidor al calcular la analítica: {e}", 500
+
+    return render_template(
+        'admin_analytics.html',
+        rows=rows,
+        summary=summary,
+        histogram=histogram,
+        histogram_max=max((bar['count'] for bar in histogram), default=0),
+        start_date=start_date,
+        end_date=end_date,
+        cutoff=format_seconds(cutoff_seconds),
+        sort_key=sort_key,
+        descending=descending,
+    )
+
+
+@app.route('/admin/db/pool')
+def admin_db_pool_stats():
+    """Devuelve las estadísticas del pool de conexiones (y de la réplica) de este worker (JSON)."""
+    if not session.get('is_admin'):
+        return jsonify({"error": "Acceso denegado."}), 403
+    stats = get_pool().stats()
+    stats['pid'] = os.getpid()
+    if DB_REPLICA_DSN:
+        stats['replica'] = replica_router.stats()
+    return jsonify(stats)
+
+
+@app.route('/admin/cache/checkin')
+def admin_checkin_cache_stats():
+    """Devuelve los aciertos/fallos de la caché de check-in de este worker (JSON)."""
+    if not session.get('is_admin'):
+        return jsonify({"error": "Acceso denegado."}), 403
+    stats = checkin_cache.stats()
+    stats['pid'] = os.getpid()
+    return jsonify(stats)
+
+
+@app.route('/admin/cache/attendance')
+def admin_attendance_cache_stats():
+    """Devuelve los aciertos/fallos de la caché de meses cerrados de este worker (JSON)."""
+    if not session.get('is_admin'):
+        return jsonify({"error": "Acceso denegado."}), 403
+    stats = attendance_cache.stats()
+    stats['pid'] = os.getpid()
+    return jsonify(stats)
+
+
+@app.route('/admin/checkin/buffer')
+def admin_checkin_buffer_stats():
+    """Profundidad de la cola y latencia de vaciado del búfer diferido de este worker (JSON)."""
+    if not session.get('is_admin'):
+        return jsonify({"error": "Acceso denegado."}), 403
+    if not CHECKIN_WRITE_BEHIND:
+        return jsonify({"enabled": False, "pid": os.getpid()})
+    stats = get_checkin_buffer().stats()
+    stats['enabled'] = True
+    stats['pid'] = os.getpid()
+    return jsonify(stats)
+
+
+@app.route('/metrics')
+def metrics():
+    """
+    Métricas en formato Prometheus. Igual que /admin/db/pool, las cifras son
+    del worker que atiende la solicitud; con varios workers de gunicorn cada
+    scrape ve solo uno de ellos.
+    """
+    authorized = session.get('is_admin')
+    if not authorized and METRICS_TOKEN:
+        authorized = hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {METRICS_TOKEN}')
+    if not authorized:
+        return "Acceso denegado.", 403
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
+
+@app.route('/healthz')
+def liveness():
+    """El proceso responde (no toca la base de datos)."""
+    return jsonify({"status": "ok"})
+
+
+@app.route('/readyz')
+def readiness():
+    """
+    Listo para recibir tráfico: la base responde y no hay migraciones pendientes.
+    Responde 503 en caso contrario, para que el balanceador no envíe solicitudes.
+    """
+    start = time.perf_counter()
+    try:
+        pending = schema_status(get_db())
+    except Exception as e:
+        print(f"Error en la verificación de disponibilidad: {e}")
+        return jsonify({"status": "unavailable", "database": "unreachable"}), 503
+
+    payload = {
+        "status": "ready" if not pending else "unavailable",
+        "database": "ok",
+        "database_ms": round((time.perf_counter() - start) * 1000, 3),
+        "pending_migrations": pending,
+        "import_seconds": round(APP_IMPORT_SECONDS, 3),
+    }
+    return jsonify(payload), 200 if not pending else 503
+
+
+@app.route('/admin/scanner')
+def admin_scanner():
+    """Muestra la interfaz del escáner QR (solo para admin)."""
+    if not session.get('is_admin'):
+        return "Acceso denegado.", 403
+    return render_template('admin_scanner.html')
+
+
+@app.route('/admin/badges.zip')
+def admin_badges_export():
+    """
+    Descarga (en streaming) un ZIP con los gafetes QR de un subconjunto de
+    usuarios filtrado por `q` (texto) o `ids` (lista separada por comas). Si
+    pasan de BADGE_SYNC_MAX_USERS (p. ej. todos los usuarios) se envía a la
+    página de trabajos en segundo plano, para no ocupar el worker.
+    """
+    if not session.get('is_admin'):
+        return "Acceso denegado.", 403
+
+    search_term = request.args.get('q', '').strip() or None
+    try:
+        user_ids = [int(value) for value in request.args.get('ids', '').split(',') if value.strip()]
+    except ValueError:
+        return "Parámetro 'ids' inválido.", 400
+
+    users = fetch_badge_users(get_db(read_only=True), search_term, user_ids, limit=BADGE_SYNC_MAX_USERS + 1)
+    if not users:
+        return "No hay usuarios que coincidan con el filtro.", 404
+    if len(users) > BADGE_SYNC_MAX_USERS:
+        flash(f"Más de {BADGE_SYNC_MAX_USERS} gafetes: genera el ZIP aquí como trabajo en segundo plano.", 'warning')
+        return redirect(url_for('admin_jobs'))
+
+    badges = build_badge_list(users)
+    return Response(
+        iter_badge_zip(badges),
+        mimetype='application/zip',
+        headers={"Content-Disposition": "attachment; filename=gafetes.zip"}
+    )
+
+
+# --- Trabajos en Segundo Plano (exportaciones y reportes largos) ---
+
+# Las exportaciones grandes (reporte de todo el historial, mes completo de la
+# organización, gafetes) pueden superar el timeout del worker de gunicorn si
+# se generan dentro de la solicitud. Como trabajo, la solicitud solo encola y
+# responde 202; un pool acotado de hilos de cada worker lo ejecuta y el
+# resultado queda en disco hasta que expira. Sin broker externo: el estado
+# vive en JOBS_DIR (compartido por los workers de la misma máquina), así
+# cualquier worker puede consultarlo o servir la descarga.
+JOBS_DIR = os.environ.get('JOBS_DIR', os.path.join(app.instance_path, 'jobs'))
+# Hilos por proceso que ejecutan trabajos, y trabajos que pueden esperar turno
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 2))
+JOB_MAX_QUEUED = int(os.environ.get('JOB_MAX_QUEUED', 20))
+# Segundos que se conserva el resultado (o el error) de un trabajo terminado
+JOB_RESULT_TTL = float(os.environ.get('JOB_RESULT_TTL', 24 * 3600))
+# Intervalo mínimo entre escrituras del progreso en disco
+JOB_PROGRESS_INTERVAL = 0.5
+
+JOB_ID_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+
+
+class JobQueueFull(Exception):
+    """No hay lugar en la cola de trabajos de este worker."""
+
+
+class JobKind:
+    """
+    Tipo de trabajo. `prepare(args)` corre en la solicitud: valida los
+    parámetros (ValueError con el mensaje para el usuario) y devuelve
+    (parámetros, descripción). `run(params, out, progress)` corre en el pool:
+    escribe el resultado en `out` (binario) y avisa progress(hechos, total).
+    """
+
+    __slots__ = ('name', 'title', 'prepare', 'run', 'extension', 'mimetype')
+
+    def __init__(self, name, title, prepare, run, extension, mimetype):
+        self.name = name
+        self.title = title
+        self.prepare = prepare
+        self.run = run
+        self.extension = extension
+        self.mimetype = mimetype
+
+
+def _job_now():
+    return datetime.datetime.now().isoformat(timespec='seconds')
+
+
+def _write_json_atomic(path, data):
+    """Escribe un JSON completo o nada: quien lee nunca ve un archivo a medias."""
+    tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as tmp:
+        json.dump(data, tmp, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+class JobRunner:
+    """
+    Ejecutor de trabajos de un proceso: un ThreadPoolExecutor de `workers`
+    hilos y a lo sumo `max_queued` trabajos esperando.
+
+    Cada trabajo tiene su directorio `<jobs_dir>/<id>/` con `job.json` (estado
+    y progreso), el resultado y `job.lock`. El proceso que lo aceptó sostiene
+    un flock sobre `job.lock` hasta terminarlo; un trabajo 'queued' o
+    'running' cuyo lock ya nadie sostiene quedó huérfano (el worker murió o se
+    reinició) y se informa como fallido.
+    """
+
+    def __init__(self, jobs_dir, workers, max_queued, ttl):
+        self.jobs_dir = jobs_dir
+        self.workers = workers
+        self.max_queued = max_queued
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix='job')
+        self._jobs = {}     # id -> estado de los trabajos de este proceso aún sin terminar
+        self._locks = {}    # id -> archivo con el flock
+        self._submitted = 0
+        self._completed = 0
+        self._failed = 0
+        os.makedirs(jobs_dir, exist_ok=True)
+
+    # Rutas
+    def job_dir(self, job_id):
+        return os.path.join(self.jobs_dir, job_id)
+
+    def result_path(self, job):
+        return os.path.join(self.job_dir(job['id']), f"result.{JOB_KINDS[job['kind']].extension}")
+
+    def submit(self, kind, params, description, created_by=None):
+        """Registra el trabajo en disco y lo encola. JobQueueFull si no hay lugar."""
+        with self._lock:
+            if len(self._jobs) >= self.workers + self.max_queued:
+                raise JobQueueFull()
+            job_id = uuid.uuid4().hex
+            self._jobs[job_id] = None  # Reserva el lugar mientras se crea en disco
+        try:
+            job = {
+                'id': job_id,
+                'kind': kind.name,
+                'title': kind.title,
+                'description': description,
+                'status': 'queued',
+                'progress': {'done': 0, 'total': None},
+                'created_at': _job_now(),
+                'started_at': None,
+                'finished_at': None,
+                'expires_at': None,
+                'error': None,
+                'filename': f"{kind.name}_{datetime.datetime.now():%Y%m%d_%H%M%S}.{kind.extension}",
+                'size': None,
+                'created_by': created_by,
+            }
+            # Se arma en un directorio temporal y se publica con rename, ya con
+            # el lock tomado: otro worker nunca ve el trabajo sin dueño.
+            tmp_dir = os.path.join(self.jobs_dir, f'.{job_id}.tmp')
+            os.makedirs(tmp_dir)
+            lock_file = open(os.path.join(tmp_dir, 'job.lock'), 'w')
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            _write_json_atomic(os.path.join(tmp_dir, 'job.json'), job)
+            os.rename(tmp_dir, self.job_dir(job_id))
+        except Exception:
+            with self._lock:
+                self._jobs.pop(job_id, None)
+            raise
+
+        with self._lock:
+            self._jobs[job_id] = job
+            self._locks[job_id] = lock_file
+            self._submitted += 1
+        self._executor.submit(self._execute, job_id, kind, params)
+        return dict(job)
+
+    def _save(self, job_id, **changes):
+        with self._lock:
+            job = self._jobs[job_id]
+            job.update(changes)
+            snapshot = dict(job)
+        _write_json_atomic(os.path.join(self.job_dir(job_id), 'job.json'), snapshot)
+        return snapshot
+
+    def _execute(self, job_id, kind, params):
+        self._save(job_id, status='running', started_at=_job_now())
+        last_write = [0.0]
+
+        def progress(done, total=None):
+            now = time.monotonic()
+            if now - last_write[0] >= JOB_PROGRESS_INTERVAL:
+                last_write[0] = now
+                self._save(job_id, progress={'done': done, 'total': total})
+
+        part_path = os.path.join(self.job_dir(job_id), 'result.part')
+        status = 'failed'
+        try:
+            start = time.perf_counter()
+            with open(part_path, 'wb') as out:
+                total = kind.run(params, out, progress)
+            result_path = os.path.join(self.job_dir(job_id), f'result.{kind.extension}')
+            os.replace(part_path, result_path)
+            status = 'done'
+            expires_at = datetime.datetime.now() + datetime.timedelta(seconds=self.ttl)
+            self._save(
+                job_id, status='done', finished_at=_job_now(), expires_at=expires_at.isoformat(timespec='seconds'),
+                size=os.path.getsize(result_path), progress={'done': total, 'total': total},
+            )
+            print(f"Trabajo {job_id} ({kind.name}) terminado en {time.perf_counter() - start:.2f}s")
+        except Exception as e:
+            print(f"Error en el trabajo {job_id} ({kind.name}): {e}")
+            try:
+                os.unlink(part_path)
+            except FileNotFoundError:
+                pass
+            expires_at = datetime.datetime.now() + datetime.timedelta(seconds=self.ttl)
+            self._save(job_id, status='failed', finished_at=_job_now(),
+                       expires_at=expires_at.isoformat(timespec='seconds'), error=str(e))
+        finally:
+            JOBS_FINISHED.inc(kind.name, status)
+            with self._lock:
+                self._jobs.pop(job_id, None)
+                lock_file = self._locks.pop(job_id)
+                if status == 'done':
+                    self._completed += 1
+                else:
+                    self._failed += 1
+            lock_file.close()
+
+    def _read(self, job_id):
+        try:
+            with open(os.path.join(self.job_dir(job_id), 'job.json'), encoding='utf-8') as status_file:
+                return json.load(status_file)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _check_orphan(self, job):
+        """Si el dueño de un trabajo en curso ya no vive, lo marca como fallido. Devuelve el estado vigente."""
+        lock_path = os.path.join(self.job_dir(job['id']), 'job.lock')
+        with open(lock_path, 'a') as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return job  # El dueño sigue vivo
+            # El dueño pudo terminarlo entre la lectura y el flock
+            job = self._read(job['id']) or job
+            if job['status'] in ('queued', 'running'):
+                expires_at = datetime.datetime.now() + datetime.timedelta(seconds=self.ttl)
+                job.update(
+                    status='failed', finished_at=_job_now(), expires_at=expires_at.isoformat(timespec='seconds'),
+                    error="El worker que ejecutaba el trabajo terminó antes de completarlo.",
+                )
+                _write_json_atomic(os.path.join(self.job_dir(job['id']), 'job.json'), job)
+        return job
+
+    def get(self, job_id):
+        """Estado de un trabajo (de cualquier worker); None si no existe o expiró."""
+        if not JOB_ID_PATTERN.match(job_id):
+            return None
+        job = self._read(job_id)
+        if job is None:
+            return None
+        if job['status'] in ('queued', 'running'):
+            job = self._check_orphan(job)
+        if job['expires_at'] and datetime.datetime.fromisoformat(job['expires_at']) <= datetime.datetime.now():
+            shutil.rmtree(self.job_dir(job_id), ignore_errors=True)
+            return None
+        return job
+
+    def list(self):
+        """Trabajos vigentes, del más reciente al más antiguo. De paso borra los expirados."""
+        jobs = []
+        for entry in os.listdir(self.jobs_dir):
+            if entry.startswith('.'):
+                continue
+            job = self.get(entry)
+            if job is not None:
+                jobs.append(job)
+        jobs.sort(key=lambda job: job['created_at'], reverse=True)
+        return jobs
+
+    def stats(self):
+        with self._lock:
+            running = sum(1 for job in self._jobs.values() if job and job['status'] == 'running')
+            return {
+                'workers': self.workers,
+                'max_queued': self.max_queued,
+                'running': running,
+                'queued': len(self._jobs) - running,
+                'submitted': self._submitted,
+                'completed': self._completed,
+                'failed': self._failed,
+                'result_ttl_seconds': self.ttl,
+            }
+
+
+_job_runner = None
+_job_runner_pid = None
+_job_runner_lock = threading.Lock()
+
+def get_job_runner():
+    """Devuelve el ejecutor de trabajos del proceso actual (uno por PID, como get_pool)."""
+    global _job_runner, _job_runner_pid
+    pid = os.getpid()
+    if _job_runner is None or _job_runner_pid != pid:
+        with _job_runner_lock:
+            if _job_runner is None or _job_runner_pid != pid:
+                _job_runner = JobRunner(JOBS_DIR, JOB_WORKERS, JOB_MAX_QUEUED, JOB_RESULT_TTL)
+                _job_runner_pid = pid
+    return _job_runner
+
+
+def _job_date(args, name):
+    """Lee una fecha 'YYYY-MM-DD' de los parámetros del trabajo; None si falta."""
+    value = str(args.get(name) or '').strip()
+    if not value:
+        return None
+    try:
+        return datetime.date.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f"Parámetro '{name}' inválido (formato YYYY-MM-DD).")
+
+
+def prepare_attendance_report_job(args):
+    """Reporte de check-ins de `start` a `end`; sin `start`, desde el primer registro."""
+    start_date = _job_date(args, 'start')
+    end_date = _job_date(args, 'end') or datetime.date.today()
+    if start_date is not None and start_date > end_date:
+        raise ValueError("La fecha 'start' no puede ser posterior a 'end'.")
+    since = start_date.isoformat() if start_date else 'el primer registro'
+    return {'start': start_date, 'end': end_date}, f"Check-ins desde {since} hasta {end_date.isoformat()}"
+
+
+def run_attendance_report_job(params, out, progress):
+    conn, putconn = getconn_read_only()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                "SELECT MIN(day), COALESCE(SUM(attendee_count), 0) FROM attendance_daily WHERE day >= %s AND day <= %s",
+                (params['start'] or datetime.date.min, params['end'])
+            )
+            first_day, total = cursor.fetchone()
+        conn.rollback()
+    finally:
+        putconn(conn)
+
+    text = io.TextIOWrapper(out, encoding='utf-8', newline='')
+    writer = csv.writer(text, delimiter=',')
+    writer.writerow(["Fecha", "Hora", "Apellido Paterno", "Apellido Materno", "Nombre(s)", "Telefono"])
+    done = 0
+    if first_day is not None:
+        rows = iter_attendance_report_rows(params['start'] or first_day, params['end'] + datetime.timedelta(days=1))
+        for record in rows:
+            writer.writerow([
+                record['date_key'], record['time'], record['paternal_last_name'],
+                record['maternal_last_name'], record['first_name'], record['phone_number'],
+            ])
+            done += 1
+            progress(done, total)
+    text.flush()
+    text.detach()
+    return done
+
+
+def prepare_organization_export_job(args):
+    """Mes completo de la organización (`month` = 'YYYY-MM')."""
+    try:
+        year, month = (int(part) for part in str(args.get('month') or '').strip().split('-'))
+        month_bounds(year, month)
+    except ValueError:
+        raise ValueError("Parámetro 'month' inválido (formato YYYY-MM).")
+    return {'year': year, 'month': month}, f"Asistencia de todos los empleados, {month:02d}/{year}"
+
+
+def run_organization_export_job(params, out, progress):
+    conn, putconn = getconn_read_only()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT COUNT(*) FROM users WHERE is_admin = FALSE")
+            total = cursor.fetchone()[0]
+            chunks = iter_organization_export(cursor, params['year'], params['month'])
+        conn.rollback()
+    finally:
+        putconn(conn)
+
+    # Cuatro líneas de metadatos y el encabezado antes de una fila por usuario
+    lines = 0
+    for chunk in chunks:
+        out.write(chunk)
+        lines += chunk.count(b'\n')
+        progress(max(0, min(lines - 5, total)), total)
+    return total
+
+
+def prepare_badges_job(args):
+    """Gafetes de todos los usuarios o de los filtrados por `q` o `ids`. La lista se arma en la solicitud (URLs externas)."""
+    search_term = str(args.get('q') or '').strip() or None
+    ids = args.get('ids') or []
+    try:
+        if isinstance(ids, str):
+            ids = ids.split(',')
+        user_ids = [int(value) for value in ids if str(value).strip()]
+    except ValueError:
+        raise ValueError("Parámetro 'ids' inválido.")
+    users = fetch_badge_users(get_db(read_only=True), search_term, user_ids)
+    if not users:
+        raise ValueError("No hay usuarios que coincidan con el filtro.")
+    return {'badges': build_badge_list(users)}, f"Gafetes QR de {len(users)} usuario(s)"
+
+
+def run_badges_job(params, out, progress):
+    badges = params['badges']
+    total = len(badges)
+    rendered = 0
+    # iter_badge_zip entrega un fragmento por gafete y uno final (manifiesto y resumen)
+    for chunk in iter_badge_zip(badges):
+        out.write(chunk)
+        rendered = min(rendered + 1, total)
+        progress(rendered, total)
+    return total
+
+
+JOB_KINDS = {kind.name: kind for kind in (
+    JobKind('attendance_report', 'Reporte general de asistencias (CSV)',
+            prepare_attendance_report_job, run_attendance_report_job, 'csv', 'text/csv'),
+    JobKind('organization_export', 'Exportación mensual de la organización (CSV)',
+            prepare_organization_export_job, run_organization_export_job, 'csv', 'text/csv'),
+    JobKind('badges', 'Gafetes QR (ZIP)',
+            prepare_badges_job, run_badges_job, 'zip', 'application/zip'),
+)}
+
+
+def job_payload(job):
+    """Estado de un trabajo para el API, con la URL de descarga si ya terminó."""
+    payload = dict(job)
+    payload['status_url'] = url_for('api_job_status', job_id=job['id'])
+    payload['download_url'] = url_for('api_job_download', job_id=job['id']) if job['status'] == 'done' else None
+    return payload
+
+
+@app.route('/admin/jobs')
+def admin_jobs():
+    """Página para encolar exportaciones largas y seguir su avance."""
+    if not session.get('is_admin'):
+        return "Acceso denegado.", 403
+    jobs = [job_payload(job) for job in get_job_runner().list()]
+    return render_template('admin_jobs.html', jobs=jobs, kinds=JOB_KINDS, today=datetime.date.today())
+
+
+@app.route('/api/jobs', methods=['GET', 'POST'])
+def api_jobs():
+    """
+    GET: trabajos vigentes y estado del ejecutor de este worker.
+    POST: encola un trabajo (`kind` y sus parámetros, en JSON o formulario).
+    Responde 202 con el estado y `Location`; 503 si la cola está llena.
+    """
+    if not session.get('is_admin'):
+        return jsonify({"error": "Acceso denegado."}), 403
+
+    runner = get_job_runner()
+    if request.method == 'GET':
+        stats = runner.stats()
+        stats['pid'] = os.getpid()
+        return jsonify({"jobs": [job_payload(job) for job in runner.list()], "runner": stats})
+
+    args = request.get_json(silent=True) if request.is_json else request.form
+    if not isinstance(args, dict):
+        return jsonify({"error": "Se esperaba un objeto JSON."}), 400
+    kind = JOB_KINDS.get(args.get('kind'))
+    if kind is None:
+        return jsonify({"error": f"Tipo de trabajo desconocido. Opciones: {', '.join(JOB_KINDS)}"}), 400
+    try:
+        params, description = kind.prepare(args)
+        job = runner.submit(kind, params, description, created_by=session.get('username'))
+    except ValueError as e:
+        if not request.is_json:
+            flash(str(e), 'error')
+            return redirect(url_for('admin_jobs'))
+        return jsonify({"error": str(e)}), 400
+    except JobQueueFull:
+        message = "Hay demasiados trabajos en curso. Intente de nuevo en unos minutos."
+        if not request.is_json:
+            flash(message, 'warning')
+            return redirect(url_for('admin_jobs'))
+        return jsonify({"error": message}), 503, {"Retry-After": "30"}
+
+    if not request.is_json:
+        flash(f"Trabajo encolado: {description}.", 'success')
+        return redirect(url_for('admin_jobs'))
+    payload = job_payload(job)
+    return jsonify(payload), 202, {"Location": payload['status_url']}
+
+
+@app.route('/api/jobs/<job_id>')
+def api_job_status(job_id):
+    """Estado y progreso de un trabajo (JSON)."""
+    if not session.get('is_admin'):
+        return jsonify({"error": "Acceso denegado."}), 403
+    job = get_job_runner().get(job_id)
+    if job is None:
+        return jsonify({"error": "Trabajo no encontrado o expirado."}), 404
+    return jsonify(job_payload(job))
+
+
+@app.route('/api/jobs/<job_id>/download')
+def api_job_download(job_id):
+    """Descarga el resultado de un trabajo terminado."""
+    if not session.get('is_admin'):
+        return "Acceso denegado.", 403
+    runner = get_job_runner()
+    job = runner.get(job_id)
+    if job is None:
+        return "Trabajo no encontrado o expirado.", 404
+    if job['status'] != 'done':
+        return "El trabajo aún no tiene un resultado para descargar.", 409
+    return send_file(
+        runner.result_path(job),
+        mimetype=JOB_KINDS[job['kind']].mimetype,
+        as_attachment=True,
+        download_name=job['filename'],
+    )
+
+
+# --- RUTA DE PRUEBA DE ESCÁNER ---
+@app.route('/test_scanner')
+def test_scanner_route():
+    """Ruta para servir la página de prueba de carga de la librería y cámara."""
+    return render_template('test_scanner.html')
+
+
+# --- Rutas de Usuario y Asistencia ---
+
+def build_checkin_url(qr_uuid):
+    """URL completa de check-in que se codifica dentro del QR."""
+    return request.host_url.rstrip('/') + url_for('check_in', qr_uuid=qr_uuid)
+
+
+@app.route('/qrcode')
+def show_qr():
+    """Muestra el código QR único del usuario logueado."""
+    if 'user_id' not in session or session.get('is_admin'):
+        return redirect(url_for('index'))
+
+    db = get_db()
+    # 🚨 CAMBIO 17: Usar DictCursor
+    cursor = db.cursor(cursor_factory=psycopg2.extras.DictCursor)
+    
+    cursor.execute("SELECT qr_code_uuid FROM users WHERE id = %s", (session.get('user_id'),))
+    result = cursor.fetchone()
+    # 🚨 CAMBIO 18: El UUID es un objeto UUID en Python, necesitamos convertirlo a string si no lo está.
+    qr_uuid_obj = result.get('qr_code_uuid') if result else None
+    qr_uuid = str(qr_uuid_obj) if qr_uuid_obj else None
+
+    if not qr_uuid:
+        return "Error: UUID no encontrado para el usuario.", 500
+
+    # Genera la URL completa que contiene el UUID
+    checkin_url = build_checkin_url(qr_uuid)
+
+    # La imagen se sirve aparte (cacheable). El parámetro `v` cambia con el
+    # contenido del QR (p. ej. si cambia el host), así la URL puede ser inmutable.
+    qr_image_url = url_for('qr_image', qr_uuid=qr_uuid, fmt='svg', v=qr_image_etag(checkin_url, 'svg')[:16])
+
+    # Nota: Requiere que 'qr_viewer.html' exista.
+    return render_template('qr_viewer.html', qr_image_url=qr_image_url, checkin_url=checkin_url)
+
+
+@app.route('/qrcode/<qr_uuid>.<fmt>')
+def qr_image(qr_uuid, fmt):
+    """
+    Sirve la imagen QR (PNG o SVG) de un UUID con ETag fuerte y caché larga.
+    La mayoría de las solicitudes terminan en 304 o en un acierto de la caché LRU.
+    """
+    if 'user_id' not in session:
+        return "Acceso denegado.", 403
+    if fmt not in QR_IMAGE_FORMATS:
+        return "Formato no soportado.", 404
+    try:
+        qr_uuid = str(uuid.UUID(qr_uuid))
+    except ValueError:
+        return "UUID inválido.", 404
+
+    checkin_url = build_checkin_url(qr_uuid)
+    etag = qr_image_etag(checkin_url, fmt)
+
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = Response(render_qr_image(checkin_url, fmt), mimetype=QR_IMAGE_FORMATS[fmt])
+    response.set_etag(etag)
+    # Privada: solo el navegador del usuario la guarda. Inmutable mientras la URL
+    # lleve la versión `v`; el ETag cubre las solicitudes sin ella.
+    response.headers['Cache-Control'] = 'private, max-age=31536000, immutable'
+    return response
+
+
+# --- Caché en Memoria para Check-in ---
+
+class CheckinCache:
+    """
+    Caché por proceso para los escaneos repetidos:
+    - LRU acotada de qr_code_uuid -> (id, nombre completo, nombre a mostrar).
+    - Conjunto de IDs de usuario que ya registraron asistencia hoy; se vacía
+      solo al cambiar la fecha local (medianoche).
+    Con ambos, un segundo escaneo del mismo gafete se responde sin ir a PostgreSQL.
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._users = OrderedDict()
+        self._day = datetime.date.today()
+        self._checked_in = set()
+        self._hits = 0
+        self._misses = 0
+        self._today_hits = 0
+        self._invalidations = 0
+
+    def _roll_day(self):
+        today = datetime.date.today()
+        if today != self._day:
+            self._day = today
+            self._checked_in.clear()
+
+    def get_user(self, qr_uuid):
+        """Devuelve (user_id, full_name, display_name) o None, contando aciertos y fallos."""
+        with self._lock:
+            entry = self._users.get(qr_uuid)
+            if entry is None:
+                self._misses += 1
+                return None
+            self._users.move_to_end(qr_uuid)
+            self._hits += 1
+            return entry
+
+    def put_user(self, qr_uuid, user_id, full_name, display_name):
+        with self._lock:
+            self._users[qr_uuid] = (user_id, full_name, display_name)
+            self._users.move_to_end(qr_uuid)
+            while len(self._users) > self.maxsize:
+                self._users.popitem(last=False)
+
+    def is_checked_in_today(self, user_id):
+        with self._lock:
+            self._roll_day()
+            if user_id in self._checked_in:
+                self._today_hits += 1
+                return True
+            return False
+
+    def mark_checked_in(self, user_id, day=None):
+        """Registra que el usuario ya tiene asistencia `day` (hoy por defecto)."""
+        with self._lock:
+            self._roll_day()
+            if day is None or day == self._day:
+                self._checked_in.add(user_id)
+
+    def claim_checked_in(self, user_id):
+        """Marca al usuario como registrado hoy; False si ya lo estaba (dos escaneos simultáneos)."""
+        with self._lock:
+            self._roll_day()
+            if user_id in self._checked_in:
+                self._today_hits += 1
+                return False
+            self._checked_in.add(user_id)
+            return True
+
+    def invalidate_user(self, user_id):
+        """Olvida los datos en caché de un usuario (p. ej. si falla la escritura diferida de su check-in)."""
+        with self._lock:
+            for qr_uuid in [key for key, entry in self._users.items() if entry[0] == user_id]:
+                del self._users[qr_uuid]
+            self._checked_in.discard(user_id)
+            self._invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._users.clear()
+            self._checked_in.clear()
+            self._invalidations += 1
+
+    def stats(self):
+        with self._lock:
+            self._roll_day()
+            lookups = self._hits + self._misses
+            return {
+                'size': len(self._users),
+                'max': self.maxsize,
+                'hits': self._hits,
+                'misses': self._misses,
+                'hit_rate': round(self._hits / lookups, 4) if lookups else 0.0,
+                'checked_in_today': len(self._checked_in),
+                'today_hits': self._today_hits,
+                'invalidations': self._invalidations,
+                'day': self._day.isoformat(),
+            }
+
+
+CHECKIN_CACHE_SIZE = int(os.environ.get('CHECKIN_CACHE_SIZE', 10000))
+checkin_cache = CheckinCache(CHECKIN_CACHE_SIZE)
+
+
+# La hora de cada check-in la pone la aplicación, no CURRENT_TIMESTAMP del
+# servidor de base de datos (que puede estar en otra zona horaria, UTC en
+# Neon). Así el camino síncrono, el modo diferido, los lotes de kiosco y la
+# caché de "hoy" coinciden en el día de cada registro.
+def checkin_now():
+    """Hora local sin zona con la que se registran todos los check-ins."""
+    return datetime.datetime.now()
+
+
+# Registro de asistencia en una sola sentencia: busca al usuario por UUID e
+# inserta la asistencia del día; la restricción única (user_id, check_in_date)
+# convierte un segundo escaneo del mismo día en "no insertado" sin carreras.
+CHECKIN_SQL = """
+    WITH u AS (
+        SELECT id, username, first_name, paternal_last_name, maternal_last_name
+        FROM users
+        WHERE qr_code_uuid = %s AND is_admin = FALSE
+    ), ins AS (
+        INSERT INTO attendance (user_id, check_in_time, check_in_date)
+        SELECT u.id, t.checked_in_at, t.checked_in_at::DATE
+        FROM u, (SELECT %s::timestamp AS checked_in_at) t
+        ON CONFLICT (user_id, check_in_date) DO NOTHING
+        RETURNING user_id
+    )
+    SELECT u.*, EXISTS (SELECT 1 FROM ins) AS inserted
+    FROM u
+"""
+
+
+INVALID_QR_MESSAGE = "Código QR inválido o el usuario es administrador."
+
+
+def cached_checkin_result(qr_uuid):
+    """
+    (mensaje, estado, nombre) si la caché sabe que el gafete ya registró hoy;
+    None si hay que ir a la base de datos.
+    """
+    cached_user = checkin_cache.get_user(qr_uuid)
+    if cached_user is not None:
+        user_id, full_name, display_name = cached_user
+        if checkin_cache.is_checked_in_today(user_id):
+            return f"¡Atención {display_name}! Ya registraste tu asistencia el día de hoy.", "warning", full_name
+    return None
+
+
+def checkin_display_names(user_row):
+    """Devuelve (nombre completo, nombre a mostrar) de una fila de usuario."""
+    # 💡 NUEVO CÓDIGO: Construir el nombre completo
+    name_parts = [
+        user_row.get('first_name', ''), 
+        user_row.get('paternal_last_name', ''), 
+        user_row.get('maternal_last_name', '')
+    ]
+    # Creamos el nombre completo, quitando espacios extra si faltan apellidos.
+    full_name = " ".join(filter(None, name_parts)).strip()
+    
+    # Usamos el nombre completo para el mensaje, si existe, o el nombre de usuario por defecto
+    display_name = full_name if full_name else user_row['username']
+    return full_name, display_name
+
+
+def checkin_result_from_row(qr_uuid, user_row):
+    """Traduce la fila devuelta por CHECKIN_SQL a (mensaje, estado, nombre) y actualiza la caché."""
+    if user_row is None:
+        # Si falla, full_name sigue siendo None, y el template lo manejará.
+        return INVALID_QR_MESSAGE, "error", None
+
+    full_name, display_name = checkin_display_names(user_row)
+
+    # En ambos casos el usuario ya tiene su registro de hoy
+    checkin_cache.put_user(qr_uuid, user_row['id'], full_name, display_name)
+    checkin_cache.mark_checked_in(user_row['id'])
+
+    if user_row['inserted']:
+        return f"¡Asistencia registrada con éxito para {display_name}!", "success", full_name
+    # La restricción única rechazó el INSERT: ya registró asistencia hoy
+    return f"¡Atención {display_name}! Ya registraste tu asistencia el día de hoy.", "warning", full_name
+
+
+# --- Check-in con Escritura Diferida (write-behind) ---
+
+# Opcional: con CHECKIN_WRITE_BEHIND=1 el escaneo de un gafete conocido se
+# confirma en cuanto queda escrito en un diario local, y un hilo lo inserta
+# en `attendance` por lotes. Así una base de datos lenta no detiene a los escáneres.
+CHECKIN_WRITE_BEHIND = os.environ.get('CHECKIN_WRITE_BEHIND', '0') == '1'
+CHECKIN_JOURNAL_DIR = os.environ.get('CHECKIN_JOURNAL_DIR', os.path.join(app.instance_path, 'checkin-journal'))
+# Se vacía el búfer cada N ms o en cuanto junta M escaneos (lo que ocurra primero)
+CHECKIN_FLUSH_INTERVAL_MS = int(os.environ.get('CHECKIN_FLUSH_INTERVAL_MS', 200))
+CHECKIN_FLUSH_MAX_RECORDS = int(os.environ.get('CHECKIN_FLUSH_MAX_RECORDS', 500))
+# fsync por escaneo: sin él, un corte de luz puede perder los últimos escaneos confirmados
+CHECKIN_JOURNAL_FSYNC = os.environ.get('CHECKIN_JOURNAL_FSYNC', '1') == '1'
+# Espera tras un fallo al insertar antes de reintentar el mismo lote
+CHECKIN_FLUSH_RETRY_SECONDS = float(os.environ.get('CHECKIN_FLUSH_RETRY_SECONDS', 2))
+
+# DISTINCT ON deja un registro por usuario y día dentro del lote; la restricción
+# única descarta los que ya estaban en la tabla (p. ej. al repetir un diario).
+# El JOIN con users evita que un usuario borrado bloquee el lote por la llave foránea.
+CHECKIN_FLUSH_SQL = """
+    INSERT INTO attendance (user_id, check_in_time, check_in_date)
+    SELECT DISTINCT ON (j.user_id, j.scanned_at::DATE) j.user_id, j.scanned_at, j.scanned_at::DATE
+    FROM unnest(%s::int[], %s::timestamp[]) AS j (user_id, scanned_at)
+    JOIN users u ON u.id = j.user_id
+    ORDER BY j.user_id, j.scanned_at::DATE, j.scanned_at
+    ON CONFLICT (user_id, check_in_date) DO NOTHING
+"""
+
+CHECKIN_WARMUP_USERS_SQL = """
+    SELECT qr_code_uuid::TEXT AS qr_code_uuid, id, username, first_name, paternal_last_name, maternal_last_name
+    FROM users
+    WHERE is_admin = FALSE AND qr_code_uuid IS NOT NULL
+    ORDER BY id DESC
+    LIMIT %s
+"""
+
+
+class WriteBehindBuffer:
+    """
+    Búfer de check-ins con diario local duradero, uno por proceso.
+
+    Cada escaneo aceptado se agrega como una línea JSON al segmento actual del
+    diario (`journal-<token>-<n>.jsonl`) antes de confirmarse. El hilo de
+    vaciado rota el segmento, inserta el lote en una sola sentencia y borra el
+    segmento solo cuando el INSERT se confirmó; si falla, el lote vuelve a la
+    cola y el segmento se conserva.
+
+    El proceso mantiene un flock sobre `worker-<token>.lock` mientras vive. Al
+    arrancar, los segmentos cuyo lock ya nadie sostiene pertenecen a un
+    proceso caído: se renombran a este proceso y se reinsertan (replay).
+    """
+
+    def __init__(self, journal_dir, interval_ms, max_records, fsync, retry_seconds):
+        self.journal_dir = journal_dir
+        self.interval = interval_ms / 1000.0
+        self.max_records = max_records
+        self.fsync = fsync
+        self.retry_seconds = retry_seconds
+        self.token = uuid.uuid4().hex
+
+        self._cond = threading.Condition()
+        self._pending = []      # (user_id, scanned_at) aún no insertados
+        self._retained = []     # Segmentos cerrados cuyo contenido sigue en _pending
+        self._segment_seq = 0
+        self._segment_path = None
+        self._segment = None
+        self._lock_file = None
+        self._stopping = False
+        self._thread = None
+
+        self._appended = 0
+        self._replayed = 0
+        self._flushes = 0
+        self._flushed = 0
+        self._inserted = 0
+        self._failures = 0
+        self._last_error = None
+        self._flush_last = 0.0
+        self._flush_total = 0.0
+        self._flush_max = 0.0
+
+    # Rutas del diario
+    def _lock_path(self, token):
+        return os.path.join(self.journal_dir, f'worker-{token}.lock')
+
+    def _segment_paths(self, token):
+        return sorted(glob.glob(os.path.join(self.journal_dir, f'journal-{token}-*.jsonl')))
+
+    def _open_segment(self):
+        self._segment_seq += 1
+        self._segment_path = os.path.join(self.journal_dir, f'journal-{self.token}-{self._segment_seq:08d}.jsonl')
+        self._segment = open(self._segment_path, 'a', encoding='utf-8')
+
+    def start(self):
+        """Toma el lock del proceso, repite los diarios huérfanos y arranca el hilo de vaciado."""
+        os.makedirs(self.journal_dir, exist_ok=True)
+        # El lock se crea ya bloqueado y luego se renombra: otro proceso nunca
+        # puede verlo libre y tomarlo por huérfano.
+        tmp_path = os.path.join(self.journal_dir, f'.worker-{self.token}.tmp')
+        self._lock_file = open(tmp_path, 'w')
+        fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        os.rename(tmp_path, self._lock_path(self.token))
+
+        self._replay_orphans()
+        self._open_segment()
+        self._thread = threading.Thread(target=self._run, name='checkin-flusher', daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def _orphan_tokens(self):
+        tokens = set()
+        for path in glob.glob(os.path.join(self.journal_dir, 'worker-*.lock')):
+            tokens.add(os.path.basename(path)[len('worker-'):-len('.lock')])
+        for path in glob.glob(os.path.join(self.journal_dir, 'journal-*-*.jsonl')):
+            tokens.add(os.path.basename(path).split('-')[1])
+        tokens.discard(self.token)
+        return sorted(tokens)
+
+    def _replay_orphans(self):
+        """Adopta los segmentos de procesos caídos y encola sus escaneos."""
+        replay_seq = 0
+        for token in self._orphan_tokens():
+            lock_path = self._lock_path(token)
+            with open(lock_path, 'a') as orphan_lock:
+                try:
+                    fcntl.flock(orphan_lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    continue  # El proceso dueño sigue vivo
+                for path in self._segment_paths(token):
+                    replay_seq += 1
+                    adopted = os.path.join(self.journal_dir, f'journal-{self.token}-replay{replay_seq:06d}.jsonl')
+                    os.rename(path, adopted)
+                    records = self._read_segment(adopted)
+                    with self._cond:
+                        self._pending.extend(records)
+                        self._retained.append(adopted)
+                        self._replayed += len(records)
+                    for user_id, scanned_at in records:
+                        checkin_cache.mark_checked_in(user_id, scanned_at.date())
+                try:
+                    os.unlink(lock_path)
+                except FileNotFoundError:
+                    pass
+
+    @staticmethod
+    def _read_segment(path):
+        records = []
+        with open(path, encoding='utf-8') as segment:
+            for line in segment:
+                try:
+                    entry = json.loads(line)
+                    records.append((int(entry['u']), datetime.datetime.fromisoformat(entry['t'])))
+                except (ValueError, KeyError, TypeError):
+                    # Línea incompleta: el proceso cayó a mitad de la escritura
+                    # (antes de confirmar ese escaneo)
+                    print(f"Línea inválida en el diario de check-in {path}: {line!r}")
+        return records
+
+    def append(self, user_id, scanned_at):
+        """Escribe el escaneo en el diario (duradero al volver) y lo encola."""
+        line = json.dumps({'u': user_id, 't': scanned_at.isoformat()}) + '\n'
+        with self._cond:
+            self._segment.write(line)
+            self._segment.flush()
+            if self.fsync:
+                os.fsync(self._segment.fileno())
+            self._pending.append((user_id, scanned_at))
+            self._appended += 1
+            if len(self._pending) >= self.max_records:
+                self._cond.notify()
+
+    def _take_batch(self):
+        """Saca todo lo pendiente y rota el segmento (bajo el lock)."""
+        batch = self._pending
+        self._pending = []
+        if self._segment.tell() > 0:
+            self._segment.close()
+            self._retained.append(self._segment_path)
+            self._open_segment()
+        segments = self._retained
+        self._retained = []
+        return batch, segments
+
+    def _flush(self, batch, segments):
+        start = time.perf_counter()
+        conn = get_pool().getconn()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(CHECKIN_FLUSH_SQL, ([user_id for user_id, _ in batch], [scanned_at for _, scanned_at in batch]))
+                inserted = cursor.rowcount
+            conn.commit()
+        finally:
+            get_pool().putconn(conn)
+        elapsed = time.perf_counter() - start
+
+        # Ya está en PostgreSQL: los segmentos sobran
+        for path in segments:
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+        with self._cond:
+            self._flushes += 1
+            self._flushed += len(batch)
+            self._inserted += inserted
+            self._flush_last = elapsed
+            self._flush_total += elapsed
+            self._flush_max = max(self._flush_max, elapsed)
+
+    def flush_once(self):
+        """Vacía lo pendiente en un lote. Devuelve False si el INSERT falló."""
+        with self._cond:
+            batch, segments = self._take_batch()
+        if not batch:
+            for path in segments:
+                os.unlink(path)
+            return True
+        try:
+            self._flush(batch, segments)
+            return True
+        except Exception as e:
+            print(f"Error al vaciar el búfer de check-in ({len(batch)} escaneos): {e}")
+            with self._cond:
+                # Se reencolan delante, conservando los segmentos para un posible replay
+                self._pending[:0] = batch
+                self._retained[:0] = segments
+                self._failures += 1
+                self._last_error = str(e)
+            return False
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self._stopping and len(self._pending) < self.max_records:
+                    self._cond.wait(self.interval)
+                stopping = self._stopping
+            ok = self.flush_once()
+            if stopping:
+                return
+            if not ok:
+                with self._cond:
+                    self._cond.wait(self.retry_seconds)
+
+    def stop(self):
+        """Detiene el hilo y hace un último vaciado; si falla, el diario queda para el replay."""
+        with self._cond:
+            if self._stopping:
+                return
+            self._stopping = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join(timeout=30)
+        with self._cond:
+            clean = not self._pending and not self._retained
+            empty = self._segment.tell() == 0
+            self._segment.close()
+        if empty:
+            os.unlink(self._segment_path)
+        if clean:
+            os.unlink(self._lock_path(self.token))
+        self._lock_file.close()
+
+    def stats(self):
+        with self._cond:
+            return {
+                'queue_depth': len(self._pending),
+                'segments': len(self._retained) + 1,
+                'appended': self._appended,
+                'replayed': self._replayed,
+                'flushes': self._flushes,
+                'flushed': self._flushed,
+                'inserted': self._inserted,
+                'duplicates': self._flushed - self._inserted,
+                'failures': self._failures,
+                'last_error': self._last_error,
+                'flush_last_ms': round(self._flush_last * 1000, 3),
+                'flush_avg_ms': round(self._flush_total / self._flushes * 1000, 3) if self._flushes else 0.0,
+                'flush_max_ms': round(self._flush_max * 1000, 3),
+                'interval_ms': int(self.interval * 1000),
+                'max_records': self.max_records,
+            }
+
+
+def warm_checkin_cache(db):
+    """Carga en la caché los gafetes y los registros de hoy (el modo diferido solo confirma gafetes conocidos)."""
+    cursor = db.cursor(cursor_factory=psycopg2.extras.DictCursor)
+    try:
+        cursor.execute(CHECKIN_WARMUP_USERS_SQL, (CHECKIN_CACHE_SIZE,))
+        for user_row in cursor.fetchall():
+            full_name, display_name = checkin_display_names(user_row)
+            checkin_cache.put_user(user_row['qr_code_uuid'], user_row['id'], full_name, display_name)
+        cursor.execute("SELECT user_id FROM attendance WHERE check_in_date = %s", (datetime.date.today(),))
+        for (user_id,) in cursor.fetchall():
+            checkin_cache.mark_checked_in(user_id)
+        db.commit()
+    finally:
+        cursor.close()
+
+
+_checkin_buffer = None
+_checkin_buffer_pid = None
+_checkin_buffer_lock = threading.Lock()
+
+def get_checkin_buffer():
+    """
+    Devuelve el búfer diferido del proceso actual (None si el modo está apagado).
+    Igual que get_pool, se crea por PID: cada worker tiene su propio diario y lock.
+    """
+    global _checkin_buffer, _checkin_buffer_pid
+    if not CHECKIN_WRITE_BEHIND:
+        return None
+    pid = os.getpid()
+    if _checkin_buffer is None or _checkin_buffer_pid != pid:
+        with _checkin_buffer_lock:
+            if _checkin_buffer is None or _checkin_buffer_pid != pid:
+                conn = get_pool().getconn()
+                try:
+                    warm_checkin_cache(conn)
+                finally:
+                    get_pool().putconn(conn)
+                buffer = WriteBehindBuffer(
+                    CHECKIN_JOURNAL_DIR, CHECKIN_FLUSH_INTERVAL_MS, CHECKIN_FLUSH_MAX_RECORDS,
+                    CHECKIN_JOURNAL_FSYNC, CHECKIN_FLUSH_RETRY_SECONDS,
+                )
+                buffer.start()
+                _checkin_buffer = buffer
+                _checkin_buffer_pid = pid
+    return _checkin_buffer
 
 
-@app.route('/api/attendance/user/<int:user_id>/<int:year>/<int:month>')
-def get_individual_attendance(user_id, year, month):
+def write_behind_checkin(qr_uuid):
     """
-    Devuelve los días asistidos por un usuario y los días activos del sistema
-    para un mes específico, incluyendo la hora de check-in del usuario.
+    Registra el escaneo en el búfer diferido si el gafete está en caché.
+    Devuelve (mensaje, estado, nombre), o None si hay que usar el camino síncrono.
     """
-    if not session.get('is_admin'):
-        return jsonify({"error": "Acceso denegado."}), 403
+    try:
+        buffer = get_checkin_buffer()
+    except Exception as e:
+        print(f"Error al iniciar el búfer de check-in: {e}")
+        return None
+    if buffer is None:
+        return None
+    cached_user = checkin_cache.get_user(qr_uuid)
+    if cached_user is None:
+        return None
 
-    db = None
-    cursor = None
+    user_id, full_name, display_name = cached_user
+    if not checkin_cache.claim_checked_in(user_id):
+        return f"¡Atención {display_name}! Ya registraste tu asistencia el día de hoy.", "warning", full_name
     try:
-        db = get_db()
-        # 🚨 CAMBIO 13: Usar DictCursor para los fetchall
-        cursor = db.cursor(cursor_factory=psycopg2.extras.DictCursor)
+        buffer.append(user_id, checkin_now())
+    except Exception as e:
+        print(f"Error al escribir en el diario de check-in: {e}")
+        checkin_cache.invalidate_user(user_id)
+        return None
+    return f"¡Asistencia registrada con éxito para {display_name}!", "success", full_name
 
-        start_date = datetime.date(year, month, 1)
-        if month == 12:
-            end_date = datetime.date(year + 1, 1, 1)
-        else:
-            end_date = datetime.date(year, month + 1, 1)
 
-        # 1. Obtener todas las asistencias del USUARIO
-        cursor.execute(
-            """
-            SELECT check_in_time
-            FROM attendance
-            WHERE user_id = %s
-              AND check_in_time >= %s
-              AND check_in_time < %s
-            ORDER BY check_in_time ASC
-            """,
-            (user_id, start_date, end_date)
-        )
-        
-        # Almacenaremos la hora del primer check-in del día
-        attended_records = {} 
-        for record in cursor.fetchall():
-            check_in_dt = record['check_in_time'] # Objeto datetime de Python
-            date_key = check_in_dt.strftime('%Y-%m-%d')
-            time_str = check_in_dt.strftime('%H:%M') # 🚨 Formato de hora (sin segundos para la visualización)
-            
-            # Solo se guarda el primer registro de la hora más temprana del día
-            if date_key not in attended_records:
-                attended_records[date_key] = time_str
+@app.route('/checkin/<qr_uuid>')
+def check_in(qr_uuid):
+    """Ruta que es accedida al escanear el código QR para registrar la asistencia."""
+    # Un UUID mal formado no puede existir en la tabla: se responde sin ir a la base
+    try:
+        uuid.UUID(qr_uuid)
+    except ValueError:
+        return build_checkin_response(INVALID_QR_MESSAGE, "error")
 
-        # 2. Obtener días activos del SISTEMA (Global)
-        # 🚨 CAMBIO 14: Usar DATE() en PostgreSQL es check_in_time::DATE
-        cursor.execute(
-            """
-            SELECT DISTINCT check_in_time::DATE as active_date
-            FROM attendance
-            WHERE check_in_time >= %s
-              AND check_in_time < %s
-            """,
-            (start_date, end_date)
-        )
-        # El resultado de active_date es un objeto date en Python, se necesita formatear
-        system_active_days = [record['active_date'].strftime('%Y-%m-%d') for record in cursor.fetchall() if record.get('active_date')]
+    # Escaneo repetido de un gafete que ya registró hoy: se responde desde la caché
+    cached_result = cached_checkin_result(qr_uuid)
+    if cached_result is not None:
+        return build_checkin_response(*cached_result)
 
-        # 3. Respuesta del API
-        return jsonify({
-            "attended_days": list(attended_records.keys()),
-            "attended_times": attended_records,  # 🚨 NUEVO DATO: { 'YYYY-MM-DD': 'HH:MM' }
-            "system_active_days": system_active_days
-        })
+    # Modo diferido: gafete conocido, se confirma tras escribirlo en el diario local
+    buffered_result = write_behind_checkin(qr_uuid)
+    if buffered_result is not None:
+        return build_checkin_response(*buffered_result)
+
+    db = get_db()
+    cursor = db.cursor(cursor_factory=psycopg2.extras.DictCursor)
 
+    try:
+        # Autocommit: la sentencia única viaja sin BEGIN/COMMIT adicionales (un solo viaje)
+        db.autocommit = True
+        cursor.execute(CHECKIN_SQL, (qr_uuid, checkin_now()))
+        user_row = cursor.fetchone()
     except Exception as e:
-        print(f"Error al obtener datos de asistencia: {e}")
-        return jsonify({"error": "Error interno del servidor al obtener datos de asistencia."}), 500
+        return build_checkin_response(f"Error al registrar asistencia: {e}", "error")
     finally:
-        if cursor:
-            cursor.close()
+        cursor.close()
+        db.autocommit = False
 
+    # Llamar a la función que genera la respuesta (HTML o JSON), enviando el full_name
+    return build_checkin_response(*checkin_result_from_row(qr_uuid, user_row))
 
-# --- Rutas de Administración (Continuación) ---
+# --- API de Check-in por Lotes (kioscos) ---
 
-@app.route('/admin/settings', methods=['GET', 'POST'])
-def admin_settings():
-    # 1. Validación de Autenticación y Rol (sin decorador)
-    if 'user_id' not in session or not session.get('is_admin'):
-        flash('Acceso denegado. Debe iniciar sesión como administrador.', 'error')
-        return redirect(url_for('login'))
+# Máximo de escaneos aceptados en una sola solicitud
+BATCH_CHECKIN_MAX_ITEMS = int(os.environ.get('BATCH_CHECKIN_MAX_ITEMS', 500))
+# Tolerancia para relojes de kiosco adelantados
+BATCH_CHECKIN_MAX_CLOCK_SKEW = datetime.timedelta(minutes=5)
 
-    admin_id = session.get('user_id')  
-    
-    conn = get_db()
-    # 🚨 CORRECCIÓN: Usar DictCursor aquí para poder acceder por nombre de columna (e.g., admin_data['username'])
-    cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor) 
-    
-    if request.method == 'POST':
-        # Obtenemos ambos campos
-        new_username = request.form.get('username', '').strip()
-        new_password = request.form.get('password', '')
-        
-        # Validación de campos
-        if not new_username:
-             flash('El nombre de usuario no puede estar vacío.', 'error')
-             return redirect(url_for('admin_settings'))
-        if len(new_password) < 6:
-             flash('La contraseña debe tener al menos 6 caracteres.', 'error')
-             return redirect(url_for('admin_settings'))
+# Inserta todo el lote en una sola sentencia (una transacción). DISTINCT ON
+# deja el primer escaneo de cada usuario y día; la restricción única descarta
+# los que ya estaban registrados.
+BATCH_CHECKIN_SQL = """
+    WITH items (idx, qr_uuid, scanned_at) AS (
+        SELECT * FROM unnest(%s::int[], %s::uuid[], %s::timestamp[])
+    ), matched AS (
+        SELECT i.idx, u.id AS user_id, i.scanned_at
+        FROM items i
+        JOIN users u ON u.qr_code_uuid = i.qr_uuid AND u.is_admin = FALSE
+    ), ins AS (
+        INSERT INTO attendance (user_id, check_in_time, check_in_date)
+        SELECT DISTINCT ON (f.user_id, f.scanned_at::DATE) f.user_id, f.scanned_at, f.scanned_at::DATE
+        FROM matched f
+        ORDER BY f.user_id, f.scanned_at::DATE, f.scanned_at
+        ON CONFLICT (user_id, check_in_date) DO NOTHING
+        RETURNING user_id, check_in_time
+    )
+    SELECT m.idx, m.user_id, m.scanned_at,
+           EXISTS (
+               SELECT 1 FROM ins
+               WHERE ins.user_id = m.user_id AND ins.check_in_time = m.scanned_at
+           ) AS inserted
+    FROM matched m
+    ORDER BY m.idx
+"""
 
-        try:
-            # 2. Verificar unicidad del nuevo nombre de usuario
-            cur.execute("SELECT id FROM users WHERE username = %s AND id != %s", (new_username, admin_id))
-            if cur.fetchone():
-                flash('El nombre de usuario ya existe. Por favor, elige otro.', 'warning')
-                return redirect(url_for('admin_settings'))
 
-            # 3. Hashear la nueva contraseña
-            hashed_password = generate_password_hash(new_password)
-            
-            # 4. Actualizar la base de datos (tanto username como password)
-            cur.execute("""
-                UPDATE users 
-                SET username = %s, password = %s 
-                WHERE id = %s
-            """, (new_username, hashed_password, admin_id))
-            conn.commit()
+def parse_scanned_at(value, now):
+    """
+    Convierte el `scanned_at` ISO 8601 de un kiosco a hora local sin zona; None
+    si es inválido. Sin `scanned_at` se usa `now` (el reloj de checkin_now).
+    """
+    if value is None:
+        return now
+    try:
+        scanned_at = datetime.datetime.fromisoformat(str(value))
+    except ValueError:
+        return None
+    if scanned_at.tzinfo is not None:
+        scanned_at = scanned_at.astimezone().replace(tzinfo=None)
+    if scanned_at > now + BATCH_CHECKIN_MAX_CLOCK_SKEW:
+        return None
+    return scanned_at
 
-            # 5. Actualizar la sesión
-            session['username'] = new_username
-            
-            flash('Su nombre de usuario y contraseña han sido actualizados exitosamente.', 'success')
-            return redirect(url_for('admin_dashboard'))
 
-        except Exception as e:
-            conn.rollback()
-            print(f"Error al actualizar la configuración del admin: {e}") 
-            flash('Error interno al actualizar la configuración.', 'error')
-            return redirect(url_for('admin_settings'))
-            
-    # GET request: Mostrar el formulario con el nombre de usuario actual
-    try:
-        cur.execute("SELECT username FROM users WHERE id = %s", (admin_id,))
-        admin_data = cur.fetchone() 
-        
-        # ¡Esta línea ahora funciona correctamente!
-        current_username = admin_data['username'] if admin_data else ''
-        
-        return render_template('admin_settings.html', current_username=current_username)
+def parse_batch_items(items):
+    """
+    Valida los escaneos de un lote. Devuelve la lista de resultados (todos
+    'invalid' al inicio) y los arreglos (índices, UUIDs, fechas) a insertar.
+    """
+    results = ['invalid'] * len(items)
+    now = checkin_now()
+    indexes, uuids, timestamps = [], [], []
+    for idx, item in enumerate(items):
+        if not isinstance(item, dict):
+            continue
+        try:
+            qr_uuid = str(uuid.UUID(str(item.get('qr_uuid'))))
+        except ValueError:
+            continue
+        scanned_at = parse_scanned_at(item.get('scanned_at'), now)
+        if scanned_at is None:
+            continue
+        indexes.append(idx)
+        uuids.append(qr_uuid)
+        timestamps.append(scanned_at)
+    return results, indexes, uuids, timestamps
 
-    except Exception as e:
-        print(f'Error al cargar la configuración: {e}')
-        flash('Error al cargar la información del administrador.', 'error')
-        return redirect(url_for('admin_dashboard'))
 
+def apply_batch_rows(results, rows):
+    """Completa `results` con las filas de BATCH_CHECKIN_SQL y devuelve el resumen por estado."""
+    # Si el mismo escaneo llega repetido en el lote, solo el primero cuenta como 'success'
+    claimed = set()
+    backfilled_months = set()
+    current_month = datetime.date.today().replace(day=1)
+    for row in rows:
+        checkin_cache.mark_checked_in(row['user_id'], row['scanned_at'].date())
+        key = (row['user_id'], row['scanned_at'])
+        if row['inserted'] and key not in claimed:
+            claimed.add(key)
+            results[row['idx']] = 'success'
+            # Escaneo atrasado de un mes ya cerrado: sus respuestas en caché quedan viejas
+            month = row['scanned_at'].date().replace(day=1)
+            if month < current_month:
+                backfilled_months.add(month)
+        else:
+            results[row['idx']] = 'already'
+    for month in backfilled_months:
+        attendance_cache.invalidate_month(month)
+    return {status: results.count(status) for status in ('success', 'already', 'invalid')}
 
-        
 
-@app.route('/admin/attendance/export/<int:user_id>/<int:year>/<int:month>')
-def export_individual_attendance(user_id, year, month):
+@app.route('/api/checkin/batch', methods=['POST'])
+def batch_check_in():
     """
-    Genera un archivo CSV con la asistencia (ASISTIO/NO_ASISTIO/NADIE_ASISTIO)
-    para un usuario en un mes específico, incluyendo la hora de registro.
+    Registra un lote de escaneos [{qr_uuid, scanned_at}] en una transacción.
+    Responde con un estado por elemento, en el mismo orden:
+    'success', 'already' (ya tenía asistencia ese día) o 'invalid'.
     """
     if not session.get('is_admin'):
-        return "Acceso denegado.", 403
+        return jsonify({"error": "Acceso denegado."}), 403
 
-    db = None
-    cursor = None
+    payload = request.get_json(silent=True)
+    items = payload.get('items') if isinstance(payload, dict) else payload
+    if not isinstance(items, list):
+        return jsonify({"error": "Se esperaba una lista 'items' de escaneos."}), 400
+    if len(items) > BATCH_CHECKIN_MAX_ITEMS:
+        return jsonify({"error": f"Máximo {BATCH_CHECKIN_MAX_ITEMS} escaneos por lote."}), 413
 
-    try:
+    results, indexes, uuids, timestamps = parse_batch_items(items)
+    rows = []
+    if indexes:
         db = get_db()
-        # 🚨 CAMBIO 15: Usar DictCursor para los fetchall
         cursor = db.cursor(cursor_factory=psycopg2.extras.DictCursor)
+        try:
+            db.autocommit = True
+            cursor.execute(BATCH_CHECKIN_SQL, (indexes, uuids, timestamps))
+            rows = cursor.fetchall()
+        except Exception as e:
+            print(f"Error en el check-in por lotes: {e}")
+            return jsonify({"error": "Error interno del servidor al registrar el lote."}), 500
+        finally:
+            cursor.close()
+            db.autocommit = False
 
-        # Definir current_day_date para evitar errores de ámbito
-        current_day_date = datetime.date.today()
+    summary = apply_batch_rows(results, rows)
+    return jsonify({"results": results, "summary": summary})
 
-        # 1. Obtener datos del usuario
-        cursor.execute(
-            "SELECT first_name, paternal_last_name, maternal_last_name FROM users WHERE id = %s",
-            (user_id,)
-        )
-        user_data = cursor.fetchone()
-        if not user_data:
-            return "Usuario no encontrado.", 404
-        
-        full_name = f"{user_data['paternal_last_name']} {user_data['maternal_last_name']}, {user_data['first_name']}"
-        
-        # 2. Definir el rango de fechas
-        start_date = datetime.date(year, month, 1)
-        if month == 12:
-            end_date = datetime.date(year + 1, 1, 1)
-        else:
-            end_date = datetime.date(year, month + 1, 1)
 
-        # 3. Obtener asistencias registradas del USUARIO, incluyendo la hora
-        cursor.execute(
-            """
-            SELECT check_in_time
-            FROM attendance
-            WHERE user_id = %s
-              AND check_in_time >= %s
-              AND check_in_time < %s
-            ORDER BY check_in_time ASC
-            """,
-            (user_id, start_date, end_date)
-        )
-        
-        attended_records = {}
-        for record in cursor.fetchall():
-            check_in_dt = record['check_in_time'] # Objeto datetime de Python
-            date_key = check_in_dt.strftime('%Y-%m-%d')
-            time_str = check_in_dt.strftime('%H:%M:%S')
-            
-            # Solo almacena el primer registro (hora más temprana) del día
-            if date_key not in attended_records:
-                attended_records[date_key] = time_str
+# --- Hashing de Contraseñas (pool de procesos) ---
 
-        # Crear el set de días asistidos a partir de las claves del diccionario
-        attended_dates = set(attended_records.keys())
-        
-        # 4. Obtener días activos del SISTEMA (Consulta Global)
-        # 🚨 CAMBIO 16: Usar DATE() en PostgreSQL es check_in_time::DATE
-        cursor.execute(
-            """
-            SELECT DISTINCT check_in_time::DATE as active_date
-            FROM attendance
-            WHERE check_in_time >= %s
-              AND check_in_time < %s
-            """,
-            (start_date, end_date)
-        )
-        system_active_days = {record['active_date'].strftime('%Y-%m-%d') for record in cursor.fetchall() if record.get('active_date')}
+# El KDF de las contraseñas es caro a propósito (scrypt por defecto). Si se
+# calcula en el hilo de la solicitud, un grupo entero iniciando sesión a la vez
+# deja sin CPU a los mismos workers que atienden /checkin. Por eso login,
+# registro y cambio de contraseña lo calculan en un pool de procesos acotado:
+# a lo sumo PASSWORD_HASH_WORKERS hashes a la vez por worker y
+# PASSWORD_HASH_MAX_PENDING en espera; más allá se responde "ocupado" (503).
+#
+# Parámetros en el formato de werkzeug: 'scrypt', 'scrypt:32768:8:1',
+# 'pbkdf2:sha256:600000', ... Si cambian, cada usuario se vuelve a hashear
+# con los nuevos al iniciar sesión (su contraseña en claro solo se conoce ahí).
+PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD', 'scrypt')
+PASSWORD_SALT_LENGTH = int(os.environ.get('PASSWORD_SALT_LENGTH', 16))
+PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', 2))
+PASSWORD_HASH_MAX_PENDING = int(os.environ.get('PASSWORD_HASH_MAX_PENDING', 32))
+# Segundos máximos esperando un resultado (cola + cálculo) antes de responder "ocupado"
+PASSWORD_HASH_TIMEOUT = float(os.environ.get('PASSWORD_HASH_TIMEOUT', 10))
 
-        # 5. Construir el contenido del CSV en memoria
-        output = io.StringIO()
-        writer = csv.writer(output, delimiter=',')
-        
-        # Metadatos (Tildes eliminadas)
-        writer.writerow(["REPORTE DE ASISTENCIA INDIVIDUAL", "", "", "", ""])
-        writer.writerow(["EMPLEADO:", full_name, "MES:", f"{month}/{year}"])
-        writer.writerow(["ASISTENCIAS PROPIAS:", str(len(attended_dates))])
-        writer.writerow(["DIAS ACTIVOS DEL SISTEMA:", str(len(system_active_days))])
-        writer.writerow([])
-        
-        # Encabezados (Nueva columna: Hora de Registro)
-        header_row = ["Dia", "Dia Semana", "Fecha (YYYY-MM-DD)", "Hora de Registro", "Estado de Asistencia"]
-        writer.writerow(header_row)
+PASSWORD_HASH_BUSY_MESSAGE = "El servidor está ocupado. Intente de nuevo en unos segundos."
 
-        days_in_month = (end_date - start_date).days
-        # Corregir nombres de días de la semana (Lunes es 0 en Python)
-        day_names = ["Lunes", "Martes", "Miércoles", "Jueves", "Viernes", "Sábado", "Domingo"]
-        
-        # 6. Filas de datos
-        for day in range(1, days_in_month + 1):
-            current_date = datetime.date(year, month, day)
-            date_key = current_date.strftime('%Y-%m-%d')
-            
-            day_of_week = current_date.weekday()
-            day_name = day_names[day_of_week]
-            
-            is_user_attended = date_key in attended_dates
-            is_system_active = date_key in system_active_days
 
-            is_past_or_today = current_date <= current_day_date
-            
-            status = ""
-            time_of_checkin = "" # Se inicializa la hora como vacía
-            
-            # 1. ASISTIO: Máxima prioridad.
-            if is_user_attended:
-                status = "ASISTIO"
-                # Si asistió, se recupera la hora
-                time_of_checkin = attended_records.get(date_key, "") 
-            
-            # 2. NO_ASISTIO: Sistema activo Y es pasado O HOY, pero el usuario NO asistió.
-            elif is_system_active and is_past_or_today:
-                status = "NO_ASISTIO"
-            
-            # 3. NADIE_ASISTIO: Si el sistema no estuvo activo o es un día futuro.
-            else:
-                status = "NADIE_ASISTIO"
+class PasswordHasherBusy(Exception):
+    """El pool de hashing tiene la cola llena o no respondió a tiempo."""
 
-            writer.writerow([
-                day,
-                day_name,
-                date_key,
-                time_of_checkin, # <-- Columna de la hora
-                status
-            ])
 
-        # 7. Devolver el archivo CSV
-        csv_output = output.getvalue()
-        filename = f"reporte_asistencia_{user_id}_{year}_{month}_final.csv"
-        
-        response = Response(
-            csv_output,
-            mimetype="text/csv",
-            headers={
-                "Content-Disposition": f"attachment; filename={filename}",
-                "Cache-Control": "no-cache, no-store, must-revalidate",
-                "Pragma": "no-cache",
-                "Expires": "0"
-            }
-        )
-        return response
+def make_password_hash(password):
+    """Hash con los parámetros configurados (directo, sin el pool: para la CLI)."""
+    return generate_password_hash(password, method=PASSWORD_HASH_METHOD, salt_length=PASSWORD_SALT_LENGTH)
 
-    except Exception as e:
-        print(f"ERROR AL GENERAR CSV: {e}")
-        return f"Error interno del servidor al generar el CSV: {e}", 500
-    finally:
-        if cursor:
-            cursor.close()
 
+@functools.lru_cache(maxsize=None)
+def _password_hash_prefix(method):
+    """Método normalizado ('scrypt:32768:8:1') tal como werkzeug lo escribe al inicio del hash."""
+    return generate_password_hash('', method=method, salt_length=1).split('$', 1)[0]
 
-# --- NUEVAS RUTAS DE REPORTE INDIVIDUAL (FIN) ---
 
+def password_needs_rehash(pwhash, method=None, salt_length=None):
+    """True si `pwhash` no usa los parámetros configurados (método, costo o largo de la sal)."""
+    method = method or PASSWORD_HASH_METHOD
+    salt_length = salt_length or PASSWORD_SALT_LENGTH
+    prefix, _, rest = pwhash.partition('$')
+    salt = rest.partition('$')[0]
+    return prefix != _password_hash_prefix(method) or len(salt) != salt_length
 
-@app.route('/admin/scanner')
-def admin_scanner():
-    """Muestra la interfaz del escáner QR (solo para admin)."""
-    if not session.get('is_admin'):
-        return "Acceso denegado.", 403
-    return render_template('admin_scanner.html')
 
+# Se ejecutan en los procesos del pool: reciben todo por argumento y devuelven
+# también cuánto tardó el cálculo, para separar la espera en cola del cómputo.
+def _hash_password_task(password, method, salt_length):
+    start = time.perf_counter()
+    pwhash = generate_password_hash(password, method=method, salt_length=salt_length)
+    return pwhash, time.perf_counter() - start
 
-# --- RUTA DE PRUEBA DE ESCÁNER ---
-@app.route('/test_scanner')
-def test_scanner_route():
-    """Ruta para servir la página de prueba de carga de la librería y cámara."""
-    return render_template('test_scanner.html')
 
+def _verify_password_task(pwhash, password, method, salt_length):
+    """(válida, hash nuevo si hay que actualizar los parámetros o None, segundos)."""
+    start = time.perf_counter()
+    new_hash = None
+    valid = check_password_hash(pwhash, password)
+    if valid and password_needs_rehash(pwhash, method, salt_length):
+        new_hash = generate_password_hash(password, method=method, salt_length=salt_length)
+    return valid, new_hash, time.perf_counter() - start
 
-# --- Rutas de Usuario y Asistencia ---
 
-@app.route('/qrcode')
-def show_qr():
-    """Muestra el código QR único del usuario logueado."""
-    if 'user_id' not in session or session.get('is_admin'):
-        return redirect(url_for('index'))
+class PasswordHasher:
+    """
+    Pool de procesos acotado para el KDF de las contraseñas, uno por worker.
+    `pending` cuenta los cálculos aceptados y aún sin terminar (en cola o en
+    curso); con `workers + max_pending` se rechazan los nuevos.
+    """
 
-    db = get_db()
-    # 🚨 CAMBIO 17: Usar DictCursor
-    cursor = db.cursor(cursor_factory=psycopg2.extras.DictCursor)
-    
-    cursor.execute("SELECT qr_code_uuid FROM users WHERE id = %s", (session.get('user_id'),))
-    result = cursor.fetchone()
-    # 🚨 CAMBIO 18: El UUID es un objeto UUID en Python, necesitamos convertirlo a string si no lo está.
-    qr_uuid_obj = result.get('qr_code_uuid')
-    qr_uuid = str(qr_uuid_obj) if qr_uuid_obj else None
+    def __init__(self, workers, max_pending, timeout):
+        self.workers = max(1, workers)
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._executor = self._new_executor()
+        self._pending = 0
+        self._completed = 0
+        self._rejected = 0
+        self._timeouts = 0
 
-    if not qr_uuid:
-        return "Error: UUID no encontrado para el usuario.", 500
+    def _new_executor(self):
+        return ProcessPoolExecutor(max_workers=self.workers, mp_context=PROCESS_POOL_CONTEXT)
 
-    # Genera la URL completa que contiene el UUID
-    checkin_url = request.host_url.rstrip('/') + url_for('check_in', qr_uuid=qr_uuid)
+    def _done(self, future):
+        with self._lock:
+            self._pending -= 1
+            self._completed += 1
 
-    qr_base64 = generate_qr_code(checkin_url)
+    def _run(self, operation, task, *args):
+        """Ejecuta `task` en el pool y devuelve su resultado sin los segundos de cómputo."""
+        with self._lock:
+            if self._pending >= self.workers + self.max_pending:
+                self._rejected += 1
+                PASSWORD_HASH_REJECTED.inc(operation, 'queue_full')
+                raise PasswordHasherBusy()
+            self._pending += 1
+            executor = self._executor
+        start = time.perf_counter()
+        future = None
+        try:
+            future = executor.submit(task, *args)
+            future.add_done_callback(self._done)
+            *result, compute_seconds = future.result(timeout=self.timeout)
+        except BrokenProcessPool:
+            # Un proceso del pool murió (p. ej. por memoria): se reemplaza el pool una sola vez
+            print("El pool de hashing de contraseñas se rompió; se crea uno nuevo.")
+            with self._lock:
+                if future is None:
+                    self._pending -= 1  # No llegó a encolarse
+                if self._executor is executor:
+                    self._executor = self._new_executor()
+                    executor.shutdown(wait=False)
+            raise PasswordHasherBusy()
+        except FuturesTimeoutError:
+            future.cancel()
+            with self._lock:
+                self._timeouts += 1
+            PASSWORD_HASH_REJECTED.inc(operation, 'timeout')
+            raise PasswordHasherBusy()
+        elapsed = time.perf_counter() - start
+        PASSWORD_HASH_DURATION.observe(compute_seconds, operation)
+        PASSWORD_HASH_WAIT.observe(max(0.0, elapsed - compute_seconds), operation)
+        return result
 
-    # Nota: Requiere que 'qr_viewer.html' exista.
-    return render_template('qr_viewer.html', qr_base64=qr_base64, checkin_url=checkin_url)
+    def hash(self, password):
+        """Hash nuevo con los parámetros configurados."""
+        pwhash, = self._run('hash', _hash_password_task, password, PASSWORD_HASH_METHOD, PASSWORD_SALT_LENGTH)
+        return pwhash
 
+    def verify(self, pwhash, password):
+        """(válida, hash nuevo o None). El hash nuevo solo llega si la contraseña es válida y los parámetros cambiaron."""
+        valid, new_hash = self._run('verify', _verify_password_task, pwhash, password, PASSWORD_HASH_METHOD, PASSWORD_SALT_LENGTH)
+        return valid, new_hash
 
-@app.route('/checkin/<qr_uuid>')
-def check_in(qr_uuid):
-    """Ruta que es accedida al escanear el código QR para registrar la asistencia."""
-    
-    # Asegúrate de que datetime y get_db estén definidos/importados en tu app.py
-    
-    db = get_db()
-    # 🚨 CAMBIO 19: Usar DictCursor
-    cursor = db.cursor(cursor_factory=psycopg2.extras.DictCursor)
-    message = ""
-    status = "success"
-    full_name = None # Inicializamos full_name
+    def stats(self):
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'max_pending': self.max_pending,
+                'pending': self._pending,
+                'completed': self._completed,
+                'rejected': self._rejected,
+                'timeouts': self._timeouts,
+                'method': PASSWORD_HASH_METHOD,
+            }
 
-    # 1. Buscar usuario por UUID y obtener los campos de nombre
-    cursor.execute(
-        """
-        SELECT 
-            id, 
-            username, 
-            first_name, 
-            paternal_last_name, 
-            maternal_last_name 
-        FROM users 
-        WHERE qr_code_uuid = %s AND is_admin = FALSE
-        """,  
-        (qr_uuid,)
-    )
-    user_row = cursor.fetchone()
 
-    if user_row is None:
-        message = "Código QR inválido o el usuario es administrador."
-        status = "error"
-        # Si falla, full_name sigue siendo None, y el template lo manejará.
-    else:
-        user_id = user_row['id']
-        username = user_row['username']
-        
-        # 💡 NUEVO CÓDIGO: Construir el nombre completo
-        name_parts = [
-            user_row.get('first_name', ''), 
-            user_row.get('paternal_last_name', ''), 
-            user_row.get('maternal_last_name', '')
-        ]
-        # Creamos el nombre completo, quitando espacios extra si faltan apellidos.
-        full_name = " ".join(filter(None, name_parts)).strip()
-        
-        # Usamos el nombre completo para el mensaje, si existe, o el nombre de usuario por defecto
-        display_name = full_name if full_name else username
+_password_hasher = None
+_password_hasher_pid = None
+_password_hasher_lock = threading.Lock()
 
-        # 2. Verificar si ya registró asistencia hoy
-        today = datetime.date.today()
-        
-        # 🚨 CAMBIO 20: Usar DATE() en PostgreSQL es check_in_time::DATE
-        cursor.execute(
-            """
-            SELECT id FROM attendance 
-            WHERE user_id = %s AND check_in_time::DATE = %s
-            """,  
-            (user_id, today.strftime('%Y-%m-%d'))
-        )
-        
-        if cursor.fetchone() is not None:
-            # 💡 MENSAJE MODIFICADO: Usamos el nombre completo (o display_name)
-            message = f"¡Atención {display_name}! Ya registraste tu asistencia el día de hoy."
-            status = "warning"
-        else:
-            try:
-                # 3. Registrar la asistencia
-                cursor.execute(
-                    "INSERT INTO attendance (user_id) VALUES (%s)",
-                    (user_id,)
-                )
-                db.commit()
-                # 💡 MENSAJE MODIFICADO: Usamos el nombre completo (o display_name)
-                message = f"¡Asistencia registrada con éxito para {display_name}!"
-                status = "success"
-            except Exception as e:
-                db.rollback()
-                message = f"Error al registrar asistencia: {e}"
-                status = "error"
+def get_password_hasher():
+    """Devuelve el pool de hashing del proceso actual (uno por PID, como get_pool)."""
+    global _password_hasher, _password_hasher_pid
+    pid = os.getpid()
+    if _password_hasher is None or _password_hasher_pid != pid:
+        with _password_hasher_lock:
+            if _password_hasher is None or _password_hasher_pid != pid:
+                _password_hasher = PasswordHasher(PASSWORD_HASH_WORKERS, PASSWORD_HASH_MAX_PENDING, PASSWORD_HASH_TIMEOUT)
+                _password_hasher_pid = pid
+    return _password_hasher
 
-    # 4. Llamar a la función que genera el HTML, AHORA enviando el full_name
-    return build_checkin_response(message, status, full_name)
 
 # --- Rutas de Autenticación (Login/Register/Logout) ---
 
@@ -883,8 +4923,23 @@ def login():
         if user_row is None:
             error = 'Nombre de usuario incorrecto.'
         else:
-            if not check_password_hash(user_row['password'], password):
+            try:
+                valid, new_hash = get_password_hasher().verify(user_row['password'], password)
+            except PasswordHasherBusy:
+                return render_template('login.html', error=PASSWORD_HASH_BUSY_MESSAGE), 503
+            if not valid:
                 error = 'Contraseña incorrecta.'
+            elif new_hash is not None:
+                # Cambiaron los parámetros de hashing: se guarda el hash nuevo (si nadie cambió la contraseña entretanto)
+                try:
+                    cursor.execute(
+                        "UPDATE users SET password = %s WHERE id = %s AND password = %s",
+                        (new_hash, user_row['id'], user_row['password'])
+                    )
+                    db.commit()
+                except Exception as e:
+                    db.rollback()
+                    print(f"Error al actualizar el hash de la contraseña: {e}")
 
         if error is None:
             session.clear()
@@ -953,7 +5008,7 @@ def register():
                     raise Exception("Fallo al generar un UUID único después de varios intentos.")
                     
                 
-                hashed_password = generate_password_hash(password)
+                hashed_password = get_password_hasher().hash(password)
                 
                 # 6. Insertar el nuevo usuario con TODOS los campos
                 # 🌟 CAMBIO 5: Se añade 'phone_number' al INSERT INTO y a la lista de valores
@@ -966,6 +5021,9 @@ def register():
                 )
                 db.commit()
                 return redirect(url_for('login'))
+            except PasswordHasherBusy:
+                db.rollback()
+                return render_template('register.html', error=PASSWORD_HASH_BUSY_MESSAGE), 503
             except Exception as e:
                 db.rollback()
                 error = f"Ocurrió un error al registrar el usuario: {e}"
@@ -982,6 +5040,9 @@ def logout():
     session.clear()
     return redirect(url_for('index'))
 
+# Duración de la importación (expuesta en /readyz y /metrics)
+APP_IMPORT_SECONDS = time.perf_counter() - _IMPORT_STARTED
+
 # --- Ejecución de la Aplicación ---
 if __name__ == '__main__':
     app.run(debug=True, host='0.0.0.0')
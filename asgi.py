@@ -0,0 +1,241 @@
+"""
+Servicio ASGI para las ráfagas de check-in.
+
+Atiende `/checkin/<qr_uuid>` y `/api/checkin/batch` con asyncio y un pool de
+asyncpg: mientras una consulta espera la red hacia PostgreSQL, el mismo
+proceso sigue atendiendo otros escaneos. El resto de las rutas se delegan a la
+app Flask existente (ejecutada en hilos mediante WsgiToAsgi).
+
+Las respuestas son las mismas que en app.py: se reutilizan CHECKIN_SQL,
+BATCH_CHECKIN_SQL, la caché de check-in y build_checkin_response.
+
+Ejecución:
+    uvicorn asgi:application --host 0.0.0.0 --port 8000 --workers 4
+"""
+import os
+import re
+import json
+import uuid
+import asyncio
+from http.cookies import SimpleCookie
+
+import asyncpg
+from asgiref.wsgi import WsgiToAsgi
+
+from app import (
+    app,
+    DB_CONFIG,
+    CHECKIN_SQL,
+    BATCH_CHECKIN_SQL,
+    BATCH_CHECKIN_MAX_ITEMS,
+    INVALID_QR_MESSAGE,
+    add_security_headers,
+    build_checkin_response,
+    cached_checkin_result,
+    checkin_now,
+    checkin_result_from_row,
+    parse_batch_items,
+    apply_batch_rows,
+)
+
+# Pool de asyncpg por proceso. statement_cache_size=0 por defecto porque el
+# host es el pooler (PgBouncer en modo transacción), que no conserva las
+# sentencias preparadas entre transacciones.
+ASYNC_DB_POOL_CONFIG = {
+    'min_size': int(os.environ.get('ASYNC_DB_POOL_MIN', 2)),
+    'max_size': int(os.environ.get('ASYNC_DB_POOL_MAX', 20)),
+    'statement_cache_size': int(os.environ.get('ASYNC_DB_STATEMENT_CACHE', 0)),
+    'command_timeout': float(os.environ.get('ASYNC_DB_COMMAND_TIMEOUT', 10)),
+}
+
+CHECKIN_PATH = re.compile(r'^/checkin/(?P<qr_uuid>[^/]+)$')
+BATCH_PATH = '/api/checkin/batch'
+# Límite del cuerpo JSON de un lote (~200 bytes por escaneo)
+MAX_BATCH_BODY_BYTES = BATCH_CHECKIN_MAX_ITEMS * 200 + 1024
+
+
+def to_asyncpg_sql(sql):
+    """Convierte los marcadores `%s` de psycopg2 en `$1, $2, ...` de asyncpg."""
+    counter = iter(range(1, sql.count('%s') + 1))
+    return re.sub(r'%s', lambda _: f'${next(counter)}', sql)
+
+
+ASYNC_CHECKIN_SQL = to_asyncpg_sql(CHECKIN_SQL)
+ASYNC_BATCH_CHECKIN_SQL = to_asyncpg_sql(BATCH_CHECKIN_SQL)
+
+
+def asyncpg_connect_kwargs(db_config):
+    """Traduce DB_CONFIG (parámetros de psycopg2) a los de asyncpg."""
+    kwargs = {key: value for key, value in db_config.items() if key not in ('sslmode', 'connect_timeout')}
+    if 'sslmode' in db_config:
+        kwargs['ssl'] = db_config['sslmode']
+    if 'connect_timeout' in db_config:
+        kwargs['timeout'] = db_config['connect_timeout']
+    return kwargs
+
+
+def load_session(scope):
+    """Lee la sesión firmada de Flask desde la cookie de la solicitud ({} si no hay o es inválida)."""
+    cookies = SimpleCookie()
+    for name, value in scope.get('headers', []):
+        if name == b'cookie':
+            cookies.load(value.decode('latin-1'))
+    morsel = cookies.get(app.config['SESSION_COOKIE_NAME'])
+    if morsel is None:
+        return {}
+    serializer = app.session_interface.get_signing_serializer(app)
+    try:
+        return serializer.loads(morsel.value, max_age=int(app.permanent_session_lifetime.total_seconds()))
+    except Exception:
+        return {}
+
+
+def accept_header(scope):
+    """Encabezado Accept de la solicitud, para elegir entre HTML y JSON en el check-in."""
+    for name, value in scope.get('headers', []):
+        if name == b'accept':
+            return value.decode('latin-1')
+    return None
+
+
+async def read_body(receive, limit):
+    """Lee el cuerpo completo de la solicitud; None si supera `limit` bytes."""
+    body = bytearray()
+    more_body = True
+    while more_body:
+        message = await receive()
+        body.extend(message.get('body', b''))
+        if len(body) > limit:
+            return None
+        more_body = message.get('more_body', False)
+    return bytes(body)
+
+
+async def send_response(send, response):
+    """Envía una flask.Response (con los mismos encabezados de seguridad que la app Flask)."""
+    response = add_security_headers(response)
+    body = response.get_data()
+    headers = [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in response.headers.items()]
+    headers = [(name, value) for name, value in headers if name != b'content-length']
+    headers.append((b'content-length', str(len(body)).encode()))
+    await send({'type': 'http.response.start', 'status': response.status_code, 'headers': headers})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def send_json(send, payload, status=200):
+    response = app.response_class(json.dumps(payload, ensure_ascii=False), status=status, mimetype='application/json')
+    await send_response(send, response)
+
+
+class CheckinService:
+    """Aplicación ASGI: check-in asíncrono y delegación del resto a Flask."""
+
+    def __init__(self, flask_app):
+        self.flask = WsgiToAsgi(flask_app)
+        self.pool = None
+        self._pool_lock = asyncio.Lock()
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+            return
+        if scope['type'] == 'http':
+            match = CHECKIN_PATH.match(scope['path'])
+            if match and scope['method'] == 'GET':
+                await self.check_in(scope, send, match.group('qr_uuid'))
+                return
+            if scope['path'] == BATCH_PATH and scope['method'] == 'POST':
+                await self.batch_check_in(scope, receive, send)
+                return
+        await self.flask(scope, receive, send)
+
+    async def get_pool(self):
+        """
+        Devuelve el pool asyncpg, creándolo en el primer uso. El lifespan lo crea
+        al arrancar, pero con `--lifespan off` la primera solicitud lo inicializa.
+        """
+        if self.pool is None:
+            async with self._pool_lock:
+                if self.pool is None:
+                    self.pool = await asyncpg.create_pool(**asyncpg_connect_kwargs(DB_CONFIG), **ASYNC_DB_POOL_CONFIG)
+        return self.pool
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                try:
+                    await self.get_pool()
+                except Exception as e:
+                    print(f"Error al crear el pool asyncpg: {e}")
+                    await send({'type': 'lifespan.startup.failed', 'message': str(e)})
+                    return
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                if self.pool is not None:
+                    await self.pool.close()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def check_in(self, scope, send, qr_uuid):
+        """Mismo flujo que app.check_in: UUID válido, caché y una sola sentencia."""
+        accept = accept_header(scope)
+        try:
+            uuid.UUID(qr_uuid)
+        except ValueError:
+            await send_response(send, build_checkin_response(INVALID_QR_MESSAGE, "error", accept_header=accept))
+            return
+
+        cached_result = cached_checkin_result(qr_uuid)
+        if cached_result is not None:
+            await send_response(send, build_checkin_response(*cached_result, accept_header=accept))
+            return
+
+        try:
+            # Fuera de una transacción explícita asyncpg ejecuta en autocommit (un solo viaje)
+            pool = await self.get_pool()
+            user_row = await pool.fetchrow(ASYNC_CHECKIN_SQL, qr_uuid, checkin_now())
+        except Exception as e:
+            await send_response(send, build_checkin_response(f"Error al registrar asistencia: {e}", "error", accept_header=accept))
+            return
+
+        await send_response(send, build_checkin_response(*checkin_result_from_row(qr_uuid, user_row), accept_header=accept))
+
+    async def batch_check_in(self, scope, receive, send):
+        """Mismo contrato que app.batch_check_in."""
+        if not load_session(scope).get('is_admin'):
+            await send_json(send, {"error": "Acceso denegado."}, 403)
+            return
+
+        body = await read_body(receive, MAX_BATCH_BODY_BYTES)
+        if body is None:
+            await send_json(send, {"error": f"Máximo {BATCH_CHECKIN_MAX_ITEMS} escaneos por lote."}, 413)
+            return
+        try:
+            payload = json.loads(body)
+        except ValueError:
+            payload = None
+        items = payload.get('items') if isinstance(payload, dict) else payload
+        if not isinstance(items, list):
+            await send_json(send, {"error": "Se esperaba una lista 'items' de escaneos."}, 400)
+            return
+        if len(items) > BATCH_CHECKIN_MAX_ITEMS:
+            await send_json(send, {"error": f"Máximo {BATCH_CHECKIN_MAX_ITEMS} escaneos por lote."}, 413)
+            return
+
+        results, indexes, uuids, timestamps = parse_batch_items(items)
+        rows = []
+        if indexes:
+            try:
+                pool = await self.get_pool()
+                rows = await pool.fetch(ASYNC_BATCH_CHECKIN_SQL, indexes, uuids, timestamps)
+            except Exception as e:
+                print(f"Error en el check-in por lotes: {e}")
+                await send_json(send, {"error": "Error interno del servidor al registrar el lote."}, 500)
+                return
+
+        summary = apply_batch_rows(results, rows)
+        await send_json(send, {"results": results, "summary": summary})
+
+
+application = CheckinService(app)
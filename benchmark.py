@@ -0,0 +1,493 @@
+"""
+Benchmark reproducible de las rutas críticas.
+
+1. `seed` llena una base PostgreSQL local con usuarios sintéticos (`bench_*`)
+   y años de asistencia, con una semilla fija para que dos corridas
+   generen exactamente los mismos datos. Aparte crea usuarios sin historial
+   (`bench_scan_*`) para los escenarios de check-in.
+2. `run` lanza solicitudes contra un servidor ya levantado con N hilos
+   concurrentes (cada uno espera su respuesta antes de enviar la siguiente)
+   y guarda el throughput y los percentiles p50/p95/p99 en JSON.
+3. `compare` muestra la diferencia entre dos resultados (p. ej. dos commits).
+
+Ejemplo:
+    export DB_HOST=localhost DB_PORT=5432 DB_USER=postgres DB_PASSWORD= DB_NAME=basetest_bench DB_SSLMODE=disable
+    python benchmark.py seed --users 2000 --years 3
+    gunicorn -w 4 -b 127.0.0.1:5000 app:app &
+    python benchmark.py run --concurrency 16 --duration 20 --output bench-$(git rev-parse --short HEAD).json
+    python benchmark.py compare bench-abc1234.json bench-def5678.json
+"""
+import os
+import io
+import sys
+import math
+import json
+import time
+import uuid
+import random
+import datetime
+import platform
+import threading
+import subprocess
+import http.client
+import urllib.parse
+
+import click
+import psycopg2
+from werkzeug.security import generate_password_hash
+
+BENCH_USER_PREFIX = 'bench_'
+BENCH_ADMIN_USERNAME = 'bench_admin'
+# `_` es comodín en LIKE
+BENCH_USER_PATTERN = BENCH_USER_PREFIX.replace('_', '\\_') + '%'
+# Usuarios que solo se escanean: cada uno se usa una vez por día para que el
+# check-in recorra el INSERT ... ON CONFLICT y no la caché de "ya registrado hoy"
+BENCH_SCAN_PREFIX = BENCH_USER_PREFIX + 'scan_'
+BENCH_SCAN_PATTERN = BENCH_SCAN_PREFIX.replace('_', '\\_') + '%'
+CHECKIN_ENDPOINTS = ('checkin', 'checkin_json')
+LOCAL_HOSTS = ('localhost', '127.0.0.1', '::1', '')
+
+FIRST_NAMES = ['José', 'María', 'Juan', 'Guadalupe', 'Luis', 'Sofía', 'Carlos', 'Fernanda', 'Miguel', 'Ximena',
+               'Jorge', 'Valeria', 'Andrés', 'Camila', 'Raúl', 'Regina', 'Héctor', 'Itzel', 'Ramón', 'Mónica']
+LAST_NAMES = ['Hernández', 'García', 'Martínez', 'López', 'González', 'Pérez', 'Rodríguez', 'Sánchez', 'Ramírez',
+              'Cruz', 'Flores', 'Gómez', 'Díaz', 'Núñez', 'Ávila', 'Morales', 'Jiménez', 'Reyes', 'Ruiz', 'Muñoz']
+
+# Rutas medidas: nombre -> función (rng, datos) que devuelve la ruta a pedir
+ENDPOINTS = {
+    'checkin': lambda rng, data: f"/checkin/{data['scans'].next_uuid(rng)}",
+    'checkin_json': lambda rng, data: f"/checkin/{data['scans'].next_uuid(rng)}",
+    'admin_attendance': lambda rng, data: '/admin/attendance?start={0}&end={1}'.format(*rng.choice(data['month_ranges'])),
+    'user_calendar': lambda rng, data: '/api/attendance/user/{0}/{1}/{2}'.format(rng.choice(data['user_ids']), *rng.choice(data['months'])),
+    'export_csv': lambda rng, data: '/admin/attendance/export/{0}/{1}/{2}'.format(rng.choice(data['user_ids']), *rng.choice(data['months'])),
+    'export_org': lambda rng, data: '/admin/attendance/export/all/{0}/{1}'.format(*rng.choice(data['months'])),
+}
+# Encabezados adicionales por ruta (los kioscos piden la variante JSON del check-in)
+ENDPOINT_HEADERS = {
+    'checkin_json': {'Accept': 'application/json'},
+}
+
+
+def connect():
+    # DB_CONFIG apunta a producción por defecto: se usa solo después de check_local_database
+    from app import DB_CONFIG
+    return psycopg2.connect(**DB_CONFIG)
+
+
+def check_local_database(allow_remote):
+    """Evita sembrar o medir por accidente la base de producción (el valor por defecto de DB_HOST)."""
+    host = os.environ.get('DB_HOST')
+    if host is None or (host not in LOCAL_HOSTS and not allow_remote):
+        raise click.ClickException(
+            f"DB_HOST={host!r} no es local. Define DB_HOST=localhost (o usa --allow-remote)."
+        )
+
+
+class ScanQueue:
+    """
+    Reparte entre los hilos los UUID de `bench_scan_*` aún sin asistencia hoy,
+    cada uno una sola vez. Si se agotan repite al azar y lo cuenta en `repeats`
+    (esos escaneos ya no llegan al INSERT).
+    """
+
+    def __init__(self, uuids):
+        self._uuids = uuids
+        self._next = 0
+        self._lock = threading.Lock()
+        self.repeats = 0
+
+    def __len__(self):
+        return len(self._uuids) - self._next
+
+    def next_uuid(self, rng):
+        with self._lock:
+            if self._next < len(self._uuids):
+                self._next += 1
+                return self._uuids[self._next - 1]
+            self.repeats += 1
+        return rng.choice(self._uuids)
+
+
+class IteratorFile(io.TextIOBase):
+    """Archivo de solo lectura sobre un iterador de líneas, para alimentar COPY FROM sin armar todo en memoria."""
+
+    def __init__(self, lines):
+        self._lines = lines
+        self._buffer = ''
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        while size < 0 or len(self._buffer) < size:
+            try:
+                self._buffer += next(self._lines)
+            except StopIteration:
+                break
+        if size < 0:
+            size = len(self._buffer)
+        chunk, self._buffer = self._buffer[:size], self._buffer[size:]
+        return chunk
+
+
+def school_days(first_day, last_day):
+    day = first_day
+    while day <= last_day:
+        if day.weekday() < 5:
+            yield day
+        day += datetime.timedelta(days=1)
+
+
+def attendance_lines(rng, users, days):
+    """Una línea COPY (user_id, check_in_time, check_in_date) por asistencia sintética."""
+    for day in days:
+        for user_id, rate in users:
+            if rng.random() >= rate:
+                continue
+            # Llegada alrededor de las 7:50 con dispersión de ~20 minutos, entre 6:30 y 10:00
+            minutes = min(max(rng.gauss(470, 20), 390), 600)
+            check_in_time = datetime.datetime.combine(day, datetime.time()) + datetime.timedelta(minutes=minutes)
+            yield f"{user_id}\t{check_in_time.isoformat(sep=' ')}\t{day.isoformat()}\n"
+
+
+@click.group()
+def cli():
+    """Benchmark de app.py contra una base PostgreSQL local."""
+
+
+@cli.command()
+@click.option('--users', default=2000, show_default=True, help='Usuarios sintéticos.')
+@click.option('--years', default=3, show_default=True, help='Años de historial (días hábiles hasta ayer).')
+@click.option('--scan-users', default=200000, show_default=True,
+              help='Usuarios sin historial para los check-ins (uno por escaneo y día).')
+@click.option('--seed', default=42, show_default=True, help='Semilla del generador.')
+@click.option('--admin-password', default='benchpass', show_default=True)
+@click.option('--allow-remote', is_flag=True, help='Permite una base que no sea local.')
+def seed(users, years, scan_users, seed, admin_password, allow_remote):
+    """Reemplaza los datos `bench_*` por un conjunto sintético reproducible."""
+    check_local_database(allow_remote)
+    rng = random.Random(seed)
+    db = connect()
+    try:
+        from app import apply_migrations
+        apply_migrations(db)
+        cursor = db.cursor()
+        start = time.perf_counter()
+
+        cursor.execute("SELECT id FROM users WHERE username LIKE %s", (BENCH_USER_PATTERN,))
+        old_ids = [row[0] for row in cursor.fetchall()]
+        if old_ids:
+            cursor.execute("DELETE FROM attendance WHERE user_id = ANY(%s)", (old_ids,))
+            cursor.execute("DELETE FROM users WHERE id = ANY(%s)", (old_ids,))
+
+        # Un solo hash para todos: el login no es parte del benchmark
+        password_hash = generate_password_hash(admin_password)
+        cursor.execute(
+            "INSERT INTO users (username, password, is_admin) VALUES (%s, %s, TRUE)",
+            (BENCH_ADMIN_USERNAME, password_hash),
+        )
+        rows = []
+        for i in range(users):
+            rows.append((
+                f'{BENCH_USER_PREFIX}{i:06d}',
+                str(uuid.UUID(int=rng.getrandbits(128), version=4)),
+                rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES), rng.choice(LAST_NAMES),
+                rng.choice('MF'), f'55{rng.randrange(10 ** 8):08d}',
+            ))
+        # Generador aparte para no alterar los datos de los usuarios con historial
+        scan_rng = random.Random(f'{seed}-scan')
+        scan_rows = []
+        for i in range(scan_users):
+            scan_rows.append((
+                f'{BENCH_SCAN_PREFIX}{i:07d}',
+                str(uuid.UUID(int=scan_rng.getrandbits(128), version=4)),
+                scan_rng.choice(FIRST_NAMES), scan_rng.choice(LAST_NAMES), scan_rng.choice(LAST_NAMES),
+                scan_rng.choice('MF'), f'55{scan_rng.randrange(10 ** 8):08d}',
+            ))
+        if scan_rows:
+            cursor.execute("""
+                INSERT INTO users (username, password, qr_code_uuid, first_name, paternal_last_name,
+                                   maternal_last_name, gender, phone_number)
+                SELECT u.username, %s, u.qr::UUID, u.first_name, u.paternal, u.maternal, u.gender, u.phone
+                FROM unnest(%s::text[], %s::text[], %s::text[], %s::text[], %s::text[], %s::text[], %s::text[])
+                     AS u (username, qr, first_name, paternal, maternal, gender, phone)
+            """, [password_hash] + [list(column) for column in zip(*scan_rows)])
+        cursor.execute("""
+            INSERT INTO users (username, password, qr_code_uuid, first_name, paternal_last_name,
+                               maternal_last_name, gender, phone_number)
+            SELECT u.username, %s, u.qr::UUID, u.first_name, u.paternal, u.maternal, u.gender, u.phone
+            FROM unnest(%s::text[], %s::text[], %s::text[], %s::text[], %s::text[], %s::text[], %s::text[])
+                 AS u (username, qr, first_name, paternal, maternal, gender, phone)
+            ORDER BY u.username
+            RETURNING id
+        """, [password_hash] + [list(column) for column in zip(*rows)])
+        user_ids = sorted(row[0] for row in cursor.fetchall())
+
+        # Cada usuario tiene su propia tasa de asistencia
+        bench_users = [(user_id, rng.uniform(0.6, 0.98)) for user_id in user_ids]
+        last_day = datetime.date.today() - datetime.timedelta(days=1)
+        first_day = last_day - datetime.timedelta(days=365 * years - 1)
+        lines = attendance_lines(rng, bench_users, school_days(first_day, last_day))
+        # Un mes por partición: sin esto el historial caería en attendance_default
+        cursor.execute("SELECT ensure_attendance_partitions(%s, %s)", (first_day, last_day))
+        cursor.copy_expert(
+            "COPY attendance (user_id, check_in_time, check_in_date) FROM STDIN",
+            IteratorFile(lines),
+        )
+        cursor.execute("SELECT COUNT(*) FROM attendance WHERE user_id = ANY(%s)", (user_ids,))
+        attendance_count = cursor.fetchone()[0]
+        db.commit()
+        cursor.execute("ANALYZE users")
+        cursor.execute("ANALYZE attendance")
+        db.commit()
+    finally:
+        db.close()
+    click.echo(f"{users} usuarios y {attendance_count} asistencias ({first_day} a {last_day}), "
+               f"{scan_users} usuarios para check-in, en {time.perf_counter() - start:.1f}s.")
+
+
+def load_targets():
+    """Lee de la base los UUID, IDs y meses que se usarán para armar las rutas."""
+    db = connect()
+    try:
+        cursor = db.cursor()
+        cursor.execute("""
+            SELECT id, qr_code_uuid::TEXT FROM users
+            WHERE username LIKE %s AND username NOT LIKE %s AND is_admin = FALSE ORDER BY id
+        """, (BENCH_USER_PATTERN, BENCH_SCAN_PATTERN))
+        users = cursor.fetchall()
+        if not users:
+            raise click.ClickException("No hay datos de benchmark: ejecuta primero `python benchmark.py seed`.")
+        cursor.execute("""
+            SELECT MIN(check_in_date), MAX(check_in_date), COUNT(*)
+            FROM attendance WHERE user_id = ANY(%s)
+        """, ([user_id for user_id, _ in users],))
+        first_day, last_day, attendance_count = cursor.fetchone()
+        # La caché del servidor recuerda a quien ya registró hoy: solo sirven los que faltan
+        cursor.execute("""
+            SELECT u.qr_code_uuid::TEXT FROM users u
+            WHERE u.username LIKE %s
+              AND NOT EXISTS (SELECT 1 FROM attendance a WHERE a.user_id = u.id AND a.check_in_date = %s)
+            ORDER BY u.id
+        """, (BENCH_SCAN_PATTERN, datetime.date.today()))
+        scan_uuids = [row[0] for row in cursor.fetchall()]
+    finally:
+        db.close()
+
+    months = []
+    month = first_day.replace(day=1)
+    while month <= last_day:
+        months.append((month.year, month.month))
+        month = (month + datetime.timedelta(days=32)).replace(day=1)
+    month_ranges = []
+    for year, month in months:
+        start = datetime.date(year, month, 1)
+        end = (start + datetime.timedelta(days=32)).replace(day=1) - datetime.timedelta(days=1)
+        month_ranges.append((start.isoformat(), end.isoformat()))
+    return {
+        'user_ids': [user_id for user_id, _ in users],
+        'uuids': [qr_uuid for _, qr_uuid in users],
+        'months': months,
+        'month_ranges': month_ranges,
+        'scans': ScanQueue(scan_uuids),
+        'dataset': {
+            'users': len(users),
+            'scan_users_available': len(scan_uuids),
+            'attendance_rows': attendance_count,
+            'first_day': first_day.isoformat() if first_day else None,
+            'last_day': last_day.isoformat() if last_day else None,
+        },
+    }
+
+
+class Client:
+    """Conexión HTTP/1.1 persistente por hilo (se reabre sola si el servidor la cierra)."""
+
+    def __init__(self, base_url, timeout):
+        parsed = urllib.parse.urlsplit(base_url)
+        connection_class = http.client.HTTPSConnection if parsed.scheme == 'https' else http.client.HTTPConnection
+        self.prefix = parsed.path.rstrip('/')
+        self.conn = connection_class(parsed.netloc, timeout=timeout)
+        self.cookie = None
+
+    def request(self, method, path, body=None, headers=None):
+        headers = dict(headers or {})
+        if self.cookie:
+            headers['Cookie'] = self.cookie
+        try:
+            self.conn.request(method, self.prefix + path, body=body, headers=headers)
+            response = self.conn.getresponse()
+            data = response.read()
+        except (http.client.HTTPException, OSError):
+            self.conn.close()
+            raise
+        if response.will_close:
+            self.conn.close()
+        set_cookie = response.getheader('Set-Cookie')
+        if set_cookie:
+            self.cookie = set_cookie.split(';', 1)[0]
+        return response.status, data
+
+    def login(self, username, password):
+        body = urllib.parse.urlencode({'username': username, 'password': password})
+        status, _ = self.request('POST', '/login', body, {'Content-Type': 'application/x-www-form-urlencoded'})
+        if status != 302:
+            raise click.ClickException(f"No se pudo iniciar sesión como {username} (HTTP {status}).")
+        return self.cookie
+
+
+def percentile(sorted_values, p):
+    """Percentil por rango más cercano sobre una lista ya ordenada."""
+    if not sorted_values:
+        return None
+    rank = max(0, min(len(sorted_values) - 1, math.ceil(p / 100 * len(sorted_values)) - 1))
+    return sorted_values[rank]
+
+
+def drive(endpoint, data, base_url, cookie, concurrency, duration, warmup, seed, timeout):
+    """Bucle cerrado: `concurrency` hilos piden sin pausa durante `duration` segundos."""
+    make_path = ENDPOINTS[endpoint]
+    headers = ENDPOINT_HEADERS.get(endpoint)
+    latencies = [[] for _ in range(concurrency)]
+    errors = [0] * concurrency
+    response_bytes = [0] * concurrency
+    started = threading.Barrier(concurrency + 1)
+    window = {}
+
+    def worker(index):
+        rng = random.Random(f'{seed}-{endpoint}-{index}')
+        client = Client(base_url, timeout)
+        client.cookie = cookie
+        started.wait()
+        while True:
+            now = time.perf_counter()
+            if now >= window['end']:
+                return
+            path = make_path(rng, data)
+            try:
+                status, body = client.request('GET', path, headers=headers)
+                ok = status < 400
+            except (http.client.HTTPException, OSError):
+                ok, body = False, b''
+            finished = time.perf_counter()
+            # Solo cuentan las solicitudes que empiezan después del calentamiento
+            if now >= window['measure_from']:
+                latencies[index].append(finished - now)
+                response_bytes[index] += len(body)
+                if not ok:
+                    errors[index] += 1
+
+    threads = [threading.Thread(target=worker, args=(i,), daemon=True) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    begin = time.perf_counter()
+    window['measure_from'] = begin + warmup
+    window['end'] = begin + warmup + duration
+    started.wait()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - window['measure_from']
+
+    samples = sorted(value for thread_latencies in latencies for value in thread_latencies)
+    to_ms = lambda value: round(value * 1000, 3) if value is not None else None
+    return {
+        'requests': len(samples),
+        'errors': sum(errors),
+        'throughput_rps': round(len(samples) / elapsed, 2) if elapsed > 0 else 0.0,
+        'mean_ms': to_ms(sum(samples) / len(samples)) if samples else None,
+        'p50_ms': to_ms(percentile(samples, 50)),
+        'p95_ms': to_ms(percentile(samples, 95)),
+        'p99_ms': to_ms(percentile(samples, 99)),
+        'max_ms': to_ms(samples[-1]) if samples else None,
+        'avg_response_bytes': round(sum(response_bytes) / len(samples)) if samples else 0,
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL, text=True,
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+@cli.command()
+@click.option('--url', 'base_url', default='http://127.0.0.1:5000', show_default=True, help='Servidor a medir.')
+@click.option('--endpoints', default=','.join(ENDPOINTS), show_default=True, help='Rutas a medir, separadas por comas.')
+@click.option('--concurrency', default=16, show_default=True, help='Hilos con solicitudes en vuelo.')
+@click.option('--duration', default=20.0, show_default=True, help='Segundos medidos por ruta.')
+@click.option('--warmup', default=3.0, show_default=True, help='Segundos de calentamiento (no medidos) por ruta.')
+@click.option('--seed', default=42, show_default=True, help='Semilla para elegir usuarios y meses.')
+@click.option('--timeout', default=60.0, show_default=True, help='Timeout por solicitud (s).')
+@click.option('--admin-password', default='benchpass', show_default=True)
+@click.option('--output', type=click.Path(dir_okay=False), help='Archivo JSON de resultados.')
+@click.option('--allow-remote', is_flag=True, help='Permite una base que no sea local.')
+def run(base_url, endpoints, concurrency, duration, warmup, seed, timeout, admin_password, output, allow_remote):
+    """Mide throughput y latencias de cada ruta, una tras otra."""
+    check_local_database(allow_remote)
+    selected = [name.strip() for name in endpoints.split(',') if name.strip()]
+    unknown = [name for name in selected if name not in ENDPOINTS]
+    if unknown:
+        raise click.ClickException(f"Rutas desconocidas: {', '.join(unknown)}. Opciones: {', '.join(ENDPOINTS)}")
+
+    data = load_targets()
+    if any(name in CHECKIN_ENDPOINTS for name in selected) and not len(data['scans']):
+        raise click.ClickException("No quedan usuarios bench_scan_* sin asistencia hoy: vuelve a ejecutar `seed`.")
+    cookie = Client(base_url, timeout).login(BENCH_ADMIN_USERNAME, admin_password)
+
+    results = {}
+    for endpoint in selected:
+        click.echo(f"{endpoint}: {concurrency} concurrentes, {duration:g}s...")
+        repeats_before = data['scans'].repeats
+        results[endpoint] = drive(endpoint, data, base_url, cookie, concurrency, duration, warmup, seed, timeout)
+        summary = results[endpoint]
+        click.echo(f"  {summary['throughput_rps']} req/s  p50={summary['p50_ms']}ms  "
+                   f"p95={summary['p95_ms']}ms  p99={summary['p99_ms']}ms  errores={summary['errors']}")
+        if endpoint in CHECKIN_ENDPOINTS:
+            summary['repeated_scans'] = data['scans'].repeats - repeats_before
+            if summary['repeated_scans']:
+                click.echo(f"  aviso: {summary['repeated_scans']} escaneos repetidos (usa `seed --scan-users` mayor)")
+
+    report = {
+        'meta': {
+            'commit': git_commit(),
+            'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+            'url': base_url,
+            'concurrency': concurrency,
+            'duration_s': duration,
+            'warmup_s': warmup,
+            'seed': seed,
+            'python': platform.python_version(),
+            'dataset': data['dataset'],
+        },
+        'results': results,
+    }
+    if output:
+        with open(output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        click.echo(f"Resultados guardados en {output}")
+    else:
+        json.dump(report, sys.stdout, indent=2, ensure_ascii=False)
+        click.echo()
+
+
+@cli.command()
+@click.argument('baseline', type=click.File('r', encoding='utf-8'))
+@click.argument('candidate', type=click.File('r', encoding='utf-8'))
+def compare(baseline, candidate):
+    """Compara dos resultados de `run` (cambio relativo de throughput y percentiles)."""
+    before, after = json.load(baseline), json.load(candidate)
+    click.echo(f"{before['meta'].get('commit') or '?'} -> {after['meta'].get('commit') or '?'}")
+    for endpoint in after['results']:
+        if endpoint not in before['results']:
+            continue
+        click.echo(endpoint)
+        for key in ('throughput_rps', 'p50_ms', 'p95_ms', 'p99_ms'):
+            old, new = before['results'][endpoint][key], after['results'][endpoint][key]
+            change = f"{(new - old) / old * 100:+.1f}%" if old and new is not None else 'n/a'
+            click.echo(f"  {key:<15} {old!s:>10} -> {new!s:>10}  {change}")
+
+
+if __name__ == '__main__':
+    cli()